@@ -0,0 +1,195 @@
+import argparse
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from artifacts import commit_staged, latest_bundle_path, load_bundle, staged_memmap, write_json_atomic
+from serving_engine import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+IVF_MANIFEST = 'ivf.json'
+IVF_FILES = ('centroids', 'offsets', 'items', 'vectors')
+
+
+def augment(vectors):
+    """Map item vectors onto the unit sphere so inner-product search becomes cosine search.
+
+    Each item x gets an extra coordinate sqrt(M^2 - |x|^2), M being the
+    largest norm, and is divided by M. A query [q, 0] then ranks items by
+    q . x exactly as before, while every item has the same norm.
+    """
+    norms = np.linalg.norm(vectors, axis=1)
+    max_norm = max(float(norms.max()) if len(norms) else 0.0, 1e-12)
+    extra = np.sqrt(np.maximum(max_norm ** 2 - norms ** 2, 0.0))
+    return np.hstack([vectors, extra[:, None]]).astype(np.float32) / max_norm
+
+
+def spherical_kmeans(points, n_clusters, n_iter=10, block_size=4096, random_state=42):
+    """Cluster unit vectors by inner product; returns (centroids, assignment)."""
+    rng = np.random.default_rng(random_state)
+    n_points = points.shape[0]
+    centroids = points[rng.choice(n_points, size=n_clusters, replace=False)].copy()
+    assignment = np.zeros(n_points, dtype=np.int64)
+    for iteration in range(n_iter):
+        for start in range(0, n_points, block_size):
+            assignment[start:start + block_size] = np.argmax(points[start:start + block_size] @ centroids.T, axis=1)
+        members = csr_matrix((np.ones(n_points, dtype=np.float32), (assignment, np.arange(n_points))),
+                             shape=(n_clusters, n_points))
+        sums = np.asarray(members @ points)
+        counts = np.diff(members.indptr)
+        empty = np.flatnonzero(counts == 0)
+        # Reseed empty lists with random points so every list stays in use
+        sums[empty] = points[rng.choice(n_points, size=len(empty), replace=False)]
+        centroids = sums / np.maximum(np.linalg.norm(sums, axis=1, keepdims=True), 1e-12)
+        logger.debug(f"k-means iteration {iteration + 1}: {len(empty)} empty lists reseeded")
+    for start in range(0, n_points, block_size):
+        assignment[start:start + block_size] = np.argmax(points[start:start + block_size] @ centroids.T, axis=1)
+    return centroids.astype(np.float32), assignment
+
+
+class IVFIndex:
+    """Inverted-file index over item factors for approximate maximum-inner-product top-k.
+
+    Items are clustered by a k-means coarse quantiser on the augmented unit
+    sphere. A query probes the ``nprobe`` lists whose centroids score highest
+    and re-ranks only their items, exactly, with the original factors.
+    The item vectors are stored list by list so each probed list is one
+    contiguous slice.
+    """
+
+    def __init__(self, centroids, offsets, items, vectors, manifest=None):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.items = items
+        self.vectors = vectors
+        self.manifest = manifest or {}
+
+    @classmethod
+    def build(cls, item_factors, n_lists=None, n_iter=10, random_state=42, version=None):
+        """Build from factors x items (``svd.components_``); n_lists defaults to 4 * sqrt(n_items)."""
+        start_time = time.time()
+        vectors = np.ascontiguousarray(np.asarray(item_factors, dtype=np.float32).T)
+        n_items = vectors.shape[0]
+        n_lists = min(n_lists or max(int(round(4 * np.sqrt(n_items))), 1), n_items)
+        centroids, assignment = spherical_kmeans(augment(vectors), n_lists, n_iter=n_iter,
+                                                 random_state=random_state)
+        order = np.argsort(assignment, kind='stable')
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+        manifest = {'model_version': version, 'n_items': int(n_items), 'n_lists': int(n_lists),
+                    'n_iter': int(n_iter)}
+        logger.info(f"Built IVF index with {n_lists} lists over {n_items} items in {time.time() - start_time:.1f}s")
+        return cls(centroids, offsets, order.astype(np.int32), vectors[order], manifest)
+
+    @property
+    def n_lists(self):
+        return len(self.offsets) - 1
+
+    @property
+    def version(self):
+        return self.manifest.get('model_version')
+
+    def save(self, directory):
+        """Write the index into directory, which servers may have mapped already (e.g. on ``--rebuild``).
+
+        Each array is staged and renamed over the old file, and the manifest
+        goes last, so a live server's mappings keep the old index intact.
+        """
+        os.makedirs(directory, exist_ok=True)
+        for name in IVF_FILES:
+            array = getattr(self, name)
+            path = os.path.join(directory, f'ivf_{name}.npy')
+            staged = staged_memmap(path, array.dtype, array.shape)
+            staged[:] = array
+            commit_staged(staged, path)
+        write_json_atomic(os.path.join(directory, IVF_MANIFEST), self.manifest)
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, IVF_MANIFEST)) as f:
+            manifest = json.load(f)
+        arrays = [np.load(os.path.join(directory, f'ivf_{name}.npy'), mmap_mode=mmap_mode) for name in IVF_FILES]
+        return cls(*arrays, manifest=manifest)
+
+    def probe(self, queries, nprobe):
+        """The nprobe best list numbers for each query, shape (n_queries, nprobe)."""
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        return top_k_indices(queries @ self.centroids[:, :-1].T, nprobe)
+
+    def candidates(self, lists):
+        """Item columns and stacked item vectors of the given lists."""
+        spans = [(self.offsets[j], self.offsets[j + 1]) for j in lists.tolist()]
+        cols = np.concatenate([self.items[lo:hi] for lo, hi in spans])
+        vectors = np.concatenate([self.vectors[lo:hi] for lo, hi in spans])
+        return cols, vectors
+
+    def search(self, queries, k, nprobe=32, exclude=None):
+        """Approximate top-k item columns and exact scores per query, best first, -inf padded.
+
+        ``exclude`` is an optional list of per-query item-column arrays that
+        must not be returned (e.g. already-rated items).
+        """
+        queries = np.atleast_2d(np.asarray(queries, dtype=np.float32))
+        probed = self.probe(queries, nprobe)
+        top = np.zeros((len(queries), k), dtype=np.int64)
+        top_scores = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        for i, query in enumerate(queries):
+            cols, vectors = self.candidates(probed[i])
+            scores = vectors @ query
+            if exclude is not None and len(exclude[i]):
+                scores[np.isin(cols, exclude[i])] = -np.inf
+            best = top_k_indices(scores, k)[0]
+            top[i, :len(best)] = cols[best]
+            top_scores[i, :len(best)] = scores[best]
+        return top, top_scores
+
+
+def recall_at_k(index, user_factors, item_factors, k=10, nprobe=32, n_queries=1000, random_state=42):
+    """Mean recall@k of IVF search against exact search on a sample of users, plus mean latency in ms."""
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(len(user_factors), size=min(n_queries, len(user_factors)), replace=False))
+    queries = np.asarray(user_factors[rows], dtype=np.float32)
+    exact = top_k_indices(queries @ np.asarray(item_factors, dtype=np.float32), k)
+    start = time.time()
+    approximate, _ = index.search(queries, k, nprobe=nprobe)
+    latency_ms = (time.time() - start) / len(rows) * 1000
+    hits = sum(len(np.intersect1d(a, e)) for a, e in zip(approximate, exact))
+    return {'recall': hits / (len(rows) * exact.shape[1]), 'latency_ms': latency_ms, 'nprobe': nprobe}
+
+
+def has_ivf(directory):
+    return os.path.exists(os.path.join(directory, IVF_MANIFEST))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Build an IVF index for a bundle and report recall@k vs nprobe")
+    parser.add_argument('--artifact-root', default='artifacts')
+    parser.add_argument('--bundle', default=None, help="Bundle directory (default: the LATEST bundle)")
+    parser.add_argument('--lists', type=int, default=None, help="Number of inverted lists (default: 4 * sqrt(n_items))")
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild even if the bundle already has an index")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[4, 8, 16, 32, 64])
+    parser.add_argument('--queries', type=int, default=1000)
+    args = parser.parse_args()
+
+    bundle_path = args.bundle or latest_bundle_path(args.artifact_root)
+    if bundle_path is None:
+        raise SystemExit(f"No artifact bundle under {args.artifact_root}")
+    bundle = load_bundle(bundle_path)
+    if args.rebuild or not has_ivf(bundle_path):
+        IVFIndex.build(bundle.item_factors, n_lists=args.lists, version=bundle.version).save(bundle_path)
+    index = IVFIndex.load(bundle_path)
+    for nprobe in args.nprobe:
+        result = recall_at_k(index, bundle.user_factors, bundle.item_factors, k=args.k, nprobe=nprobe,
+                             n_queries=args.queries)
+        logger.info(f"nprobe={nprobe}: recall@{args.k} {result['recall']:.3f}, {result['latency_ms']:.2f} ms/query")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,67 +1,261 @@
+import asyncio
+from contextlib import asynccontextmanager
+from typing import List, Optional
 from fastapi import FastAPI, HTTPException
+from fastapi.responses import JSONResponse, PlainTextResponse
+from pydantic import BaseModel, Field
 import numpy as np
 from scipy.sparse import load_npz
 import joblib
-import boto3
-import pandas as pd
-from decimal import Decimal
 import logging
+import os
 import time
+from batching import MicroBatcher
+from item_neighbours import similar_items
+from metrics import MetricsMiddleware, MetricsRegistry
+from model_manager import ModelManager, ServingState, load_state, make_source
+from prediction_logging import PredictionLogger, TeeSink, make_sink
+from recommendation_cache import RecommendationCache, make_cache_backend
+from rollups import RollupSink, RollupStore
+from serving_engine import RecommenderEngine
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
-app = FastAPI()
-
+artifact_root = os.getenv('ARTIFACT_ROOT', 'artifacts')
 model_path = 'model.pkl'
 matrix_npz_path = 'user_item_matrix.npz'
 index_path = 'user_item_indices.npy'
 columns_path = 'user_item_columns.npy'
 
-try:
-    model = joblib.load(model_path)
-    matrix = load_npz(matrix_npz_path)
-    indices = np.load(index_path, allow_pickle=True)
-    columns = np.load(columns_path, allow_pickle=True)
-    user_item_matrix = pd.DataFrame.sparse.from_spmatrix(matrix, index=indices, columns=columns)
-    logger.info("Model and matrix loaded successfully")
-except Exception as e:
-    logger.error(f"Loading failed: {e}")
-    raise HTTPException(status_code=500, detail=f"Model/matrix loading error: {e}")
+# Request counts/latency and per-stage timings (lookup, transform, score, topk, persist, serialise) for /metrics
+metrics = MetricsRegistry()
+metrics.describe('serving_stage_seconds', 'histogram', 'Time spent in each stage of serving a recommendation.')
+
+
+def load_serving_state(path):
+    """Build the ServingState for a bundle directory, or from the legacy model/matrix files if path is None."""
+    if path is None:
+        logger.info(f"No artifact bundle under {artifact_root}, loading {model_path} and matrix files")
+        model = joblib.load(model_path)
+        matrix = load_npz(matrix_npz_path)
+        indices = np.load(index_path, allow_pickle=True)
+        columns = np.load(columns_path, allow_pickle=True)
+        state = ServingState(RecommenderEngine.from_model(model, matrix, indices, columns))
+        state.fold_in.load()
+    else:
+        # Memory-mapped bundle: near-instant load, one page-cache copy shared by all workers
+        state = load_state(path, retrieval=os.getenv('RETRIEVAL', 'exact'), nprobe=int(os.getenv('ANN_NPROBE', '32')),
+                           quantization=os.getenv('SERVING_QUANTIZATION', 'none'),
+                           shortlist=int(os.getenv('QUANT_SHORTLIST', '100')))
+    logger.info(f"Model and matrix loaded successfully ({state.engine.n_users} users, {state.engine.n_items} items)")
+    return state
+
+
+def on_model_swap(previous, state):
+    # Instrument only once warm-up is done, so its scoring does not show up in the serving stages
+    state.engine.instrument(metrics.stage_timer)
+    # Results of the old version can never be read again under the new version key; this runs on a worker
+    # thread, so clear() hands the work to the event loop that owns the cache
+    recommendation_cache.clear()
+
+
+# The served model lives in a ServingState owned by the manager; new versions are loaded, warmed and swapped in
+# by a background poll, and a failed load leaves the app up but not ready instead of crashing it
+model_manager = ModelManager(
+    make_source(os.getenv('MODEL_SOURCE', 'artifacts'), artifact_root,
+                model_name=os.getenv('MODEL_NAME', 'BookRecommenderModel'),
+                tracking_uri=os.getenv('MLFLOW_TRACKING_URI'), stage=os.getenv('MODEL_STAGE')),
+    load_serving_state,
+    poll_interval=float(os.getenv('MODEL_POLL_SECONDS', '30')),
+    on_swap=on_model_swap
+)
+store_hits = {"count": 0}
+
+# Repeat /predict calls for the same user are served from an LRU/TTL cache keyed by model version
+recommendation_cache = RecommendationCache(
+    max_entries=int(os.getenv('REC_CACHE_MAX_ENTRIES', '10000')),
+    ttl=float(os.getenv('REC_CACHE_TTL_SECONDS', '300')),
+    backend=make_cache_backend(os.getenv('REC_CACHE_BACKEND', 'none'), os.getenv('REC_CACHE_URL'))
+)
+
+model_manager.check()
+
+# New ratings are folded into the served factors in place; each worker compacts its delta next to the artifacts
+# and replays the other workers' deltas on the same interval
+compact_interval = float(os.getenv('FOLD_IN_COMPACT_SECONDS', '300'))
+
+# Prediction records are written behind the request by a background task, never inline
+# Every logged batch is also folded into per-minute/per-hour rollups (rollups.py) that the dashboard reads
+prediction_sink = make_sink(os.getenv('PREDICTION_LOG_SINK', 'dynamodb'), os.getenv('PREDICTION_LOG_PATH'))
+rollup_db = os.getenv('ROLLUP_DB', 'rollups.db')
+if rollup_db != 'none':
+    prediction_sink = TeeSink(prediction_sink, [RollupSink(RollupStore(rollup_db))])
+prediction_logger = PredictionLogger(
+    prediction_sink,
+    max_queue=int(os.getenv('PREDICTION_LOG_MAX_QUEUE', '10000')),
+    flush_interval=float(os.getenv('PREDICTION_LOG_FLUSH_SECONDS', '1')),
+    overflow=os.getenv('PREDICTION_LOG_OVERFLOW', 'spill'),
+    spill_path=os.getenv('PREDICTION_LOG_SPILL_PATH', 'prediction_spill.jsonl'),
+    stage_timer=metrics.stage_timer
+)
+
+# Concurrent /predict calls arriving within max_wait_ms are scored as one matrix product
+max_batch_size = int(os.getenv('PREDICT_MAX_BATCH_SIZE', '64'))
+max_wait_ms = float(os.getenv('PREDICT_MAX_WAIT_MS', '2'))
+# /predict/batch: bigger requests are rejected, accepted ones are scored off the loop in chunks of max_batch_size
+max_batch_users = int(os.getenv('PREDICT_BATCH_MAX_USERS', '1000'))
+
+
+def score_predict_batch(requests):
+    """Score a batch of (state, user_id, k, exclude_rated) requests with one product per state/exclude_rated group.
+
+    Each request carries the ServingState it started on, so a batch that
+    straddles a model swap still scores every request with its own version.
+    """
+    results = [None] * len(requests)
+    groups = {}
+    with metrics.stage_timer('lookup'):
+        for pos, (state, user_id, k, exclude_rated) in enumerate(requests):
+            row = state.engine.user_index.get(user_id)
+            if row is None:
+                results[pos] = KeyError(user_id)
+            else:
+                groups.setdefault((state, exclude_rated), []).append((pos, row, k))
+    for (state, exclude_rated), members in groups.items():
+        max_k = max(k for _, _, k in members)
+        scored = state.engine.recommend_rows([row for _, row, _ in members], k=max_k, exclude_rated=exclude_rated)
+        for (pos, _, k), (books, scores) in zip(members, scored):
+            results[pos] = (books[:k], scores[:k])
+    return results
+
+
+def precomputed_recommendations(state, user_id, k, exclude_rated):
+    """(items, scores) from the precomputed store, or None if the request needs scoring."""
+    store, engine = state.store, state.engine
+    if store is None or k > store.k or exclude_rated != store.exclude_rated:
+        return None
+    with metrics.stage_timer('lookup'):
+        row = engine.user_index.get(user_id)
+        # Users folded in since the store was built have new factors and must be scored
+        if row is None or row >= len(store) or row in engine.overlay_rows:
+            return None
+        cols, scores = store.lookup(row, k)
+        store_hits["count"] += 1
+        return engine.item_ids[cols].tolist(), scores.tolist()
+
+
+def serving_state():
+    """The state to serve this request with, read once; 503 until a model has been loaded."""
+    state = model_manager.current
+    if state is None:
+        raise HTTPException(status_code=503, detail="Model not loaded")
+    return state
+
+
+batcher = MicroBatcher(score_predict_batch, max_batch_size=max_batch_size, max_wait_ms=max_wait_ms)
+
+
+async def compact_periodically():
+    loop = asyncio.get_running_loop()
+    while True:
+        await asyncio.sleep(compact_interval)
+        state = model_manager.current
+        if state is None:
+            continue
+        try:
+            if state.fold_in.dirty:
+                await loop.run_in_executor(None, state.fold_in.compact)
+            # Pick up ratings that were posted to the other workers
+            if await loop.run_in_executor(None, state.fold_in.sync):
+                recommendation_cache.clear()
+        except Exception as e:
+            logger.error(f"Fold-in compaction failed: {e}")
+
+
+@asynccontextmanager
+async def lifespan(app):
+    batcher.start()
+    prediction_logger.start()
+    compactor = asyncio.create_task(compact_periodically())
+    watcher = asyncio.create_task(model_manager.watch()) if model_manager.poll_interval > 0 else None
+    yield
+    if watcher is not None:
+        watcher.cancel()
+    compactor.cancel()
+    await batcher.stop()
+    await prediction_logger.stop()
+    state = model_manager.current
+    if state is not None and state.fold_in.dirty:
+        state.fold_in.compact()
+
+
+app = FastAPI(lifespan=lifespan)
+# PROFILE_DIR switches on per-request sampling profiles for requests sent with an X-Profile: 1 header
+app.add_middleware(MetricsMiddleware, registry=metrics, profile_dir=os.getenv('PROFILE_DIR'))
+metrics.callback('predict_batcher_queue_depth', 'gauge', 'Requests waiting for the micro-batcher.',
+                 lambda: batcher.queue_depth)
+metrics.callback('prediction_log_queue_depth', 'gauge', 'Prediction records waiting to be written.',
+                 lambda: prediction_logger.queue_depth)
+metrics.callback('prediction_log_records_total', 'counter', 'Prediction records by outcome.',
+                 lambda: {(('outcome', outcome),): prediction_logger.stats()[outcome]
+                          for outcome in ('written', 'spilled', 'dropped')})
+metrics.callback('recommendation_cache_events_total', 'counter', 'Recommendation cache lookups by outcome.',
+                 lambda: {(('event', event),): recommendation_cache.stats()[event]
+                          for event in ('hits', 'misses', 'backend_hits', 'coalesced', 'evictions')})
+metrics.callback('recommendation_cache_entries', 'gauge', 'Entries in the local recommendation cache.',
+                 lambda: len(recommendation_cache))
+metrics.callback('recommendation_store_hits_total', 'counter', 'Requests answered from the precomputed store.',
+                 lambda: store_hits["count"])
+metrics.callback('model_info', 'gauge', 'The model version being served.',
+                 lambda: {(('version', model_manager.current.version),): 1} if model_manager.ready else None)
+metrics.callback('model_swaps_total', 'counter', 'Model versions swapped in since startup.',
+                 lambda: model_manager.stats()['swaps'])
+
+
+class BatchPredictRequest(BaseModel):
+    user_ids: List[str]
+    k: int = 5
+    exclude_rated: bool = False
+
+
+class Rating(BaseModel):
+    user_id: str
+    parent_asin: str
+    rating: float = Field(gt=0, le=5)
+    timestamp: Optional[int] = None
+
+
+class RatingsRequest(BaseModel):
+    ratings: List[Rating]
 
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-table = dynamodb.Table('BookRecommendations')
+
+def log_predictions(user_id, top_books, top_scores, latency):
+    timestamp = int(time.time())
+    for book_id, predicted_rating in zip(top_books, top_scores):
+        prediction_logger.log(user_id, book_id, predicted_rating, latency, timestamp=timestamp)
 
 
 @app.post("/predict")
-async def predict(user_id: str):
+async def predict(user_id: str, k: int = 5, exclude_rated: bool = False):
+    state = serving_state()
     try:
         logger.info(f"Received request for user_id: {user_id}")
         start_time = time.time()
 
-        if user_id not in user_item_matrix.index:
-            raise KeyError("User not found")
-        user_idx = user_item_matrix.index.get_loc(user_id)
-        user_factors = model.transform(user_item_matrix.values[[user_idx]])
-        predicted_ratings = np.dot(user_factors, model.components_)[0]
-        if np.any(np.isnan(predicted_ratings)) or np.any(np.isinf(predicted_ratings)):
-            predicted_ratings = np.nan_to_num(predicted_ratings, nan=0.0, posinf=0.0, neginf=0.0)
-        top_books = user_item_matrix.columns[np.argsort(predicted_ratings)[-5:]].tolist()
-
-        latency = Decimal(str(time.time() - start_time))
-        for book_id in top_books:
-            predicted_rating_idx = user_item_matrix.columns.get_loc(book_id)
-            predicted_rating_value = predicted_ratings[predicted_rating_idx]
-            predicted_rating = Decimal(str(predicted_rating_value))
-            table.put_item(Item={
-                'user_id': user_id,
-                'item_id': book_id,
-                'predicted_rating': predicted_rating,
-                'timestamp': int(time.time()),
-                'latency': latency
-            })
-
-        return {"user_id": user_id, "recommended_books": top_books}
+        recommended = precomputed_recommendations(state, user_id, k, exclude_rated)
+        if recommended is None:
+            recommended = await recommendation_cache.get_or_compute(
+                state.version, user_id, k, exclude_rated,
+                lambda: batcher.submit((state, user_id, k, exclude_rated)),
+                revision=state.fold_in.revision(user_id)
+            )
+        top_books, top_scores = recommended
+
+        log_predictions(user_id, top_books, top_scores, time.time() - start_time)
+
+        with metrics.stage_timer('serialise'):
+            return JSONResponse({"user_id": user_id, "recommended_books": top_books})
     except KeyError:
         raise HTTPException(status_code=404, detail="User not found")
     except Exception as e:
@@ -69,6 +263,127 @@ async def predict(user_id: str):
         raise HTTPException(status_code=500, detail=f"Prediction error: {e}")
 
 
+@app.post("/predict/batch")
+async def predict_batch(request: BatchPredictRequest):
+    if len(request.user_ids) > max_batch_users:
+        raise HTTPException(status_code=413, detail=f"At most {max_batch_users} user_ids per batch request")
+    state = serving_state()
+    engine = state.engine
+    loop = asyncio.get_running_loop()
+    try:
+        logger.info(f"Received batch request for {len(request.user_ids)} users")
+        start_time = time.time()
+
+        known = [user_id for user_id in request.user_ids if user_id in engine.user_index]
+        recommended = {user_id: precomputed_recommendations(state, user_id, request.k, request.exclude_rated)
+                       for user_id in known}
+        missing = [user_id for user_id in known if recommended[user_id] is None]
+        rows = [engine.user_index[user_id] for user_id in missing]
+        scored = []
+        for start in range(0, len(rows), max_batch_size):
+            # Each chunk is one bounded (chunk x items) product in a worker thread, so other requests keep flowing
+            scored.extend(await loop.run_in_executor(None, engine.recommend_rows, rows[start:start + max_batch_size],
+                                                     request.k, request.exclude_rated))
+        recommended.update(zip(missing, scored))
+
+        latency = time.time() - start_time
+        results = []
+        for user_id in known:
+            top_books, top_scores = recommended[user_id]
+            log_predictions(user_id, top_books, top_scores, latency)
+            results.append({"user_id": user_id, "recommended_books": top_books})
+        not_found = [user_id for user_id in request.user_ids if user_id not in engine.user_index]
+        with metrics.stage_timer('serialise'):
+            return JSONResponse({"results": results, "not_found": not_found})
+    except Exception as e:
+        logger.error(f"Batch prediction error: {e}")
+        raise HTTPException(status_code=500, detail=f"Prediction error: {e}")
+
+
+@app.get("/similar/{parent_asin}")
+async def similar(parent_asin: str, k: int = 10):
+    state = serving_state()
+    engine, neighbour_index = state.engine, state.neighbours
+    col = engine.item_index.get(parent_asin)
+    if col is None:
+        raise HTTPException(status_code=404, detail="Book not found")
+    if k <= 0:
+        raise HTTPException(status_code=422, detail="k must be positive")
+    if neighbour_index is not None:
+        # Capped at the table width, like the catalogue caps the on-demand search
+        cols, scores = neighbour_index.lookup(col, min(k, neighbour_index.k))
+    else:
+        top, top_scores = similar_items(state.item_vectors, [col], k)
+        cols, scores = top[0], top_scores[0]
+    return {"parent_asin": parent_asin, "similar_books": engine.item_ids[cols].tolist(),
+            "scores": scores.tolist()}
+
+
+@app.get("/users")
+async def users(prefix: str = "", limit: int = 20, cursor: Optional[str] = None):
+    if not 1 <= limit <= 100:
+        raise HTTPException(status_code=422, detail="limit must be between 1 and 100")
+    state = serving_state()
+    user_ids, next_cursor = state.user_search.search(prefix, limit=limit, cursor=cursor,
+                                                     extra=state.engine.new_user_ids)
+    return {"user_ids": user_ids, "next_cursor": next_cursor}
+
+
+@app.post("/ratings")
+async def add_ratings(request: RatingsRequest):
+    state = serving_state()
+    ratings = [(r.user_id, r.parent_asin, r.rating, r.timestamp) for r in request.ratings]
+    loop = asyncio.get_running_loop()
+    try:
+        summary = await loop.run_in_executor(None, state.fold_in.add_ratings, ratings)
+        if model_manager.current is not state:
+            # A new model was swapped in meanwhile; make sure these ratings reach it too
+            await loop.run_in_executor(None, model_manager.current.fold_in.add_ratings, ratings)
+    except Exception as e:
+        logger.error(f"Fold-in error: {e}")
+        raise HTTPException(status_code=500, detail=f"Fold-in error: {e}")
+    for user_id in {r.user_id for r in request.ratings}:
+        await recommendation_cache.invalidate_user(user_id, version=model_manager.current.version)
+    logger.info(f"Folded in {summary['accepted']} ratings for {summary['updated_users']} users")
+    return summary
+
+
+@app.get("/ratings/stats")
+async def ratings_stats():
+    return serving_state().fold_in.stats()
+
+
+@app.get("/predict/stats")
+async def predict_stats():
+    return {**batcher.stats(), "store_hits": store_hits["count"]}
+
+
+@app.get("/cache/stats")
+async def cache_stats():
+    return recommendation_cache.stats()
+
+
+@app.get("/logging/stats")
+async def logging_stats():
+    return prediction_logger.stats()
+
+
+@app.get("/model/stats")
+async def model_stats():
+    return model_manager.stats()
+
+
+@app.get("/metrics")
+async def prometheus_metrics():
+    return PlainTextResponse(metrics.render(), media_type='text/plain; version=0.0.4')
+
+
 @app.get("/health")
 async def health():
     return {"status": "healthy"}
+
+
+@app.get("/ready")
+async def ready():
+    state = serving_state()
+    return {"status": "ready", "version": state.version}
@@ -0,0 +1,183 @@
+import json
+import logging
+import os
+import time
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+logger = logging.getLogger(__name__)
+
+FORMAT_VERSION = 1
+MANIFEST = 'manifest.json'
+LATEST = 'LATEST'
+
+
+class StringTable:
+    """Compact, memory-mappable table of strings stored as UTF-8 bytes plus int64 offsets."""
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_strings(cls, strings):
+        encoded = [str(s).encode('utf-8') for s in strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in encoded], out=offsets[1:])
+        data = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return cls(offsets, data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i]:self.offsets[i + 1]]).decode('utf-8')
+
+    def tolist(self):
+        raw = bytes(self.data)
+        offsets = self.offsets.tolist()
+        return [raw[offsets[i]:offsets[i + 1]].decode('utf-8') for i in range(len(offsets) - 1)]
+
+    def save(self, directory, name):
+        np.save(os.path.join(directory, f'{name}_offsets.npy'), self.offsets)
+        np.save(os.path.join(directory, f'{name}_bytes.npy'), self.data)
+
+    @classmethod
+    def load(cls, directory, name, mmap_mode='r'):
+        offsets = np.load(os.path.join(directory, f'{name}_offsets.npy'), mmap_mode=mmap_mode)
+        data = np.load(os.path.join(directory, f'{name}_bytes.npy'), mmap_mode=mmap_mode)
+        return cls(offsets, data)
+
+
+class ArtifactBundle:
+    """A loaded artifact directory: manifest, factor matrices, CSR ratings and ID tables."""
+
+    def __init__(self, path, manifest, arrays, user_ids, item_ids):
+        self.path = path
+        self.manifest = manifest
+        self.arrays = arrays
+        self.user_ids = user_ids
+        self.item_ids = item_ids
+
+    @property
+    def version(self):
+        return self.manifest['version']
+
+    @property
+    def user_factors(self):
+        return self.arrays['user_factors']
+
+    @property
+    def item_factors(self):
+        return self.arrays['item_factors']
+
+    @property
+    def matrix(self):
+        shape = (self.manifest['n_users'], self.manifest['n_items'])
+        return csr_matrix((self.arrays['matrix_data'], self.arrays['matrix_indices'], self.arrays['matrix_indptr']),
+                          shape=shape, copy=False)
+
+
+def new_version():
+    return time.strftime('%Y%m%d-%H%M%S')
+
+
+def save_bundle(root, user_factors, item_factors, matrix, user_ids, item_ids, version=None, extra=None,
+                publish=True):
+    """Write a versioned artifact directory under root and point root/LATEST at it.
+
+    With publish=False LATEST is left alone, so files can still be added to
+    the bundle before ``set_latest`` makes it visible to running servers.
+    """
+    version = version or new_version()
+    path = os.path.join(root, version)
+    os.makedirs(path, exist_ok=True)
+    matrix = csr_matrix(matrix)
+    matrix.sort_indices()
+    arrays = {
+        'user_factors': np.ascontiguousarray(user_factors, dtype=np.float32),
+        'item_factors': np.ascontiguousarray(item_factors, dtype=np.float32),
+        'matrix_data': matrix.data.astype(np.float32),
+        'matrix_indices': matrix.indices.astype(np.int32),
+        'matrix_indptr': matrix.indptr.astype(np.int64)
+    }
+    files = {}
+    for name, array in arrays.items():
+        np.save(os.path.join(path, f'{name}.npy'), array)
+        files[name] = {'file': f'{name}.npy', 'dtype': str(array.dtype), 'shape': list(array.shape)}
+    for name, strings in (('user_ids', user_ids), ('item_ids', item_ids)):
+        strings = [str(value) for value in strings]
+        StringTable.from_strings(strings).save(path, name)
+        # Sorted tables can be searched with bisect straight from the memory map (see user_search.py)
+        files[name] = {'file': [f'{name}_offsets.npy', f'{name}_bytes.npy'], 'count': len(strings),
+                       'sorted': all(a <= b for a, b in zip(strings, strings[1:]))}
+    manifest = {
+        'format_version': FORMAT_VERSION,
+        'version': version,
+        'created': int(time.time()),
+        'n_users': int(matrix.shape[0]),
+        'n_items': int(matrix.shape[1]),
+        'n_factors': int(arrays['item_factors'].shape[0]),
+        'files': files
+    }
+    manifest.update(extra or {})
+    with open(os.path.join(path, MANIFEST), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    if publish:
+        set_latest(root, version)
+    logger.info(f"Saved artifact bundle {version} to {path}")
+    return path
+
+
+def set_latest(root, version):
+    tmp = os.path.join(root, f'.{LATEST}.tmp')
+    with open(tmp, 'w') as f:
+        f.write(version)
+    os.replace(tmp, os.path.join(root, LATEST))
+
+
+def staged_memmap(path, dtype, shape):
+    """Writable .npy memmap under a temporary name next to path, for files added to a possibly live bundle.
+
+    Servers may have path itself memory-mapped, so it is never written in
+    place; ``commit_staged`` moves the finished file over it in one rename.
+    """
+    return np.lib.format.open_memmap(f'{path}.tmp', mode='w+', dtype=dtype, shape=shape)
+
+
+def commit_staged(array, path):
+    array.flush()
+    os.replace(f'{path}.tmp', path)
+
+
+def write_json_atomic(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp, path)
+
+
+def latest_bundle_path(root):
+    """Return the directory named by root/LATEST, or None if there is no bundle."""
+    try:
+        with open(os.path.join(root, LATEST)) as f:
+            return os.path.join(root, f.read().strip())
+    except FileNotFoundError:
+        return None
+
+
+def load_bundle(path, mmap_mode='r'):
+    """Open an artifact directory; arrays are memory-mapped so workers share one page-cache copy."""
+    with open(os.path.join(path, MANIFEST)) as f:
+        manifest = json.load(f)
+    if manifest.get('format_version') != FORMAT_VERSION:
+        raise ValueError(f"Unsupported artifact format {manifest.get('format_version')} in {path}")
+    arrays = {}
+    for name, entry in manifest['files'].items():
+        if name in ('user_ids', 'item_ids'):
+            continue
+        arrays[name] = np.load(os.path.join(path, entry['file']), mmap_mode=mmap_mode)
+    user_ids = StringTable.load(path, 'user_ids', mmap_mode=mmap_mode)
+    item_ids = StringTable.load(path, 'item_ids', mmap_mode=mmap_mode)
+    return ArtifactBundle(path, manifest, arrays, user_ids, item_ids)
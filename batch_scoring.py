@@ -0,0 +1,176 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from artifacts import commit_staged, latest_bundle_path, load_bundle, staged_memmap, write_json_atomic
+from serving_engine import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+STORE_MANIFEST = 'recommendations.json'
+ITEMS_FILE = 'recommendations_items.npy'
+SCORES_FILE = 'recommendations_scores.npy'
+
+# Factors shared with pool workers once via the initializer instead of per task
+_shared = {}
+
+
+def _init_worker(user_factors, item_factors, rated, k, exclude_rated):
+    _shared.update(user_factors=user_factors, item_factors=np.ascontiguousarray(item_factors, dtype=np.float32),
+                   rated=rated, k=k, exclude_rated=exclude_rated)
+
+
+def _score_block(bounds):
+    """Top-k item columns (int32, -1 padded) and scores (float32, -inf padded) for users [start, end)."""
+    start, end = bounds
+    scores = np.asarray(_shared['user_factors'][start:end], dtype=np.float32) @ _shared['item_factors']
+    if not np.isfinite(scores).all():
+        scores = np.nan_to_num(scores, nan=0.0, posinf=0.0, neginf=0.0)
+    if _shared['exclude_rated']:
+        rated = _shared['rated'][start:end]
+        rows = np.repeat(np.arange(end - start), np.diff(rated.indptr))
+        scores[rows, rated.indices] = -np.inf
+    top = top_k_indices(scores, _shared['k'])
+    top_scores = np.take_along_axis(scores, top, axis=1)
+    top = top.astype(np.int32)
+    top[~np.isfinite(top_scores)] = -1
+    return start, end, top, top_scores.astype(np.float32)
+
+
+def score_all(user_factors, item_factors, output_dir, rated=None, k=10, exclude_rated=False, block_size=2048,
+              n_jobs=1, version=None):
+    """Score every user against the full catalogue in blocks and write the top-k to a binary store.
+
+    ``item_factors`` is factors x items as in ``svd.components_``. The store is
+    an int32 item-column array and a float32 score array, both (n_users, k)
+    and row-aligned with the user factors, plus a manifest written last.
+    """
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    n_users, n_items = user_factors.shape[0], item_factors.shape[1]
+    k = min(k, n_items)
+    if exclude_rated:
+        rated = csr_matrix(rated)
+    items = staged_memmap(os.path.join(output_dir, ITEMS_FILE), np.int32, (n_users, k))
+    scores = staged_memmap(os.path.join(output_dir, SCORES_FILE), np.float32, (n_users, k))
+    blocks = [(start, min(start + block_size, n_users)) for start in range(0, n_users, block_size)]
+    args = (user_factors, item_factors, rated, k, exclude_rated)
+
+    def write(start, end, top, top_scores):
+        items[start:end] = top
+        scores[start:end] = top_scores
+
+    if n_jobs == 1 or len(blocks) <= 1:
+        _init_worker(*args)
+        for bounds in blocks:
+            write(*_score_block(bounds))
+        _shared.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=args) as pool:
+            for result in pool.map(_score_block, blocks):
+                write(*result)
+    # Arrays first, manifest last: servers that mapped the old files keep reading them until they reload
+    commit_staged(items, os.path.join(output_dir, ITEMS_FILE))
+    commit_staged(scores, os.path.join(output_dir, SCORES_FILE))
+    manifest = {
+        'model_version': version,
+        'created': int(time.time()),
+        'n_users': int(n_users),
+        'n_items': int(n_items),
+        'k': int(k),
+        'exclude_rated': bool(exclude_rated),
+        'files': {'items': ITEMS_FILE, 'scores': SCORES_FILE}
+    }
+    write_json_atomic(os.path.join(output_dir, STORE_MANIFEST), manifest)
+    logger.info(f"Scored {n_users} users x {n_items} items (top {k}) into {output_dir} in "
+                f"{time.time() - start_time:.1f}s")
+    return manifest
+
+
+class RecommendationStore:
+    """Memory-mapped top-k recommendations written by score_all; a lookup is two array slices."""
+
+    def __init__(self, manifest, items, scores):
+        self.manifest = manifest
+        self.items = items
+        self.scores = scores
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, STORE_MANIFEST)) as f:
+            manifest = json.load(f)
+        items = np.load(os.path.join(directory, manifest['files']['items']), mmap_mode=mmap_mode)
+        scores = np.load(os.path.join(directory, manifest['files']['scores']), mmap_mode=mmap_mode)
+        return cls(manifest, items, scores)
+
+    @property
+    def version(self):
+        return self.manifest['model_version']
+
+    @property
+    def k(self):
+        return self.manifest['k']
+
+    @property
+    def exclude_rated(self):
+        return self.manifest['exclude_rated']
+
+    def __len__(self):
+        return self.items.shape[0]
+
+    def lookup(self, row, k):
+        """Item columns and scores of the top-k for a user row, best first, without padding."""
+        cols = self.items[row, :k]
+        keep = cols >= 0
+        return cols[keep], self.scores[row, :k][keep]
+
+
+def has_store(directory):
+    return os.path.exists(os.path.join(directory, STORE_MANIFEST))
+
+
+def export_json(store, user_ids, item_ids, path, k=5):
+    """Write {user_id: [item_id, ...]} for every user, as all_recommendations.json used to hold."""
+    item_ids = np.asarray(item_ids, dtype=object)
+    recommendations = {}
+    for row, user_id in enumerate(user_ids):
+        cols, _ = store.lookup(row, k)
+        recommendations[user_id] = item_ids[cols].tolist()
+    with open(path, 'w') as f:
+        json.dump(recommendations, f, separators=(',', ':'))
+    return len(recommendations)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Precompute top-k recommendations for every user of a bundle")
+    parser.add_argument('--artifact-root', default='artifacts')
+    parser.add_argument('--bundle', default=None, help="Bundle directory (default: the LATEST bundle)")
+    parser.add_argument('-k', type=int, default=10)
+    parser.add_argument('--exclude-rated', action='store_true')
+    parser.add_argument('--block-size', type=int, default=2048)
+    parser.add_argument('--jobs', type=int, default=1)
+    parser.add_argument('--json', default=None, help="Also export the top 5 per user to this JSON file")
+    args = parser.parse_args()
+
+    bundle_path = args.bundle or latest_bundle_path(args.artifact_root)
+    if bundle_path is None:
+        raise SystemExit(f"No artifact bundle under {args.artifact_root}")
+    bundle = load_bundle(bundle_path)
+    score_all(bundle.user_factors, bundle.item_factors, bundle_path, rated=bundle.matrix, k=args.k,
+              exclude_rated=args.exclude_rated, block_size=args.block_size, n_jobs=args.jobs,
+              version=bundle.version)
+    if args.json:
+        export_json(RecommendationStore.load(bundle_path), bundle.user_ids.tolist(), bundle.item_ids.tolist(),
+                    args.json)
+        logger.info(f"Exported recommendations to {args.json}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import time
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from artifacts import new_version, save_bundle, set_latest
+from batch_scoring import score_all
+from evaluation import evaluate
+from matrix_builder import build_user_item_matrix, dedupe_latest
+from trainers import bundle_metadata, make_trainer
+
+logger = logging.getLogger(__name__)
+
+SCALES = {'100k': 100_000, '1m': 1_000_000, '10m': 10_000_000}
+# Metrics where larger is better; every other number in the results is a duration
+HIGHER_IS_BETTER = ('rps',)
+
+
+def synthetic_ratings(n_interactions, n_users=None, n_items=None, duplicate_rate=0.05, random_state=42):
+    """Ratings with Amazon-like skew: Zipf-ish user activity and item popularity, some re-rated pairs.
+
+    IDs are categorical so 10M rows stay cheap to build; every column has the
+    dtype ``load_ratings`` in train_model.py reads from the production parquet,
+    timestamps included (datetime64, not int milliseconds).
+    """
+    rng = np.random.default_rng(random_state)
+    n_users = n_users or max(n_interactions // 15, 10)
+    n_items = n_items or max(n_interactions // 40, 10)
+
+    def skewed(n, size, exponent):
+        weights = 1.0 / np.arange(1, n + 1) ** exponent
+        return rng.permutation(n)[rng.choice(n, size=size, p=weights / weights.sum())]
+
+    n_unique = int(n_interactions * (1 - duplicate_rate))
+    users = skewed(n_users, n_unique, 0.6)
+    items = skewed(n_items, n_unique, 0.9)
+    repeats = rng.integers(0, n_unique, size=n_interactions - n_unique)
+    users, items = np.concatenate([users, users[repeats]]), np.concatenate([items, items[repeats]])
+    ratings = np.clip(np.rint(rng.normal(4.2, 1.0, size=n_interactions)), 1, 5)
+    timestamps = pd.to_datetime(rng.integers(1_500_000_000_000, 1_700_000_000_000, size=n_interactions), unit='ms')
+    return pd.DataFrame({
+        'user_id': pd.Categorical.from_codes(users, [f'U{i:09d}' for i in range(n_users)]),
+        'parent_asin': pd.Categorical.from_codes(items, [f'B{i:09d}' for i in range(n_items)]),
+        'rating': ratings,
+        'timestamp': timestamps
+    })
+
+
+class StageTimer:
+    """Wall-clock seconds per named stage, in the order the stages ran."""
+
+    def __init__(self):
+        self.seconds = {}
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        yield
+        self.seconds[name] = time.perf_counter() - start
+        logger.info(f"{name}: {self.seconds[name]:.2f}s")
+
+
+def benchmark_training(work_dir, n_interactions, trainer='svd', n_components=64, n_iter=5, k=10, version=None):
+    """Run the train_model.py stages on synthetic data, timing each; returns (timings, bundle path).
+
+    The bundle is written under work_dir/artifacts without moving LATEST.
+    """
+    timer = StageTimer()
+    source = os.path.join(work_dir, f'ratings-{n_interactions}.parquet')
+    synthetic_ratings(n_interactions).to_parquet(source)
+
+    with timer.stage('load'):
+        df = pd.read_parquet(source)[['user_id', 'parent_asin', 'rating', 'timestamp']]
+    with timer.stage('dedupe'):
+        ratings = dedupe_latest(df)
+    with timer.stage('matrix'):
+        matrix, user_ids, item_ids = build_user_item_matrix(ratings, time_col=None)
+    with timer.stage('split'):
+        train_matrix, test_matrix = train_test_split(matrix, test_size=0.2, random_state=42)
+    with timer.stage('fit'):
+        model = make_trainer(trainer, n_components=n_components, n_iter=n_iter, random_state=42)
+        model.fit_transform(train_matrix)
+    with timer.stage('evaluate'):
+        evaluate(model.transform(test_matrix), model.components_, test_matrix, k=5, threshold=2)
+    with timer.stage('bundle'):
+        all_user_factors = model.transform(matrix)
+        bundle_path = save_bundle(os.path.join(work_dir, 'artifacts'), all_user_factors, model.components_, matrix,
+                                  user_ids, item_ids, version=version, extra=bundle_metadata(model), publish=False)
+    with timer.stage('batch_scoring'):
+        score_all(all_user_factors, model.components_, bundle_path, rated=matrix, k=k,
+                  version=os.path.basename(bundle_path))
+    return timer.seconds, bundle_path
+
+
+def latency_summary(latencies, errors, elapsed):
+    latencies_ms = np.asarray(latencies) * 1000
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'rps': len(latencies) / elapsed if elapsed else 0.0,
+        'p50_ms': float(np.percentile(latencies_ms, 50)) if len(latencies) else None,
+        'p95_ms': float(np.percentile(latencies_ms, 95)) if len(latencies) else None,
+        'p99_ms': float(np.percentile(latencies_ms, 99)) if len(latencies) else None
+    }
+
+
+async def generate_load(client, make_request, n_requests, concurrency):
+    """Issue n_requests from `concurrency` workers as fast as the app answers; latency per request."""
+    latencies, errors = [], 0
+    remaining = iter(range(n_requests))
+
+    async def worker():
+        nonlocal errors
+        for i in remaining:
+            method, url, kwargs = make_request(i)
+            start = time.perf_counter()
+            response = await client.request(method, url, **kwargs)
+            latencies.append(time.perf_counter() - start)
+            errors += response.status_code != 200
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latency_summary(latencies, errors, time.perf_counter() - start)
+
+
+async def benchmark_serving(client, user_ids, n_requests=2000, concurrency=32, batch_size=32, random_state=42):
+    """Single and batch /predict load against the model the app is serving."""
+    rng = np.random.default_rng(random_state)
+    single_users = rng.choice(user_ids, size=n_requests).tolist()
+    n_batches = max(n_requests // 4, 1)
+    batches = [rng.choice(user_ids, size=batch_size).tolist() for _ in range(n_batches)]
+    # Warm-up: the first requests pay for page faults on the fresh bundle, which is not what we measure
+    await generate_load(client, lambda i: ('POST', '/predict', {'params': {'user_id': single_users[i]}}),
+                        min(100, n_requests), concurrency)
+    return {
+        'predict': await generate_load(
+            client, lambda i: ('POST', '/predict', {'params': {'user_id': single_users[i]}}), n_requests, concurrency),
+        'predict_batch': await generate_load(
+            client, lambda i: ('POST', '/predict/batch', {'json': {'user_ids': batches[i], 'k': 5}}), n_batches,
+            max(concurrency // 4, 1))
+    }
+
+
+def load_app(work_dir, bundle_path, sink='sqlite'):
+    """Import app.py serving bundle_path from work_dir/artifacts, with a local stand-in for DynamoDB and no S3."""
+    set_latest(os.path.dirname(bundle_path), os.path.basename(bundle_path))
+    os.environ.update({
+        'ARTIFACT_ROOT': os.path.join(work_dir, 'artifacts'),
+        'PREDICTION_LOG_SINK': sink,
+        'PREDICTION_LOG_PATH': os.path.join(work_dir, f'predictions.{"db" if sink == "sqlite" else "jsonl"}'),
+        'PREDICTION_LOG_SPILL_PATH': os.path.join(work_dir, 'prediction_spill.jsonl'),
+        'ROLLUP_DB': os.path.join(work_dir, 'rollups.db'),
+        'MODEL_POLL_SECONDS': '0'
+    })
+    import app
+    return app
+
+
+async def serve_all(app_module, bundles, **load_params):
+    """Run the app in-process (ASGI, no sockets) and benchmark each bundle in turn, hot-swapping between them."""
+    import httpx
+    results = {}
+    async with app_module.lifespan(app_module.app):
+        transport = httpx.ASGITransport(app=app_module.app)
+        async with httpx.AsyncClient(transport=transport, base_url='http://benchmark') as client:
+            for scale, bundle_path in bundles.items():
+                set_latest(os.path.dirname(bundle_path), os.path.basename(bundle_path))
+                app_module.model_manager.check()
+                state = app_module.model_manager.current
+                if state is None or state.path != bundle_path:
+                    raise RuntimeError(f"App did not load {bundle_path}: {app_module.model_manager.last_error}")
+                results[scale] = await benchmark_serving(client, state.engine.user_ids, **load_params)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25, min_seconds=0.05):
+    """Regressions of results against baseline as (metric, baseline, current) for anything worse by over tolerance.
+
+    Training stages and latencies regress by getting slower, rps by dropping.
+    Training stages under ``min_seconds`` in the baseline are skipped, since
+    their run-to-run noise exceeds any sensible tolerance.
+    """
+    regressions = []
+
+    def walk(current, reference, path):
+        for key, value in reference.items():
+            if key not in current:
+                continue
+            if isinstance(value, dict):
+                walk(current[key], value, path + (key,))
+                continue
+            if not isinstance(value, (int, float)) or not isinstance(current[key], (int, float)) or value <= 0:
+                continue
+            if key in HIGHER_IS_BETTER:
+                worse = current[key] < value * (1 - tolerance)
+            elif key.endswith('_ms') or (path[-1:] == ('training',) and value >= min_seconds):
+                worse = current[key] > value * (1 + tolerance)
+            else:
+                worse = False
+            if worse:
+                regressions.append(('.'.join(path + (key,)), value, current[key]))
+
+    walk(results.get('scales', {}), baseline.get('scales', {}), ())
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    # Per-request log lines would dominate the output and the timings
+    for name in ('app', 'httpx'):
+        logging.getLogger(name).setLevel(logging.WARNING)
+    parser = argparse.ArgumentParser(description="Benchmark training stages and in-process serving on synthetic data")
+    parser.add_argument('--scales', nargs='+', default=['100k'], choices=list(SCALES))
+    parser.add_argument('--work-dir', default='benchmark_work')
+    parser.add_argument('--output', default='benchmark_results.json')
+    parser.add_argument('--baseline', default='benchmark_baseline.json')
+    parser.add_argument('--save-baseline', action='store_true', help="Write these results as the new baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before a run fails")
+    parser.add_argument('--trainer', default='svd', choices=['svd', 'als', 'als_implicit'])
+    parser.add_argument('--components', type=int, default=64)
+    parser.add_argument('--requests', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=32)
+    parser.add_argument('--sink', default='sqlite', choices=['sqlite', 'jsonl', 'memory'],
+                        help="Local stand-in for the DynamoDB prediction log")
+    parser.add_argument('--skip-serving', action='store_true')
+    args = parser.parse_args()
+
+    results = {
+        'meta': {'created': int(time.time()), 'python': platform.python_version(), 'numpy': np.__version__,
+                 'platform': platform.platform(), 'cpus': os.cpu_count(), 'trainer': args.trainer,
+                 'components': args.components, 'requests': args.requests, 'concurrency': args.concurrency},
+        'scales': {}
+    }
+    os.makedirs(args.work_dir, exist_ok=True)
+    bundles = {}
+    for scale in args.scales:
+        logger.info(f"Scale {scale}: {SCALES[scale]} interactions")
+        training, bundles[scale] = benchmark_training(args.work_dir, SCALES[scale], trainer=args.trainer,
+                                                      n_components=args.components, version=f'{new_version()}-{scale}')
+        results['scales'][scale] = {'training': training}
+    if not args.skip_serving:
+        app_module = load_app(args.work_dir, bundles[args.scales[0]], sink=args.sink)
+        serving = asyncio.run(serve_all(app_module, bundles, n_requests=args.requests, concurrency=args.concurrency))
+        for scale, summaries in serving.items():
+            results['scales'][scale]['serving'] = summaries
+            for name, summary in summaries.items():
+                logger.info(f"{scale} {name}: {summary['rps']:.0f} req/s, p50 {summary['p50_ms']:.2f} ms, "
+                            f"p95 {summary['p95_ms']:.2f} ms, p99 {summary['p99_ms']:.2f} ms, "
+                            f"{summary['errors']} errors")
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    logger.info(f"Wrote {args.output}")
+
+    if args.save_baseline:
+        with open(args.baseline, 'w') as f:
+            json.dump(results, f, indent=2)
+        logger.info(f"Saved baseline {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        logger.warning(f"No baseline at {args.baseline}; run with --save-baseline to create one")
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, tolerance=args.tolerance)
+    errors = sum(summary['errors'] for scale in results['scales'].values()
+                 for summary in scale.get('serving', {}).values())
+    for name, before, after in regressions:
+        logger.error(f"Regression in {name}: {before:.4g} -> {after:.4g}")
+    if regressions or errors:
+        raise SystemExit(f"{len(regressions)} regressions and {errors} failed requests against {args.baseline}")
+    logger.info(f"No regressions against {args.baseline} (tolerance {args.tolerance:.0%})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,257 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from artifacts import latest_bundle_path, load_bundle
+from serving_engine import RecommenderEngine
+
+logger = logging.getLogger(__name__)
+
+DELTA_GLOB = 'delta*.npz'
+
+
+def delta_paths(directory):
+    """Every worker's persisted delta file in directory (plus a legacy delta.npz), oldest name first."""
+    return sorted(path for path in glob.glob(os.path.join(directory, DELTA_GLOB)) if not path.endswith('.tmp.npz'))
+
+
+def read_delta(path):
+    """(user_id, item_id, rating, timestamp) tuples from one delta file."""
+    with np.load(path) as delta:
+        return list(zip(delta['user_ids'].tolist(), delta['item_ids'].tolist(),
+                        delta['ratings'].tolist(), delta['timestamps'].tolist()))
+
+
+def read_deltas(directory):
+    """Ratings from every delta file in directory; the same rating may appear in several files."""
+    ratings = []
+    for path in delta_paths(directory):
+        ratings.extend(read_delta(path))
+    return ratings
+
+
+def append_folded_in(df, ratings):
+    """df (user_id, parent_asin, rating, timestamp) with folded-in rating tuples appended in the same units.
+
+    Folded-in timestamps are epoch milliseconds; they become datetimes when
+    df's timestamp column is one, so dedupe sees a single comparable type.
+    """
+    if not ratings:
+        return df
+    folded = pd.DataFrame(ratings, columns=['user_id', 'parent_asin', 'rating', 'timestamp'])
+    timestamps = df['timestamp']
+    if pd.api.types.is_datetime64_any_dtype(timestamps):
+        tz = getattr(timestamps.dt, 'tz', None)
+        converted = pd.to_datetime(folded['timestamp'], unit='ms', utc=tz is not None)
+        folded['timestamp'] = (converted.dt.tz_convert(tz) if tz is not None else converted).astype(timestamps.dtype)
+    else:
+        folded['timestamp'] = folded['timestamp'].astype(timestamps.dtype)
+    return pd.concat([df.astype({'user_id': str, 'parent_asin': str}), folded], ignore_index=True)
+
+
+class FoldInUpdater:
+    """Fold new ratings into a RecommenderEngine without retraining.
+
+    Each affected user's rating row (base CSR row merged with the new ratings,
+    latest rating per item wins) is projected onto the item factors and
+    installed in the engine's overlay. New ratings are kept as a delta that
+    ``compact`` persists next to the base artifacts and ``load`` replays at
+    startup; train_model.py reads the deltas of the latest bundle into the
+    next retrain.
+
+    Every worker process owns its own ``delta-<worker>.npz``, so workers never
+    overwrite each other's ratings. ``load`` merges all of them and ``sync``
+    picks up what other workers have persisted since, so a rating posted to
+    one worker reaches the others within a compaction interval. Merging is
+    idempotent: the latest timestamp per (user, item) wins wherever it came
+    from.
+    """
+
+    def __init__(self, engine, delta_dir, worker_id=None):
+        self.engine = engine
+        self.delta_dir = delta_dir
+        self.delta_path = os.path.join(delta_dir, f'delta-{worker_id or os.getpid()}.npz')
+        self.delta = {}
+        self.dirty = False
+        self._seen = {}
+        self._lock = threading.Lock()
+
+    def base_ratings(self, user_id):
+        row = self.engine.user_index.get(user_id)
+        rated = self.engine.rated
+        if row is None or rated is None or row >= rated.shape[0]:
+            return {}
+        start, end = rated.indptr[row], rated.indptr[row + 1]
+        return dict(zip(rated.indices[start:end].tolist(), rated.data[start:end].tolist()))
+
+    def add_ratings(self, ratings):
+        """Apply (user_id, item_id, rating, timestamp) tuples; returns a summary of what was applied."""
+        unknown_items = []
+        touched = set()
+        with self._lock:
+            for user_id, item_id, rating, timestamp in ratings:
+                col = self.engine.item_index.get(item_id)
+                if col is None:
+                    unknown_items.append(item_id)
+                    continue
+                user_delta = self.delta.setdefault(user_id, {})
+                previous = user_delta.get(col)
+                # Milliseconds, like the timestamps of the ratings dump the model is trained on
+                timestamp = int(timestamp if timestamp is not None else time.time() * 1000)
+                if previous is None or timestamp >= previous[1]:
+                    user_delta[col] = (float(rating), timestamp)
+                touched.add(user_id)
+            for user_id in touched:
+                self._fold_in(user_id)
+            self.dirty = self.dirty or bool(touched)
+        return {
+            "accepted": len(ratings) - len(unknown_items),
+            "updated_users": len(touched),
+            "unknown_items": sorted(set(unknown_items))
+        }
+
+    def _fold_in(self, user_id):
+        merged = self.base_ratings(user_id)
+        merged.update({col: rating for col, (rating, _) in self.delta[user_id].items()})
+        cols = np.fromiter(merged.keys(), dtype=np.int64, count=len(merged))
+        values = np.fromiter(merged.values(), dtype=np.float32, count=len(merged))
+        self.engine.set_user_factors(user_id, self.engine.project(cols, values), cols)
+
+    def _delta_rows(self):
+        users, cols, values, timestamps = [], [], [], []
+        for user_id, user_delta in self.delta.items():
+            for col, (rating, timestamp) in user_delta.items():
+                users.append(user_id)
+                cols.append(col)
+                values.append(rating)
+                timestamps.append(timestamp)
+        item_ids = self.engine.item_ids[np.asarray(cols, dtype=np.int64)] if cols else np.empty(0, dtype=str)
+        return users, item_ids, values, timestamps
+
+    def revision(self, user_id):
+        """Timestamp of the user's latest folded-in rating, or 0; the same on every worker once synced."""
+        with self._lock:
+            user_delta = self.delta.get(user_id)
+            return max(timestamp for _, timestamp in user_delta.values()) if user_delta else 0
+
+    def unabsorbed(self, ratings):
+        """The rating tuples the base matrix does not already hold, e.g. all but those a retrain absorbed."""
+        kept = []
+        base = {}
+        for user_id, item_id, rating, timestamp in ratings:
+            if user_id not in base:
+                base[user_id] = self.base_ratings(user_id)
+            stored = base[user_id].get(self.engine.item_index.get(item_id))
+            if stored is None or abs(stored - rating) > 1e-6:
+                kept.append((user_id, item_id, rating, timestamp))
+        return kept
+
+    def ratings(self):
+        """The folded-in ratings as (user_id, item_id, rating, timestamp) tuples, e.g. to replay on a new model."""
+        with self._lock:
+            users, item_ids, values, timestamps = self._delta_rows()
+        return list(zip(users, np.asarray(item_ids).tolist(), values, timestamps))
+
+    def compact(self):
+        """Persist the rating delta atomically next to the base artifacts."""
+        with self._lock:
+            users, item_ids, values, timestamps = self._delta_rows()
+            tmp_path = f'{self.delta_path}.tmp.npz'
+            np.savez(tmp_path, user_ids=np.asarray(users, dtype=str), item_ids=np.asarray(item_ids, dtype=str),
+                     ratings=np.asarray(values, dtype=np.float32), timestamps=np.asarray(timestamps, dtype=np.int64))
+            os.replace(tmp_path, self.delta_path)
+            self.dirty = False
+        logger.info(f"Compacted {len(users)} folded-in ratings for {len(self.delta)} users to {self.delta_path}")
+        return len(users)
+
+    def discard(self):
+        """Delete this worker's persisted delta once its ratings are kept elsewhere (e.g. by a newer bundle)."""
+        try:
+            os.remove(self.delta_path)
+        except FileNotFoundError:
+            pass
+
+    def load(self):
+        """Replay every worker's persisted delta into the engine; returns the number of ratings accepted."""
+        return self._replay(delta_paths(self.delta_dir))
+
+    def sync(self):
+        """Replay delta files other workers have written since they were last read."""
+        changed = []
+        for path in delta_paths(self.delta_dir):
+            if path != self.delta_path and self._seen.get(path) != self._stat(path):
+                changed.append(path)
+        return self._replay(changed) if changed else 0
+
+    @staticmethod
+    def _stat(path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_size, stat.st_mtime_ns
+
+    def _replay(self, paths):
+        ratings = []
+        for path in paths:
+            stat = self._stat(path)
+            ratings.extend(read_delta(path))
+            self._seen[path] = stat
+        if not ratings:
+            return 0
+        dirty = self.dirty
+        summary = self.add_ratings(ratings)
+        # Ratings already persisted elsewhere do not make this worker's delta dirty
+        self.dirty = dirty
+        logger.info(f"Replayed {summary['accepted']} folded-in ratings for {summary['updated_users']} users "
+                    f"from {len(paths)} delta files")
+        return summary['accepted']
+
+    def stats(self):
+        return {
+            "delta_users": len(self.delta),
+            "delta_ratings": sum(len(user_delta) for user_delta in self.delta.values()),
+            "new_users": self.engine.n_new_users,
+            "dirty": self.dirty
+        }
+
+
+def read_ratings_file(path):
+    """Read ratings from a JSONL file of {user_id, parent_asin, rating, timestamp} objects."""
+    ratings = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                ratings.append((record['user_id'], record['parent_asin'], float(record['rating']),
+                                record.get('timestamp')))
+    return ratings
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Fold a file of new ratings into the latest artifact bundle's delta")
+    parser.add_argument('ratings_file', help="JSONL with user_id, parent_asin, rating and optional timestamp")
+    parser.add_argument('--artifact-root', default='artifacts')
+    args = parser.parse_args()
+
+    bundle_path = latest_bundle_path(args.artifact_root)
+    if bundle_path is None:
+        raise SystemExit(f"No artifact bundle under {args.artifact_root}")
+    updater = FoldInUpdater(RecommenderEngine.from_bundle(load_bundle(bundle_path)), bundle_path, worker_id='cli')
+    updater.load()
+    summary = updater.add_ratings(read_ratings_file(args.ratings_file))
+    updater.compact()
+    logger.info(f"Applied {summary['accepted']} ratings for {summary['updated_users']} users, "
+                f"{len(summary['unknown_items'])} unknown items skipped")
+
+
+if __name__ == '__main__':
+    main()
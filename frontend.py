@@ -1,31 +1,62 @@
+import os
+
 import streamlit as st
-import pandas as pd
 import requests
 
+API_URL = os.getenv('API_URL', 'http://localhost:8000')
+PAGE_SIZE = 20
+# Every backend call is bounded, so a hung API shows an error instead of freezing the page
+API_TIMEOUT = float(os.getenv('API_TIMEOUT_SECONDS', '5'))
 
-@st.cache_data
-def load_user_ids():
-    try:
-        df = pd.read_parquet('books_5core_1M.parquet')
-        if 'user_id' not in df.columns:
-            st.error("Column 'user_id' not found in the dataset")
-            return ["AE224GVO7OHTYF26U6ER6BEVIUAQ"]
-        user_ids = df['user_id'].dropna().unique().tolist()
-        st.write(f"Loaded {len(user_ids)} unique user IDs")
-        return user_ids
-    except Exception as e:
-        st.error(f"Error loading user IDs: {e}")
-        return ["AE224GVO7OHTYF26U6ER6BEVIUAQ"]
+
+@st.cache_data(ttl=60)
+def search_users(prefix, cursor):
+    """One page of user IDs starting with prefix from the backend's /users index."""
+    params = {"prefix": prefix, "limit": PAGE_SIZE}
+    if cursor:
+        params["cursor"] = cursor
+    response = requests.get(f"{API_URL}/users", params=params, timeout=API_TIMEOUT)
+    response.raise_for_status()
+    data = response.json()
+    return data["user_ids"], data["next_cursor"]
 
 
 st.title("Book Recommender")
-st.markdown("Select a user ID to get personalized book recommendations.")
+st.markdown("Search for a user ID to get personalized book recommendations.")
+
+prefix = st.text_input("User ID starts with", value="").strip()
+# Cursors of the pages seen so far for this prefix, so Previous can go back
+if st.session_state.get("prefix") != prefix:
+    st.session_state.prefix = prefix
+    st.session_state.cursors = [None]
 
-user_ids = load_user_ids()
-selected_user_id = st.selectbox("Select User ID", user_ids, index=0)
+try:
+    user_ids, next_cursor = search_users(prefix, st.session_state.cursors[-1])
+except Exception as e:
+    st.error(f"Error searching user IDs: {e}")
+    user_ids, next_cursor = [], None
 
-if st.button("Get Recommendations"):
-    response = requests.post(f"http://localhost:8000/predict?user_id={selected_user_id}")
+if user_ids:
+    selected_user_id = st.selectbox("Select User ID", user_ids, index=0)
+else:
+    selected_user_id = None
+    st.info("No user IDs match this prefix.")
+
+previous_column, page_column, next_column = st.columns([1, 2, 1])
+if previous_column.button("Previous", disabled=len(st.session_state.cursors) == 1):
+    st.session_state.cursors.pop()
+    st.rerun()
+page_column.caption(f"Page {len(st.session_state.cursors)}")
+if next_column.button("Next", disabled=next_cursor is None):
+    st.session_state.cursors.append(next_cursor)
+    st.rerun()
+
+if st.button("Get Recommendations", disabled=selected_user_id is None):
+    try:
+        response = requests.post(f"{API_URL}/predict", params={"user_id": selected_user_id}, timeout=API_TIMEOUT)
+    except requests.RequestException as e:
+        st.error(f"Error reaching the recommendation API: {e}")
+        st.stop()
     if response.status_code == 200:
         data = response.json()
         st.success(f"Recommendations for {data['user_id']}: {data['recommended_books']}")
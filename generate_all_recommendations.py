@@ -1,26 +1,30 @@
-import requests
-import numpy as np
-import json
+import logging
+import os
 
-# Load all user IDs from the saved numpy file
-user_ids = np.load('user_item_indices.npy', allow_pickle=True)
+from artifacts import latest_bundle_path, load_bundle
+from batch_scoring import RecommendationStore, export_json, has_store, score_all
 
-# Initialize a dictionary to store all recommendations
-all_recommendations = {}
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
 
-# Query the FastAPI endpoint for each user ID
-for user_id in user_ids:
-    try:
-        response = requests.post(f"http://localhost:8000/predict?user_id={user_id}")
-        if response.status_code == 200:
-            all_recommendations[user_id] = response.json()["recommended_books"]
-        else:
-            all_recommendations[user_id] = f"Error: {response.status_code} - {response.text}"
-    except Exception as e:
-        all_recommendations[user_id] = f"Error: {str(e)}"
+artifact_root = os.getenv('ARTIFACT_ROOT', 'artifacts')
+recommend_k = int(os.getenv('RECOMMEND_K', '10'))
+recommend_jobs = int(os.getenv('RECOMMEND_JOBS', '1'))
 
-# Save to a JSON file
-with open('all_recommendations.json', 'w') as f:
-    json.dump(all_recommendations, f, indent=4)
 
-print("Recommendations for all users saved to all_recommendations.json")
+def main():
+    # Score offline from the latest artifact bundle instead of one POST /predict per user
+    bundle_path = latest_bundle_path(artifact_root)
+    if bundle_path is None:
+        raise SystemExit(f"No artifact bundle under {artifact_root}; run train_model.py first")
+    bundle = load_bundle(bundle_path)
+    if not has_store(bundle_path) or RecommendationStore.load(bundle_path).k < recommend_k:
+        score_all(bundle.user_factors, bundle.item_factors, bundle_path, rated=bundle.matrix, k=recommend_k,
+                  n_jobs=recommend_jobs, version=bundle.version)
+    n_users = export_json(RecommendationStore.load(bundle_path), bundle.user_ids.tolist(), bundle.item_ids.tolist(),
+                          'all_recommendations.json')
+    logger.info(f"Recommendations for {n_users} users saved to all_recommendations.json")
+
+
+if __name__ == '__main__':
+    main()
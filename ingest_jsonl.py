@@ -0,0 +1,189 @@
+import argparse
+import glob
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import boto3
+from botocore.exceptions import ClientError
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+try:
+    import orjson
+    loads = orjson.loads
+except ImportError:  # fall back to the standard library parser
+    loads = json.loads
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = pa.schema([
+    ('user_id', pa.string()),
+    ('parent_asin', pa.string()),
+    ('rating', pa.float32()),
+    ('timestamp', pa.int64())
+])
+READ_AHEAD = 1 << 16
+_s3 = None
+
+
+def _s3_client():
+    global _s3
+    if _s3 is None:
+        _s3 = boto3.client('s3')
+    return _s3
+
+
+def _split_s3(source):
+    bucket, _, key = source[len('s3://'):].partition('/')
+    return bucket, key
+
+
+def source_size(source):
+    """Size in bytes of a local file or an s3://bucket/key object."""
+    if source.startswith('s3://'):
+        bucket, key = _split_s3(source)
+        return _s3_client().head_object(Bucket=bucket, Key=key)['ContentLength']
+    return os.path.getsize(source)
+
+
+def read_bytes(source, start, length):
+    """Read up to length bytes at offset start, using a ranged GET for S3 objects."""
+    if length <= 0:
+        return b''
+    if source.startswith('s3://'):
+        bucket, key = _split_s3(source)
+        try:
+            response = _s3_client().get_object(Bucket=bucket, Key=key, Range=f'bytes={start}-{start + length - 1}')
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'InvalidRange':
+                return b''  # read past the end of the object
+            raise
+        return response['Body'].read()
+    with open(source, 'rb') as f:
+        f.seek(start)
+        return f.read(length)
+
+
+def byte_ranges(size, chunk_bytes):
+    return [(start, min(start + chunk_bytes, size)) for start in range(0, size, chunk_bytes)]
+
+
+def read_lines_in_range(source, start, end):
+    """Bytes of every complete line that starts in [start, end).
+
+    A line straddling ``start`` belongs to the previous range; the last line is
+    completed by reading past ``end``.
+    """
+    begin = max(start - 1, 0)
+    data = read_bytes(source, begin, end - begin)
+    if start > 0:
+        newline = data.find(b'\n')
+        if newline < 0:
+            return b''
+        data = data[newline + 1:]
+    pos = end
+    while data and not data.endswith(b'\n'):
+        more = read_bytes(source, pos, READ_AHEAD)
+        if not more:
+            break
+        newline = more.find(b'\n')
+        if newline >= 0:
+            data += more[:newline + 1]
+            break
+        data += more
+        pos += len(more)
+    return data
+
+
+def validate_record(obj):
+    """Return (user_id, parent_asin, rating, timestamp) for a well-formed review, else None."""
+    if not isinstance(obj, dict):
+        return None
+    user_id = obj.get('user_id')
+    item_id = obj.get('parent_asin')
+    rating = obj.get('rating')
+    timestamp = obj.get('timestamp')
+    if not isinstance(user_id, str) or not user_id or not isinstance(item_id, str) or not item_id:
+        return None
+    if isinstance(rating, bool) or not isinstance(rating, (int, float)) or not 0 < rating <= 5:
+        return None
+    if isinstance(timestamp, bool) or not isinstance(timestamp, int) or timestamp <= 0:
+        return None
+    return user_id, item_id, float(rating), timestamp
+
+
+def parse_range(task):
+    """Parse one byte range and write its rows as a Parquet partition. Runs in a pool worker."""
+    source, index, start, end, output_dir, min_rating, row_group_size = task
+    user_ids, item_ids, ratings, timestamps = [], [], [], []
+    n_lines = n_invalid = 0
+    for line in read_lines_in_range(source, start, end).splitlines():
+        if not line.strip():
+            continue
+        n_lines += 1
+        try:
+            record = validate_record(loads(line))
+        except ValueError:
+            record = None
+        if record is None:
+            n_invalid += 1
+            continue
+        if record[2] < min_rating:
+            continue
+        user_ids.append(record[0])
+        item_ids.append(record[1])
+        ratings.append(record[2])
+        timestamps.append(record[3])
+    if user_ids:
+        table = pa.Table.from_arrays(
+            [pa.array(user_ids), pa.array(item_ids), pa.array(ratings, pa.float32()), pa.array(timestamps, pa.int64())],
+            schema=SCHEMA
+        )
+        pq.write_table(table, os.path.join(output_dir, f'part-{index:05d}.parquet'), row_group_size=row_group_size)
+    return {'lines': n_lines, 'rows': len(user_ids), 'invalid': n_invalid}
+
+
+def ingest(source, output_dir, workers=None, chunk_bytes=64 << 20, min_rating=2, row_group_size=128 * 1024):
+    """Convert a JSONL review dump into Parquet partitions, one per byte range.
+
+    Only user_id, parent_asin, rating and timestamp are kept and reviews rated
+    below min_rating are dropped. Each worker holds one chunk at a time, so
+    memory stays at roughly workers x chunk_bytes regardless of input size.
+    """
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    for stale in glob.glob(os.path.join(output_dir, 'part-*.parquet')):
+        os.remove(stale)
+    ranges = byte_ranges(source_size(source), chunk_bytes)
+    tasks = [(source, i, start, end, output_dir, min_rating, row_group_size) for i, (start, end) in enumerate(ranges)]
+    logger.info(f"Ingesting {source} as {len(tasks)} chunks into {output_dir}")
+    totals = {'lines': 0, 'rows': 0, 'invalid': 0}
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for stats in pool.map(parse_range, tasks):
+            for name, value in stats.items():
+                totals[name] += value
+    totals['seconds'] = time.time() - start_time
+    logger.info(f"Ingested {totals['rows']} rows from {totals['lines']} lines "
+                f"({totals['invalid']} invalid) in {totals['seconds']:.1f}s")
+    return totals
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Convert a JSONL review dump into partitioned Parquet")
+    parser.add_argument('source', help="Local JSONL path or s3://bucket/key")
+    parser.add_argument('output_dir', help="Directory for part-*.parquet files")
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--chunk-mb', type=int, default=64)
+    parser.add_argument('--min-rating', type=float, default=2)
+    parser.add_argument('--row-group-size', type=int, default=128 * 1024)
+    args = parser.parse_args()
+    ingest(args.source, args.output_dir, workers=args.workers, chunk_bytes=args.chunk_mb << 20,
+           min_rating=args.min_rating, row_group_size=args.row_group_size)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,172 @@
+import argparse
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from artifacts import commit_staged, latest_bundle_path, load_bundle, staged_memmap, write_json_atomic
+from serving_engine import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+NEIGHBOURS_MANIFEST = 'neighbours.json'
+ITEMS_FILE = 'neighbours_items.npy'
+SCORES_FILE = 'neighbours_scores.npy'
+VECTORS_FILE = 'item_vectors_normalised.npy'
+
+# Normalised item vectors shared with pool workers once via the initializer
+_shared = {}
+
+
+def normalised_items(item_factors):
+    """Unit-length item vectors (items x factors, float32) from factors x items; zero vectors stay zero."""
+    vectors = np.ascontiguousarray(np.asarray(item_factors, dtype=np.float32).T)
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def load_normalised_items(directory, item_factors):
+    """Normalised item vectors saved in the bundle on first use and memory-mapped, so workers share one copy.
+
+    Workers may race to write the file; each stages its own copy and the
+    renames are equivalent. A read-only bundle gets a private in-memory copy.
+    """
+    path = os.path.join(directory, VECTORS_FILE)
+    if not os.path.exists(path):
+        vectors = normalised_items(item_factors)
+        tmp = f'{path}.{os.getpid()}.tmp'
+        try:
+            with open(tmp, 'wb') as f:
+                np.save(f, vectors)
+            os.replace(tmp, path)
+        except OSError as e:
+            logger.warning(f"Could not save normalised item vectors to {directory}: {e}")
+            return vectors
+        logger.info(f"Saved normalised item vectors for {vectors.shape[0]} items to {path}")
+    return np.load(path, mmap_mode='r')
+
+
+def similar_items(vectors, cols, k):
+    """Top-k cosine neighbours (excluding the item itself) and similarities for each of cols."""
+    cols = np.asarray(cols, dtype=np.int64)
+    k = min(k, vectors.shape[0] - 1)
+    similarities = vectors[cols] @ vectors.T
+    similarities[np.arange(len(cols)), cols] = -np.inf
+    top = top_k_indices(similarities, k)
+    return top, np.take_along_axis(similarities, top, axis=1)
+
+
+def _init_worker(vectors, k):
+    _shared.update(vectors=vectors, k=k)
+
+
+def _neighbours_block(bounds):
+    start, end = bounds
+    top, similarities = similar_items(_shared['vectors'], np.arange(start, end), _shared['k'])
+    return start, end, top.astype(np.int32), similarities.astype(np.float16)
+
+
+def build_neighbours(item_factors, output_dir, k=20, block_size=1024, n_jobs=1, version=None):
+    """Write the top-k cosine neighbours of every item as int32/float16 arrays plus a manifest.
+
+    Items are processed in blocks of block_size rows of the item x item
+    similarity matrix, so memory is O(block_size x items) however large the
+    catalogue is.
+    """
+    start_time = time.time()
+    os.makedirs(output_dir, exist_ok=True)
+    vectors = normalised_items(item_factors)
+    n_items = vectors.shape[0]
+    k = min(k, max(n_items - 1, 0))
+    items = staged_memmap(os.path.join(output_dir, ITEMS_FILE), np.int32, (n_items, k))
+    scores = staged_memmap(os.path.join(output_dir, SCORES_FILE), np.float16, (n_items, k))
+    blocks = [(start, min(start + block_size, n_items)) for start in range(0, n_items, block_size)]
+
+    def write(start, end, top, similarities):
+        items[start:end] = top
+        scores[start:end] = similarities
+
+    if n_jobs == 1 or len(blocks) <= 1:
+        _init_worker(vectors, k)
+        for bounds in blocks:
+            write(*_neighbours_block(bounds))
+        _shared.clear()
+    else:
+        with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(vectors, k)) as pool:
+            for result in pool.map(_neighbours_block, blocks):
+                write(*result)
+    # Renamed into place, never rewritten, since /similar may be reading the previous table
+    commit_staged(items, os.path.join(output_dir, ITEMS_FILE))
+    commit_staged(scores, os.path.join(output_dir, SCORES_FILE))
+    manifest = {
+        'model_version': version,
+        'created': int(time.time()),
+        'n_items': int(n_items),
+        'k': int(k),
+        'metric': 'cosine',
+        'files': {'items': ITEMS_FILE, 'scores': SCORES_FILE}
+    }
+    write_json_atomic(os.path.join(output_dir, NEIGHBOURS_MANIFEST), manifest)
+    logger.info(f"Built top-{k} neighbours for {n_items} items in {output_dir} in {time.time() - start_time:.1f}s")
+    return manifest
+
+
+class NeighbourIndex:
+    """Memory-mapped item neighbour table written by build_neighbours; a lookup is one row read."""
+
+    def __init__(self, manifest, items, scores):
+        self.manifest = manifest
+        self.items = items
+        self.scores = scores
+
+    @classmethod
+    def load(cls, directory, mmap_mode='r'):
+        with open(os.path.join(directory, NEIGHBOURS_MANIFEST)) as f:
+            manifest = json.load(f)
+        items = np.load(os.path.join(directory, manifest['files']['items']), mmap_mode=mmap_mode)
+        scores = np.load(os.path.join(directory, manifest['files']['scores']), mmap_mode=mmap_mode)
+        return cls(manifest, items, scores)
+
+    @property
+    def version(self):
+        return self.manifest['model_version']
+
+    @property
+    def k(self):
+        return self.manifest['k']
+
+    def __len__(self):
+        return self.items.shape[0]
+
+    def lookup(self, col, k):
+        """Neighbour item columns and cosine similarities for an item column, most similar first."""
+        return self.items[col, :k], self.scores[col, :k].astype(np.float32)
+
+
+def has_neighbours(directory):
+    return os.path.exists(os.path.join(directory, NEIGHBOURS_MANIFEST))
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Precompute item-to-item neighbours for an artifact bundle")
+    parser.add_argument('--artifact-root', default='artifacts')
+    parser.add_argument('--bundle', default=None, help="Bundle directory (default: the LATEST bundle)")
+    parser.add_argument('-k', type=int, default=20)
+    parser.add_argument('--block-size', type=int, default=1024)
+    parser.add_argument('--jobs', type=int, default=1)
+    args = parser.parse_args()
+
+    bundle_path = args.bundle or latest_bundle_path(args.artifact_root)
+    if bundle_path is None:
+        raise SystemExit(f"No artifact bundle under {args.artifact_root}")
+    bundle = load_bundle(bundle_path)
+    build_neighbours(bundle.item_factors, bundle_path, k=args.k, block_size=args.block_size, n_jobs=args.jobs,
+                     version=bundle.version)
+
+
+if __name__ == '__main__':
+    main()
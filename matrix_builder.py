@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix
+
+
+def timestamps_as_int64(values):
+    """Return timestamps as int64 so they can be sorted alongside integer codes."""
+    values = np.asarray(values)
+    if np.issubdtype(values.dtype, np.datetime64):
+        return values.astype('datetime64[ns]').view(np.int64)
+    return values.astype(np.int64)
+
+
+def latest_per_pair(user_codes, item_codes, timestamps):
+    """Indices of the most recent row for every (user, item) pair, ordered by user then item.
+
+    Ties on timestamp keep the row that appears last in the input.
+    """
+    order = np.lexsort((np.arange(len(user_codes)), timestamps, item_codes, user_codes))
+    u = user_codes[order]
+    i = item_codes[order]
+    last = np.ones(len(order), dtype=bool)
+    last[:-1] = (u[1:] != u[:-1]) | (i[1:] != i[:-1])
+    return order[last]
+
+
+def dedupe_latest(df, user_col='user_id', item_col='parent_asin', time_col='timestamp'):
+    """Keep only the most recent row of df for every (user, item) pair, ordered by user then item."""
+    user_codes = pd.factorize(df[user_col])[0]
+    item_codes = pd.factorize(df[item_col])[0]
+    keep = latest_per_pair(user_codes, item_codes, timestamps_as_int64(df[time_col]))
+    return df.iloc[keep].reset_index(drop=True)
+
+
+def build_user_item_matrix(df, user_col='user_id', item_col='parent_asin', rating_col='rating',
+                           time_col='timestamp', dtype=np.float64):
+    """Build the CSR user-item matrix straight from categorical codes.
+
+    Equivalent to deduping by most recent rating and then
+    ``df.pivot(index=user_col, columns=item_col, values=rating_col).fillna(0)``,
+    but never materialises the dense users x items frame. With
+    ``time_col=None`` the pairs are assumed to be unique already. Returns
+    ``(matrix, user_ids, item_ids)`` with IDs sorted like the pivot's index and
+    columns.
+    """
+    user_codes, user_ids = pd.factorize(df[user_col], sort=True)
+    item_codes, item_ids = pd.factorize(df[item_col], sort=True)
+    user_codes = user_codes.astype(np.int32)
+    item_codes = item_codes.astype(np.int32)
+    ratings = df[rating_col].to_numpy(dtype=dtype)
+    if time_col is not None:
+        keep = latest_per_pair(user_codes, item_codes, timestamps_as_int64(df[time_col]))
+        user_codes, item_codes, ratings = user_codes[keep], item_codes[keep], ratings[keep]
+    matrix = csr_matrix((ratings, (user_codes, item_codes)), shape=(len(user_ids), len(item_ids)), dtype=dtype)
+    matrix.eliminate_zeros()
+    return matrix, np.asarray(user_ids, dtype=object), np.asarray(item_ids, dtype=object)
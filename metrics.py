@@ -0,0 +1,263 @@
+import logging
+import os
+import sys
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+
+# Seconds, roughly x2.5 apart: 50us .. 10s covers a cached lookup up to a stuck sink write
+DEFAULT_BUCKETS = (0.00005, 0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0)
+
+
+class Histogram:
+    """Fixed-bucket histogram: observe is one bisect and two additions under a lock."""
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = tuple(buckets)
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def observe(self, value):
+        position = bisect_left(self.buckets, value)
+        with self._lock:
+            self.counts[position] += 1
+            self.sum += value
+            self.count += 1
+
+    def quantile(self, q):
+        """Upper bound of the bucket holding the q-th quantile (inf if it is past the last bucket)."""
+        with self._lock:
+            counts, total = list(self.counts), self.count
+        if not total:
+            return 0.0
+        running = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            running += count
+            if running >= q * total:
+                return bound
+        return float('inf')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{name}="{value}"' for (name, _), value in zip(labels, escaped)) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class MetricsRegistry:
+    """In-process counters, gauges and histograms rendered in the Prometheus text format.
+
+    Series are keyed by metric name plus a label dict, created on first use.
+    Gauges that are cheaper to read at scrape time than to keep updated
+    (queue depths, cache sizes) are registered as callbacks instead.
+    """
+
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self._meta = {}
+        self._counters = {}
+        self._gauges = {}
+        self._histograms = {}
+        self._callbacks = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, kind, help_text):
+        self._meta[name] = (kind, help_text)
+
+    def inc(self, name, amount=1, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def set(self, name, value, **labels):
+        self._gauges[(name, tuple(sorted(labels.items())))] = value
+
+    def add(self, name, amount, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._gauges[key] = self._gauges.get(key, 0) + amount
+
+    def histogram(self, name, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, Histogram(self.buckets))
+        return histogram
+
+    def observe(self, name, value, **labels):
+        self.histogram(name, **labels).observe(value)
+
+    @contextmanager
+    def timer(self, name, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - start, **labels)
+
+    def stage_timer(self, stage):
+        """Context manager timing one serving stage into ``serving_stage_seconds{stage=...}``."""
+        return self.timer('serving_stage_seconds', stage=stage)
+
+    def callback(self, name, kind, help_text, fn):
+        """Report fn() at scrape time; fn returns a number or a {((label, value), ...): number} mapping."""
+        self.describe(name, kind, help_text)
+        self._callbacks[name] = fn
+
+    def _families(self):
+        families = {}
+        for store in (self._counters, self._gauges):
+            for (name, labels), value in list(store.items()):
+                families.setdefault(name, []).append((name, labels, value))
+        for (name, labels), histogram in list(self._histograms.items()):
+            with histogram._lock:
+                counts, total, count = list(histogram.counts), histogram.sum, histogram.count
+            samples = families.setdefault(name, [])
+            running = 0
+            for bound, bucket_count in zip(histogram.buckets + (float('inf'),), counts):
+                running += bucket_count
+                samples.append((f'{name}_bucket', labels + (('le', _format_value(bound)),), running))
+            samples.append((f'{name}_sum', labels, total))
+            samples.append((f'{name}_count', labels, count))
+        for name, fn in list(self._callbacks.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                logger.warning(f"Metric callback {name} failed: {e}")
+                continue
+            if isinstance(value, dict):
+                families[name] = [(name, tuple(sorted(labels)), v) for labels, v in value.items()]
+            elif value is not None:
+                families[name] = [(name, (), value)]
+        return families
+
+    def render(self):
+        """All series in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for name, samples in sorted(self._families().items()):
+            kind, help_text = self._meta.get(name, ('untyped', ''))
+            if help_text:
+                lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} {kind}')
+            for sample_name, labels, value in samples:
+                lines.append(f'{sample_name}{_format_labels(labels)} {_format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+
+class SamplingProfiler:
+    """Sample the Python stacks of every other thread at a fixed interval while active.
+
+    Samples are folded into collapsed-stack lines (``frame;frame;frame count``)
+    that flamegraph.pl and speedscope read directly. Sampling covers the whole
+    process, so work of concurrent requests shows up in the profile too.
+    """
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.samples = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        own = threading.get_ident()
+        names = {thread.ident: thread.name for thread in threading.enumerate()}
+        while not self._stop.wait(self.interval):
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f'{os.path.basename(code.co_filename)}:{code.co_name}')
+                    frame = frame.f_back
+                stack.append(names.get(ident, str(ident)))
+                self.samples[';'.join(reversed(stack))] += 1
+
+    def __enter__(self):
+        self._thread = threading.Thread(target=self._sample, name='sampling-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self):
+        return ''.join(f'{stack} {count}\n' for stack, count in self.samples.most_common())
+
+
+class MetricsMiddleware:
+    """ASGI middleware counting requests, errors and in-flight requests, and timing each route.
+
+    With a ``profile_dir`` set, a request carrying an ``X-Profile: 1`` header is
+    run under a SamplingProfiler and its collapsed stacks are written to that
+    directory; the file name comes back in the ``X-Profile-File`` header.
+    """
+
+    def __init__(self, app, registry, profile_dir=None, profile_interval=0.001):
+        self.app = app
+        self.registry = registry
+        self.profile_dir = profile_dir
+        self.profile_interval = profile_interval
+        registry.describe('http_requests_total', 'counter', 'Requests by route, method and status.')
+        registry.describe('http_request_errors_total', 'counter', 'Requests that ended in a 5xx or an exception.')
+        registry.describe('http_requests_in_flight', 'gauge', 'Requests currently being handled.')
+        registry.describe('http_request_duration_seconds', 'histogram', 'Request latency by route.')
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            await self.app(scope, receive, send)
+            return
+        profiler = None
+        if self.profile_dir and (b'x-profile', b'1') in scope.get('headers', ()):
+            profiler = SamplingProfiler(self.profile_interval)
+        status = {'code': 500}
+        profile_file = None
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                status['code'] = message['status']
+                if profile_file:
+                    message['headers'] = list(message.get('headers', [])) + [
+                        (b'x-profile-file', profile_file.encode())]
+            await send(message)
+
+        if profiler is not None:
+            profile_file = f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['path'].strip('/').replace('/', '_')}-" \
+                           f"{id(scope):x}.collapsed"
+            profiler.__enter__()
+        self.registry.add('http_requests_in_flight', 1)
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - start
+            self.registry.add('http_requests_in_flight', -1)
+            route = getattr(scope.get('route'), 'path', None) or 'unmatched'
+            method = scope['method']
+            self.registry.inc('http_requests_total', route=route, method=method, status=status['code'])
+            if status['code'] >= 500:
+                self.registry.inc('http_request_errors_total', route=route, method=method)
+            self.registry.observe('http_request_duration_seconds', elapsed, route=route)
+            if profiler is not None:
+                profiler.__exit__()
+                os.makedirs(self.profile_dir, exist_ok=True)
+                with open(os.path.join(self.profile_dir, profile_file), 'w') as f:
+                    f.write(profiler.collapsed())
+                logger.info(f"Profile of {scope['path']} ({elapsed * 1000:.1f} ms, "
+                            f"{sum(profiler.samples.values())} samples) written to {profile_file}")
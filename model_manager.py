@@ -0,0 +1,302 @@
+import asyncio
+import json
+import logging
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+import numpy as np
+
+from ann_index import IVFIndex, has_ivf
+from artifacts import MANIFEST, latest_bundle_path, load_bundle
+from batch_scoring import RecommendationStore, has_store
+from fold_in import FoldInUpdater
+from item_neighbours import NeighbourIndex, has_neighbours, load_normalised_items, normalised_items
+from quantization import QuantizedItems, has_quantized
+from serving_engine import RecommenderEngine
+from user_search import UserIDIndex
+
+logger = logging.getLogger(__name__)
+
+
+class ServingState:
+    """Everything served for one model version: the engine, its precomputed tables and its fold-in updater."""
+
+    def __init__(self, engine, path=None, store=None, neighbours=None, user_search=None):
+        self.engine = engine
+        self.path = path
+        self.user_search = user_search or UserIDIndex.from_ids(engine.user_ids.tolist())
+        self.store = store
+        self.neighbours = neighbours
+        self.fold_in = FoldInUpdater(engine, path or '.')
+        self.loaded_at = time.time()
+        self._item_vectors = None
+
+    @property
+    def version(self):
+        return self.engine.version
+
+    @property
+    def item_vectors(self):
+        """Normalised item vectors for on-demand /similar, built on first use (once per bundle when there is one)."""
+        if self._item_vectors is None:
+            if self.path is not None:
+                self._item_vectors = load_normalised_items(self.path, self.engine.item_factors)
+            else:
+                self._item_vectors = normalised_items(self.engine.item_factors)
+        return self._item_vectors
+
+
+def load_state(path, retrieval='exact', nprobe=32, quantization='none', shortlist=100):
+    """Open a bundle with the retrieval options and the precomputed tables that match its version."""
+    bundle = load_bundle(path)
+    engine = RecommenderEngine.from_bundle(bundle)
+    logger.info(f"Loaded artifact bundle {engine.version} from {path}")
+
+    # Optional approximate retrieval: probe nprobe IVF lists and re-rank only their items
+    if retrieval == 'ann':
+        if has_ivf(path):
+            engine.use_ann(IVFIndex.load(path), nprobe=nprobe)
+            logger.info(f"ANN retrieval over {engine.ann.n_lists} lists with nprobe={engine.nprobe}")
+        else:
+            logger.warning("RETRIEVAL=ann but the bundle has no IVF index, using exact scoring")
+
+    # Optional quantized scoring: float16/int8 item factors give a shortlist that is re-ranked in float32
+    if quantization != 'none':
+        if has_quantized(path):
+            engine.use_quantized(QuantizedItems.load(path, quantization, shortlist=shortlist))
+            logger.info(f"Scoring with {quantization} item factors ({engine.quantized.nbytes / 2 ** 20:.1f} MB), "
+                        f"shortlist {engine.quantized.shortlist}")
+        else:
+            logger.warning(f"SERVING_QUANTIZATION={quantization} but the bundle has no quantized factors")
+
+    # Precomputed top-k for this model version (batch_scoring.py): requests it covers are an mmap lookup
+    store = None
+    if has_store(path):
+        candidate = RecommendationStore.load(path)
+        if candidate.version == engine.version and len(candidate) == engine.n_base_users:
+            store = candidate
+            logger.info(f"Serving top-{store.k} from the precomputed store (exclude_rated={store.exclude_rated})")
+        else:
+            logger.warning(f"Ignoring precomputed store for version {candidate.version}, model is {engine.version}")
+
+    # Item-to-item neighbours for /similar: one mmap row read, or a single on-demand product without the table
+    neighbours = None
+    if has_neighbours(path):
+        index = NeighbourIndex.load(path)
+        if index.version == engine.version and len(index) == engine.n_items:
+            neighbours = index
+            logger.info(f"Serving /similar from the top-{index.k} neighbour table")
+
+    # Bundles with sorted user IDs are searched in their own memory-mapped table, without a sorted copy
+    user_search = UserIDIndex(bundle.user_ids) if bundle.manifest['files']['user_ids'].get('sorted') else None
+    state = ServingState(engine, path, store=store, neighbours=neighbours, user_search=user_search)
+    state.fold_in.load()
+    return state
+
+
+def warm_up(state, n_users=64, k=10):
+    """Score a spread of users through every serving path and check the results are sane.
+
+    Touching the memory-mapped factors, indexes and tables here pulls their
+    pages in before the first real request, so a new version starts warm.
+    Raises ValueError if the model produces anything a request must not see.
+    """
+    engine = state.engine
+    if engine.n_base_users == 0 or engine.n_items == 0:
+        raise ValueError(f"Model {state.version} has {engine.n_base_users} users and {engine.n_items} items")
+    quantized = engine.quantized
+    if quantized is not None:
+        # Quantized scoring reads only the codes and scales for every request; paging in the float32 factors
+        # here would cost exactly the memory quantization is meant to save
+        warmed = [quantized.codes] + ([quantized.scales] if quantized.scales is not None else [])
+    else:
+        warmed = [engine.item_factors]
+    if not all(np.isfinite(array).all() for array in warmed):
+        raise ValueError(f"Model {state.version} has non-finite item factors")
+    rows = np.unique(np.linspace(0, engine.n_base_users - 1, num=min(n_users, engine.n_base_users)).astype(np.int64))
+    if not np.isfinite(engine.user_vectors(rows)).all():
+        raise ValueError(f"Model {state.version} has non-finite user factors")
+    k = min(k, engine.n_items)
+    for exclude_rated in (False, True):
+        for items, scores in engine.recommend_rows(rows, k=k, exclude_rated=exclude_rated):
+            if len(items) != len(scores) or not np.isfinite(scores).all():
+                raise ValueError(f"Model {state.version} returned an invalid recommendation list")
+            if not exclude_rated and not items:
+                raise ValueError(f"Model {state.version} returned no recommendations")
+    if state.store is not None:
+        for row in rows.tolist():
+            cols, _ = state.store.lookup(row, state.store.k)
+            if len(cols) and cols.max() >= engine.n_items:
+                raise ValueError(f"Precomputed store of {state.version} points past the catalogue")
+    if state.neighbours is not None:
+        cols = np.unique(np.linspace(0, engine.n_items - 1, num=min(n_users, engine.n_items)).astype(np.int64))
+        for col in cols.tolist():
+            state.neighbours.lookup(col, state.neighbours.k)
+
+
+class BundleSource:
+    """Newest model = the bundle named by ARTIFACT_ROOT/LATEST (None when there is none)."""
+
+    def __init__(self, root):
+        self.root = root
+
+    def latest(self):
+        return latest_bundle_path(self.root)
+
+
+class MLflowRegistrySource:
+    """Newest model = the newest version of a registered MLflow model, downloaded as an artifact bundle.
+
+    train_model.py logs each bundle under ``artifact_bundle`` in the run that
+    registers the model. A new registry version is downloaded once into
+    ``artifact_root/<bundle version>`` and served from there like any bundle.
+    """
+
+    def __init__(self, model_name, artifact_root, tracking_uri=None, stage=None, artifact_path='artifact_bundle'):
+        self.model_name = model_name
+        self.artifact_root = artifact_root
+        self.tracking_uri = tracking_uri
+        self.stage = stage
+        self.artifact_path = artifact_path
+        self._registry_version = None
+        self._path = None
+
+    def latest(self):
+        from mlflow.tracking import MlflowClient
+        client = MlflowClient(tracking_uri=self.tracking_uri)
+        versions = client.search_model_versions(f"name='{self.model_name}'")
+        if self.stage:
+            versions = [v for v in versions if v.current_stage == self.stage]
+        if not versions:
+            return None
+        newest = max(versions, key=lambda v: int(v.version))
+        if newest.version != self._registry_version:
+            self._path = self._download(newest.run_id)
+            self._registry_version = newest.version
+            logger.info(f"Registry version {newest.version} of {self.model_name} is bundle {self._path}")
+        return self._path
+
+    def _download(self, run_id):
+        import mlflow.artifacts
+        os.makedirs(self.artifact_root, exist_ok=True)
+        staging = tempfile.mkdtemp(prefix='.download-', dir=self.artifact_root)
+        try:
+            local = mlflow.artifacts.download_artifacts(run_id=run_id, artifact_path=self.artifact_path,
+                                                        dst_path=staging, tracking_uri=self.tracking_uri)
+            with open(os.path.join(local, MANIFEST)) as f:
+                version = json.load(f)['version']
+            path = os.path.join(self.artifact_root, version)
+            if not os.path.exists(path):
+                os.replace(local, path)
+            return path
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+
+
+def make_source(kind, artifact_root, model_name='BookRecommenderModel', tracking_uri=None, stage=None):
+    """Build a model source by name: artifacts (the LATEST pointer) or mlflow (the model registry)."""
+    if kind in (None, '', 'artifacts'):
+        return BundleSource(artifact_root)
+    if kind == 'mlflow':
+        return MLflowRegistrySource(model_name, artifact_root, tracking_uri=tracking_uri, stage=stage)
+    raise ValueError(f"Unknown model source: {kind}")
+
+
+class ModelManager:
+    """Owns the served ServingState and swaps in new model versions without downtime.
+
+    ``check`` asks the source for the newest model; a new one is loaded,
+    warmed and smoke-checked off the event loop while the old one keeps
+    serving, then installed with a single reference assignment. Requests read
+    ``current`` once and use that state to the end, so in-flight work finishes
+    on the old version and only later requests see the new one. A failed
+    load or smoke check leaves the old version in place; that bundle is not
+    tried again until the source points somewhere else. Folded-in ratings
+    the new bundle was not trained on are replayed onto it before and again
+    right after the swap, so none are lost in between, then persisted in the
+    new bundle's delta while this worker's delta in the old bundle is deleted.
+    """
+
+    def __init__(self, source, loader, poll_interval=30.0, warm_users=64, on_swap=None):
+        self.source = source
+        self.loader = loader
+        self.poll_interval = poll_interval
+        self.warm_users = warm_users
+        self.on_swap = on_swap
+        self.current = None
+        self.last_error = None
+        self._failed_path = None
+        self._lock = threading.Lock()
+        self._counts = {'checks': 0, 'swaps': 0, 'failures': 0}
+
+    @property
+    def ready(self):
+        return self.current is not None
+
+    def check(self):
+        """Load and install the source's newest model if it is not the one being served; True if swapped."""
+        with self._lock:
+            self._counts['checks'] += 1
+            previous = self.current
+            path = None
+            try:
+                path = self.source.latest()
+                if previous is not None and path == previous.path:
+                    return False
+                if path is not None and path == self._failed_path:
+                    return False
+                start_time = time.time()
+                state = self.loader(path)
+                if previous is not None:
+                    # Only what the new bundle was not trained on, so absorbed ratings leave the overlay
+                    state.fold_in.add_ratings(state.fold_in.unabsorbed(previous.fold_in.ratings()))
+                warm_up(state, n_users=self.warm_users)
+            except Exception as e:
+                self._counts['failures'] += 1
+                self.last_error = f"{type(e).__name__}: {e}"
+                if path is not None:
+                    self._failed_path = path
+                logger.error(f"Model load failed, still serving {previous.version if previous else 'nothing'}: {e}")
+                return False
+            self.current = state
+            self.last_error = None
+            self._failed_path = None
+            self._counts['swaps'] += 1
+            if previous is not None:
+                # Ratings that reached the old model while the new one was loading
+                state.fold_in.add_ratings(state.fold_in.unabsorbed(previous.fold_in.ratings()))
+                if state.path != previous.path:
+                    # The new bundle's delta now holds whatever was not absorbed, so the old file can go
+                    if state.fold_in.dirty:
+                        state.fold_in.compact()
+                    previous.fold_in.discard()
+            logger.info(f"Now serving model {state.version} (was {previous.version if previous else 'none'}), "
+                        f"loaded and warmed in {time.time() - start_time:.1f}s")
+        if self.on_swap is not None:
+            self.on_swap(previous, state)
+        return True
+
+    async def watch(self):
+        """Poll the source every poll_interval seconds, loading new versions in a worker thread."""
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await loop.run_in_executor(None, self.check)
+            except Exception:
+                # One bad poll (e.g. a failing on_swap hook) must not end hot-swapping for good
+                logger.exception("Model check failed")
+
+    def stats(self):
+        state = self.current
+        return {
+            **self._counts,
+            'ready': state is not None,
+            'version': state.version if state else None,
+            'path': state.path if state else None,
+            'loaded_at': state.loaded_at if state else None,
+            'last_error': self.last_error
+        }
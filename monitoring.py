@@ -1,28 +1,52 @@
+import os
+import time
+
+import pandas as pd
 import streamlit as st
-import boto3
 
-# Initialize DynamoDB client
-dynamodb = boto3.resource('dynamodb', region_name='us-east-1')
-table = dynamodb.Table('BookRecommendations')
+from rollups import Rollup, RollupStore
 
-st.title("Model Monitoring Dashboard")
+# Rollups are written by the backend's prediction logger; the dashboard never reads raw prediction records
+store = RollupStore(os.getenv('ROLLUP_DB', 'rollups.db'))
 
-# Fetch recent predictions
-response = table.scan(
-    Limit=100  # Limit to 100 items for performance
-)
-items = response['Items']
+st.title("Model Monitoring Dashboard")
 
-# Calculate average latency
-latencies = [float(item['latency']) for item in items if 'latency' in item]
-avg_latency = sum(latencies) / len(latencies) if latencies else 0
+ranges = {"Last hour": 3600, "Last 6 hours": 6 * 3600, "Last 24 hours": 86400, "Last 7 days": 7 * 86400,
+          "Last 30 days": 30 * 86400}
+label = st.selectbox("Time range", list(ranges), index=2)
+end = int(time.time())
+start = end - ranges[label]
+# Minute buckets for short ranges, hour buckets beyond that: at most a few hundred rows either way
+resolution = 'minute' if ranges[label] <= 6 * 3600 else 'hour'
 
-# Rating distribution
-ratings = [float(item['predicted_rating']) for item in items if 'predicted_rating' in item]
-rating_counts = {i: ratings.count(i) for i in set(ratings)}
+buckets = store.query(resolution, start, end)
+total = Rollup()
+for _, rollup in buckets:
+    total.merge(rollup)
+summary = total.summary()
 
 # Display metrics
 st.header("Monitoring Metrics")
-st.metric("Average Prediction Latency", f"{avg_latency:.2f} seconds")
-st.subheader("Predicted Rating Distribution")
-st.bar_chart(rating_counts)
+if not total.count:
+    st.info("No predictions logged in this time range.")
+else:
+    columns = st.columns(4)
+    columns[0].metric("Predictions", f"{summary['count']:,}")
+    columns[1].metric("Mean Latency", f"{summary['mean_latency'] * 1000:.1f} ms")
+    columns[2].metric("p95 Latency", f"{summary['p95_latency'] * 1000:.1f} ms")
+    columns[3].metric("p99 Latency", f"{summary['p99_latency'] * 1000:.1f} ms")
+
+    timeline = pd.DataFrame(
+        [{"time": pd.to_datetime(bucket, unit='s'), "predictions": rollup.count,
+          "p50 latency (ms)": rollup.sketch.quantile(0.5) * 1000,
+          "p95 latency (ms)": rollup.sketch.quantile(0.95) * 1000}
+         for bucket, rollup in buckets]
+    ).set_index("time")
+    st.subheader(f"Predictions per {resolution}")
+    st.line_chart(timeline["predictions"])
+    st.subheader("Latency")
+    st.line_chart(timeline[["p50 latency (ms)", "p95 latency (ms)"]])
+
+    st.subheader("Predicted Rating Distribution")
+    histogram = total.rating_histogram()
+    st.bar_chart(pd.Series(list(histogram.values()), index=[f"{edge:.2f}" for edge in histogram], name="count"))
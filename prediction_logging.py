@@ -0,0 +1,284 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from contextlib import nullcontext
+from decimal import Decimal
+
+import boto3
+
+logger = logging.getLogger(__name__)
+
+DYNAMODB_BATCH_SIZE = 25  # BatchWriteItem accepts at most 25 items per request
+
+
+class MemorySink:
+    """In-process sink that keeps records in a list, for tests and offline runs."""
+
+    def __init__(self):
+        self.records = []
+
+    def write_batch(self, records):
+        self.records.extend(records)
+
+    def close(self):
+        pass
+
+
+class JSONLSink:
+    """Append records to a local JSON-lines file."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def write_batch(self, records):
+        with open(self.path, 'a') as f:
+            for record in records:
+                f.write(json.dumps(record) + '\n')
+
+    def close(self):
+        pass
+
+
+class SQLiteSink:
+    """Store records in a local SQLite table."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS predictions ("
+            "user_id TEXT, item_id TEXT, predicted_rating REAL, timestamp INTEGER, latency REAL)"
+        )
+        self._conn.commit()
+
+    def write_batch(self, records):
+        rows = [(r['user_id'], r['item_id'], r['predicted_rating'], r['timestamp'], r['latency']) for r in records]
+        with self._lock:
+            self._conn.executemany("INSERT INTO predictions VALUES (?, ?, ?, ?, ?)", rows)
+            self._conn.commit()
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class DynamoDBSink:
+    """Write records to the BookRecommendations table with batch_writer (25 items per request)."""
+
+    def __init__(self, table_name='BookRecommendations', region_name='us-east-1'):
+        self.table = boto3.resource('dynamodb', region_name=region_name).Table(table_name)
+        self._key_attributes = None
+
+    def write_batch(self, records):
+        if self._key_attributes is None:
+            # From the table itself (one DescribeTable), so the dedupe below always matches its real key
+            self._key_attributes = [key['AttributeName'] for key in self.table.key_schema]
+        # BatchWriteItem rejects a whole request that puts the same key twice; keep the last record per key
+        with self.table.batch_writer(overwrite_by_pkeys=self._key_attributes) as writer:
+            for record in records:
+                writer.put_item(Item={
+                    'user_id': record['user_id'],
+                    'item_id': record['item_id'],
+                    'predicted_rating': Decimal(str(record['predicted_rating'])),
+                    'timestamp': int(record['timestamp']),
+                    'latency': Decimal(str(record['latency']))
+                })
+
+    def close(self):
+        pass
+
+
+class TeeSink:
+    """Write each batch to the primary sink, then feed it to secondary sinks (e.g. rollups).
+
+    If the primary write fails the secondaries are skipped, so they never hold
+    records the primary lacks; the batch is spilled and can be backfilled
+    from there. A secondary failure is logged and counted but never fails the
+    batch, so the primary sink's retry/spill handling stays in charge of
+    persistence.
+    """
+
+    def __init__(self, primary, secondaries):
+        self.primary = primary
+        self.secondaries = list(secondaries)
+        self.secondary_errors = 0
+
+    def write_batch(self, records):
+        self.primary.write_batch(records)
+        for sink in self.secondaries:
+            try:
+                sink.write_batch(records)
+            except Exception as e:
+                self.secondary_errors += 1
+                logger.error(f"{type(sink).__name__} write of {len(records)} records failed: {e}")
+
+    def close(self):
+        for sink in self.secondaries + [self.primary]:
+            sink.close()
+
+
+def make_sink(kind, path=None):
+    """Build a sink by name: dynamodb, jsonl, sqlite or memory."""
+    if kind == 'dynamodb':
+        return DynamoDBSink()
+    if kind == 'jsonl':
+        return JSONLSink(path or 'predictions.jsonl')
+    if kind == 'sqlite':
+        return SQLiteSink(path or 'predictions.db')
+    if kind == 'memory':
+        return MemorySink()
+    raise ValueError(f"Unknown prediction log sink: {kind}")
+
+
+class PredictionLogger:
+    """Write-behind queue for prediction records.
+
+    ``log`` never blocks the request: records go onto a bounded in-memory
+    queue and a background task flushes them to the sink in batches. When the
+    queue is full, or a batch cannot be written, records are either spilled to
+    a local JSONL file (``overflow='spill'``) or dropped (``overflow='drop'``).
+    Spilling happens on the writer thread, never in ``log``: records that
+    overflow the queue wait in a second buffer of the same bound, and are
+    dropped (and counted) once that is full too.
+    An optional ``stage_timer`` (stage name -> context manager) times each
+    sink write as the ``persist`` stage.
+    """
+
+    def __init__(self, sink, max_queue=10000, batch_size=DYNAMODB_BATCH_SIZE, flush_interval=1.0,
+                 overflow='spill', spill_path='prediction_spill.jsonl', stage_timer=None):
+        if overflow not in ('spill', 'drop'):
+            raise ValueError("overflow must be 'spill' or 'drop'")
+        self.sink = sink
+        self.max_queue = max_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.overflow = overflow
+        self.spill_path = spill_path
+        self.stage_timer = stage_timer
+        self.written = 0
+        self.dropped = 0
+        self.spilled = 0
+        self.failed_batches = 0
+        self._to_spill = []
+        # log() appends on the event loop while the writer thread takes the list
+        self._spill_lock = threading.Lock()
+        self._queue = None
+        self._worker = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            "queue_depth": self.queue_depth,
+            "written": self.written,
+            "dropped": self.dropped,
+            "spilled": self.spilled,
+            "failed_batches": self.failed_batches
+        }
+
+    def start(self):
+        if self._worker is None or self._worker.done():
+            if self._queue is None:
+                self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._worker = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        """Stop the background task and flush everything still queued."""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        loop = asyncio.get_running_loop()
+        while self._queue is not None and not self._queue.empty():
+            batch = self._drain(self.batch_size)
+            await loop.run_in_executor(None, self._write, batch)
+        await loop.run_in_executor(None, self._spill_pending)
+        self.sink.close()
+
+    def log(self, user_id, item_id, predicted_rating, latency, timestamp=None):
+        """Queue one prediction record without waiting on the sink."""
+        record = {
+            'user_id': user_id,
+            'item_id': item_id,
+            'predicted_rating': float(predicted_rating),
+            'timestamp': int(timestamp if timestamp is not None else time.time()),
+            'latency': float(latency)
+        }
+        self.start()
+        try:
+            self._queue.put_nowait(record)
+        except asyncio.QueueFull:
+            # Overloaded: no file I/O here, the writer thread spills these after its next batch
+            with self._spill_lock:
+                spill = self.overflow == 'spill' and len(self._to_spill) < self.max_queue
+                if spill:
+                    self._to_spill.append(record)
+            if not spill:
+                self.dropped += 1
+
+    def _spill_pending(self):
+        with self._spill_lock:
+            records, self._to_spill = self._to_spill, []
+        if records:
+            self._overflow(records)
+
+    def _overflow(self, records):
+        if self.overflow == 'drop':
+            self.dropped += len(records)
+            return
+        try:
+            JSONLSink(self.spill_path).write_batch(records)
+            self.spilled += len(records)
+        except OSError as e:
+            logger.error(f"Spill to {self.spill_path} failed: {e}")
+            self.dropped += len(records)
+
+    def _drain(self, limit):
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    def _write(self, batch):
+        try:
+            with self.stage_timer('persist') if self.stage_timer is not None else nullcontext():
+                self.sink.write_batch(batch)
+            self.written += len(batch)
+        except Exception as e:
+            logger.error(f"Prediction log write of {len(batch)} records failed: {e}")
+            self.failed_batches += 1
+            self._overflow(batch)
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = []
+            try:
+                batch.append(await self._queue.get())
+                deadline = loop.time() + self.flush_interval
+                while len(batch) < self.batch_size:
+                    batch.extend(self._drain(self.batch_size - len(batch)))
+                    timeout = deadline - loop.time()
+                    if len(batch) >= self.batch_size or timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # Shutting down mid-collection: don't lose what was already dequeued
+                if batch:
+                    self._write(batch)
+                raise
+            await loop.run_in_executor(None, self._write, batch)
+            if self._to_spill:
+                await loop.run_in_executor(None, self._spill_pending)
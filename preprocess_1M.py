@@ -1,13 +1,18 @@
-import pandas as pd
+import logging
+import os
+from ingest_jsonl import ingest
+from kcore import build_k_core
 
-# Process 18GB Books.jsonl to create 1M 5-core dataset
-chunk_size = 1000000
-chunks = []
-for chunk in pd.read_json('Books.jsonl', lines=True, chunksize=chunk_size, nrows=2000000):
-    chunks.append(chunk[['user_id', 'parent_asin', 'rating', 'timestamp']])  # Keep timestamp
-df = pd.concat(chunks).sample(n=1000000, random_state=42)
-df = df.sort_values('timestamp').groupby(['user_id', 'parent_asin'])[['rating', 'timestamp']].last().reset_index()
-df = df.groupby('user_id').filter(lambda x: len(x) >= 5)
-df = df.groupby('parent_asin').filter(lambda x: len(x) >= 5)
-df.to_parquet('books_5core_1M.parquet')
-print("Created books_5core_1M.parquet")
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+# Process 18GB Books.jsonl to create a 1M-sample 5-core dataset (SAMPLE_SIZE=0 keeps the full dump)
+input_file = 'Books.jsonl'
+partition_dir = 'books_parquet_all'
+output_file = 'books_5core_1M.parquet'
+sample_size = int(os.getenv('SAMPLE_SIZE', '1000000')) or None
+
+if __name__ == '__main__':
+    if not os.path.isdir(partition_dir):
+        ingest(input_file, partition_dir, min_rating=0)
+    build_k_core(partition_dir, output_file, k=5, sample=sample_size, seed=42)
+    print(f"Created {output_file}")
@@ -0,0 +1,189 @@
+import json
+import logging
+import os
+
+import numpy as np
+
+from artifacts import commit_staged, staged_memmap, write_json_atomic
+from serving_engine import top_k_indices
+
+logger = logging.getLogger(__name__)
+
+QUANTIZED_MANIFEST = 'quantized.json'
+MODES = ('float16', 'int8')
+
+
+def quantize(item_factors, mode):
+    """Quantize factors x items to (codes, scales); int8 uses one float32 scale per item column."""
+    item_factors = np.asarray(item_factors, dtype=np.float32)
+    if mode == 'float16':
+        return item_factors.astype(np.float16), None
+    if mode == 'int8':
+        scales = np.abs(item_factors).max(axis=0) / 127.0
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(item_factors / scales), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    raise ValueError(f"Unknown quantization mode: {mode}")
+
+
+class QuantizedItems:
+    """Quantized item factors for shortlist scoring, plus items-major float32 vectors for exact re-ranking.
+
+    Approximate scores for every item come from the float16 or int8 codes,
+    converted one column block at a time so the float32 copy never exists.
+    Only the shortlist is then re-scored exactly, reading one contiguous
+    row of ``vectors`` per item, so a memory-mapped exact copy stays mostly
+    on disk. Loaded from a bundle, ``vectors`` is only mapped when the first
+    re-rank needs it.
+    """
+
+    def __init__(self, mode, codes, scales, vectors, shortlist=100, block_size=8192, manifest=None,
+                 vectors_path=None, mmap_mode='r'):
+        self.mode = mode
+        self.codes = codes
+        self.scales = scales
+        self._vectors = vectors
+        self._vectors_path = vectors_path
+        self._mmap_mode = mmap_mode
+        self.shortlist = shortlist
+        self.block_size = block_size
+        self.manifest = manifest or {}
+
+    @classmethod
+    def from_factors(cls, item_factors, mode, **kwargs):
+        codes, scales = quantize(item_factors, mode)
+        vectors = np.ascontiguousarray(np.asarray(item_factors, dtype=np.float32).T)
+        return cls(mode, codes, scales, vectors, **kwargs)
+
+    @classmethod
+    def load(cls, directory, mode, mmap_mode='r', **kwargs):
+        with open(os.path.join(directory, QUANTIZED_MANIFEST)) as f:
+            manifest = json.load(f)
+        if mode not in manifest['modes']:
+            raise ValueError(f"No {mode} factors in {directory}")
+        codes = np.load(os.path.join(directory, f'item_factors_{mode}.npy'), mmap_mode=mmap_mode)
+        scales = np.load(os.path.join(directory, 'item_scales.npy'), mmap_mode=mmap_mode) if mode == 'int8' else None
+        vectors_path = os.path.join(directory, 'item_vectors.npy')
+        return cls(mode, codes, scales, None, manifest=manifest, vectors_path=vectors_path, mmap_mode=mmap_mode,
+                   **kwargs)
+
+    @property
+    def vectors(self):
+        if self._vectors is None:
+            self._vectors = np.load(self._vectors_path, mmap_mode=self._mmap_mode)
+        return self._vectors
+
+    @property
+    def version(self):
+        return self.manifest.get('model_version')
+
+    @property
+    def n_items(self):
+        return self.codes.shape[1]
+
+    @property
+    def nbytes(self):
+        """Bytes of the quantized codes and scales that scoring reads for every request."""
+        return self.codes.nbytes + (self.scales.nbytes if self.scales is not None else 0)
+
+    def approximate_scores(self, user_vectors):
+        """Scores of every item from the quantized codes, shape (n_users, n_items)."""
+        user_vectors = np.atleast_2d(np.asarray(user_vectors, dtype=np.float32))
+        scores = np.empty((len(user_vectors), self.n_items), dtype=np.float32)
+        for start in range(0, self.n_items, self.block_size):
+            end = min(start + self.block_size, self.n_items)
+            block = user_vectors @ self.codes[:, start:end].astype(np.float32)
+            if self.scales is not None:
+                block *= self.scales[start:end]
+            scores[:, start:end] = block
+        return scores
+
+    def top_k(self, user_vectors, k, exclude=None):
+        """Top-k item columns and exact scores: quantized shortlist, then float32 re-rank, -inf padded.
+
+        ``exclude`` is an optional list of per-user item-column arrays that
+        must not be returned (e.g. already-rated items).
+        """
+        user_vectors = np.atleast_2d(np.asarray(user_vectors, dtype=np.float32))
+        scores = self.approximate_scores(user_vectors)
+        if exclude is not None:
+            for i, cols in enumerate(exclude):
+                scores[i, cols] = -np.inf
+        shortlist = top_k_indices(scores, max(self.shortlist, k))
+        excluded = ~np.isfinite(np.take_along_axis(scores, shortlist, axis=1))
+        exact = np.einsum('ijf,if->ij', self.vectors[shortlist.ravel()].reshape(*shortlist.shape, -1), user_vectors)
+        exact[excluded] = -np.inf
+        best = top_k_indices(exact, k)
+        return np.take_along_axis(shortlist, best, axis=1), np.take_along_axis(exact, best, axis=1)
+
+
+def save_quantized(directory, item_factors, modes=MODES, version=None):
+    """Write the quantized item factors for each mode and the items-major float32 vectors next to a bundle.
+
+    The bundle may be live, so every file is staged first, renamed into place
+    once all are written and the manifest is replaced last.
+    """
+    os.makedirs(directory, exist_ok=True)
+    staged = []
+
+    def stage(name, array):
+        path = os.path.join(directory, name)
+        out = staged_memmap(path, array.dtype, array.shape)
+        out[:] = array
+        staged.append((out, path))
+
+    sizes = {}
+    for mode in modes:
+        codes, scales = quantize(item_factors, mode)
+        stage(f'item_factors_{mode}.npy', codes)
+        if scales is not None:
+            stage('item_scales.npy', scales)
+        sizes[mode] = int(codes.nbytes + (scales.nbytes if scales is not None else 0))
+    stage('item_vectors.npy', np.ascontiguousarray(np.asarray(item_factors, dtype=np.float32).T))
+    for out, path in staged:
+        commit_staged(out, path)
+    manifest = {'model_version': version, 'modes': list(modes), 'bytes': sizes}
+    write_json_atomic(os.path.join(directory, QUANTIZED_MANIFEST), manifest)
+    return manifest
+
+
+def has_quantized(directory):
+    return os.path.exists(os.path.join(directory, QUANTIZED_MANIFEST))
+
+
+def quantization_report(user_factors, item_factors, matrix, modes=MODES, k=5, threshold=2, shortlist=100,
+                        n_users=2000, random_state=42):
+    """Memory saved and accuracy change of quantized scoring against full precision, per mode.
+
+    ``precision_delta`` is precision@k of quantized shortlist + exact re-rank
+    minus full-precision precision@k against ``matrix`` on a sample of users;
+    ``rank_agreement`` is the mean overlap of the two top-k lists, and
+    ``shortlist_agreement`` the same without the exact re-rank.
+    """
+    rng = np.random.default_rng(random_state)
+    rows = np.sort(rng.choice(matrix.shape[0], size=min(n_users, matrix.shape[0]), replace=False))
+    queries = np.asarray(user_factors[rows], dtype=np.float32)
+    item_factors = np.asarray(item_factors)
+    exact = top_k_indices(queries @ item_factors.astype(np.float32), k)
+    relevant = matrix[rows]
+
+    def precision(top):
+        return float((np.asarray(relevant[np.arange(len(rows))[:, None], top].todense()) >= threshold).mean())
+
+    def agreement(top):
+        return float(np.mean([len(np.intersect1d(a, b)) / k for a, b in zip(top, exact)]))
+
+    full_precision = precision(exact)
+    report = {}
+    for mode in modes:
+        quantized = QuantizedItems.from_factors(item_factors, mode, shortlist=shortlist)
+        reranked, _ = quantized.top_k(queries, k)
+        report[mode] = {
+            'item_mb': quantized.nbytes / 2 ** 20,
+            'saved_mb': (item_factors.nbytes - quantized.nbytes) / 2 ** 20,
+            'precision_delta': precision(reranked) - full_precision,
+            'rank_agreement': agreement(reranked),
+            'shortlist_agreement': agreement(top_k_indices(quantized.approximate_scores(queries), k))
+        }
+        logger.info(f"{mode}: {report[mode]}")
+    return report
@@ -0,0 +1,290 @@
+import asyncio
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+class SQLiteCacheBackend:
+    """Cache entries shared by every worker on a host through one SQLite file (e.g. under /dev/shm)."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=1.0)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS recommendations ("
+            "version TEXT, user_id TEXT, variant TEXT, value TEXT, expires REAL, "
+            "PRIMARY KEY (version, user_id, variant))"
+        )
+        self._conn.commit()
+
+    def get(self, version, user_id, variant):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires FROM recommendations WHERE version = ? AND user_id = ? AND variant = ?",
+                (version, user_id, variant)
+            ).fetchone()
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def set(self, version, user_id, variant, value, ttl):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO recommendations VALUES (?, ?, ?, ?, ?)",
+                               (version, user_id, variant, json.dumps(value), time.time() + ttl))
+            self._conn.commit()
+
+    def delete_user(self, version, user_id):
+        with self._lock:
+            self._conn.execute("DELETE FROM recommendations WHERE user_id = ?", (user_id,))
+            self._conn.commit()
+
+    def clear(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM recommendations")
+            self._conn.commit()
+
+
+class RedisCacheBackend:
+    """Cache entries in Redis (or any Redis-compatible server), one hash per (version, user) with a TTL."""
+
+    def __init__(self, url='redis://localhost:6379/0', prefix='rec'):
+        import redis
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+
+    def _key(self, version, user_id):
+        return f'{self.prefix}:{version}:{user_id}'
+
+    def get(self, version, user_id, variant):
+        value = self.client.hget(self._key(version, user_id), variant)
+        return json.loads(value) if value is not None else None
+
+    def set(self, version, user_id, variant, value, ttl):
+        key = self._key(version, user_id)
+        with self.client.pipeline() as pipe:
+            pipe.hset(key, variant, json.dumps(value))
+            pipe.expire(key, int(max(ttl, 1)))
+            pipe.execute()
+
+    def delete_user(self, version, user_id):
+        self.client.delete(self._key(version, user_id))
+
+    def clear(self):
+        for key in self.client.scan_iter(f'{self.prefix}:*'):
+            self.client.delete(key)
+
+
+def make_cache_backend(kind, url=None):
+    """Build a shared cache backend by name: none, sqlite or redis."""
+    if kind in (None, '', 'none'):
+        return None
+    if kind == 'sqlite':
+        return SQLiteCacheBackend(url or '/dev/shm/recommendation_cache.db')
+    if kind == 'redis':
+        return RedisCacheBackend(url or 'redis://localhost:6379/0')
+    raise ValueError(f"Unknown recommendation cache backend: {kind}")
+
+
+class RecommendationCache:
+    """Bounded LRU/TTL cache of top-k results keyed by (model version, user_id, k, exclude_rated, revision).
+
+    Concurrent misses for the same key share one computation (single-flight).
+    ``invalidate_user`` drops a user's entries after their ratings change and
+    bumps the generation of any computation in flight for that user, so it is
+    returned but not stored. ``revision`` identifies the user's folded-in
+    ratings (e.g. the latest rating timestamp), so a worker that has not
+    synced a rating yet cannot write a stale result where up-to-date workers
+    read. A model reload changes the version in the key; ``clear`` frees the
+    old entries. An optional shared backend lets every worker reuse results
+    computed by any of them. Backend calls block (SQLite locks, network round
+    trips), so the async methods run them on a small thread pool of their
+    own; only the local LRU is touched, always on the event loop.
+    """
+
+    def __init__(self, max_entries=10000, ttl=300.0, backend=None, clock=time.monotonic, backend_threads=4):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.backend = backend
+        self.clock = clock
+        self._executor = ThreadPoolExecutor(backend_threads, thread_name_prefix='rec-cache') if backend else None
+        self._entries = OrderedDict()
+        self._user_keys = {}
+        # user_id -> [generation, computations in flight], only while some are
+        self._generations = {}
+        self._inflight = {}
+        self._loop = None
+        self._counts = {'hits': 0, 'misses': 0, 'backend_hits': 0, 'coalesced': 0, 'evictions': 0,
+                        'expirations': 0, 'invalidations': 0, 'backend_errors': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _remove(self, key):
+        self._entries.pop(key, None)
+        keys = self._user_keys.get(key[1])
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._user_keys[key[1]]
+
+    def _store(self, key, value):
+        self._entries[key] = (self.clock() + self.ttl, value)
+        self._entries.move_to_end(key)
+        self._user_keys.setdefault(key[1], set()).add(key)
+        while len(self._entries) > self.max_entries:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self._counts['evictions'] += 1
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is not None:
+            if entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self._counts['hits'] += 1
+                return entry[1]
+            self._remove(key)
+            self._counts['expirations'] += 1
+        return None
+
+    @staticmethod
+    def _variant(key):
+        version, user_id, k, exclude_rated, revision = key
+        return f'{k}:{int(exclude_rated)}:{revision}'
+
+    def _backend_get(self, key):
+        try:
+            value = self.backend.get(str(key[0]), key[1], self._variant(key))
+        except Exception as e:
+            self._counts['backend_errors'] += 1
+            logger.warning(f"Recommendation cache backend read failed: {e}")
+            return None
+        return tuple(value) if value is not None else None
+
+    def _backend_set(self, key, value):
+        try:
+            self.backend.set(str(key[0]), key[1], self._variant(key), list(value), self.ttl)
+        except Exception as e:
+            self._counts['backend_errors'] += 1
+            logger.warning(f"Recommendation cache backend write failed: {e}")
+
+    def _backend_delete(self, version, user_id):
+        try:
+            self.backend.delete_user(str(version), user_id)
+        except Exception as e:
+            self._counts['backend_errors'] += 1
+            logger.warning(f"Recommendation cache backend delete failed: {e}")
+
+    def _in_backend_thread(self, fn, *args):
+        return asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def get(self, version, user_id, k, exclude_rated, revision=0):
+        """Cached (items, scores) or None, checking the shared backend after the local LRU (blocking)."""
+        key = (version, user_id, k, exclude_rated, revision)
+        value = self._get_local(key)
+        if value is None and self.backend is not None:
+            value = self._backend_get(key)
+            if value is not None:
+                self._store(key, value)
+                self._counts['backend_hits'] += 1
+        return value
+
+    def put(self, version, user_id, k, exclude_rated, value, revision=0):
+        key = (version, user_id, k, exclude_rated, revision)
+        self._store(key, value)
+        if self.backend is not None:
+            self._backend_set(key, value)
+
+    async def get_or_compute(self, version, user_id, k, exclude_rated, compute, revision=0):
+        """Return the cached result or await compute() once, however many callers miss concurrently."""
+        self._loop = asyncio.get_running_loop()
+        key = (version, user_id, k, exclude_rated, revision)
+        value = self._get_local(key)
+        if value is not None:
+            return value
+        pending = self._inflight.get(key)
+        if pending is not None:
+            self._counts['coalesced'] += 1
+            return await asyncio.shield(pending)
+        future = self._loop.create_future()
+        self._inflight[key] = future
+        current = self._generations.setdefault(user_id, [0, 0])
+        current[1] += 1
+        generation = current[0]
+        try:
+            value = await self._in_backend_thread(self._backend_get, key) if self.backend is not None else None
+            if value is not None:
+                self._counts['backend_hits'] += 1
+            else:
+                self._counts['misses'] += 1
+                value = await compute()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            future.set_exception(e)
+            future.exception()  # mark retrieved when nobody else was waiting
+            raise
+        finally:
+            del self._inflight[key]
+            current[1] -= 1
+            if not current[1]:
+                del self._generations[user_id]
+        if current[0] == generation:
+            self._store(key, value)
+            if self.backend is not None:
+                # Written behind the response; a failed write only costs a later miss
+                self._in_backend_thread(self._backend_set, key, value)
+        future.set_result(value)
+        return value
+
+    async def invalidate_user(self, user_id, version=None):
+        """Drop every cached result for user_id, locally and in the shared backend."""
+        self._loop = asyncio.get_running_loop()
+        current = self._generations.get(user_id)
+        if current is not None:
+            current[0] += 1
+        for key in list(self._user_keys.get(user_id, ())):
+            self._remove(key)
+        self._counts['invalidations'] += 1
+        if self.backend is not None:
+            await self._in_backend_thread(self._backend_delete, version, user_id)
+
+    def clear(self):
+        """Drop every local entry, e.g. after the served model changes; safe to call from any thread.
+
+        Off the event loop (e.g. from a model swap in a worker thread) the
+        entries are dropped by a callback scheduled on the loop.
+        """
+        loop = self._loop
+        try:
+            on_loop = asyncio.get_running_loop() is loop
+        except RuntimeError:
+            on_loop = False
+        if loop is None or on_loop or loop.is_closed():
+            self._clear_local()
+        else:
+            loop.call_soon_threadsafe(self._clear_local)
+
+    def _clear_local(self):
+        self._entries.clear()
+        self._user_keys.clear()
+
+    def stats(self):
+        hits = self._counts['hits'] + self._counts['backend_hits'] + self._counts['coalesced']
+        lookups = hits + self._counts['misses']
+        return {
+            **self._counts,
+            'size': len(self._entries),
+            'max_entries': self.max_entries,
+            'ttl': self.ttl,
+            'hit_rate': hits / lookups if lookups else 0.0
+        }
@@ -0,0 +1,256 @@
+import argparse
+import json
+import logging
+import math
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+RESOLUTIONS = {'minute': 60, 'hour': 3600}
+RATING_BIN_WIDTH = 0.25
+
+
+class LatencySketch:
+    """Mergeable quantile sketch with bounded relative error (DDSketch-style log buckets).
+
+    A value x > 0 goes to bucket ceil(log_gamma(x)) with
+    gamma = (1 + a) / (1 - a), so any quantile is returned within relative
+    error ``a`` of the true value. Merging two sketches adds bucket counts,
+    which makes per-minute sketches combine exactly into hours or ranges.
+    """
+
+    def __init__(self, relative_accuracy=0.01, buckets=None, zero_count=0):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self.gamma)
+        self.buckets = buckets if buckets is not None else {}
+        self.zero_count = zero_count
+
+    @property
+    def count(self):
+        return self.zero_count + sum(self.buckets.values())
+
+    def add(self, value, count=1):
+        if value <= 1e-9:
+            self.zero_count += count
+            return
+        index = math.ceil(math.log(value) / self._log_gamma)
+        self.buckets[index] = self.buckets.get(index, 0) + count
+
+    def merge(self, other):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Cannot merge sketches with different relative accuracy")
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        return self
+
+    def quantile(self, q):
+        """Approximate q-th quantile (0 <= q <= 1), or None for an empty sketch."""
+        total = self.count
+        if not total:
+            return None
+        rank = q * (total - 1)
+        running = self.zero_count
+        if running > rank:
+            return 0.0
+        for index in sorted(self.buckets):
+            running += self.buckets[index]
+            if running > rank:
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    def to_dict(self):
+        return {'a': self.relative_accuracy, 'z': self.zero_count, 'b': {str(i): c for i, c in self.buckets.items()}}
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['a'], {int(i): c for i, c in data['b'].items()}, data['z'])
+
+
+class Rollup:
+    """Aggregate of the predictions in one time bucket: count, latency sum and sketch, rating histogram."""
+
+    def __init__(self, count=0, latency_sum=0.0, sketch=None, ratings=None):
+        self.count = count
+        self.latency_sum = latency_sum
+        self.sketch = sketch if sketch is not None else LatencySketch()
+        self.ratings = ratings if ratings is not None else {}
+
+    def add(self, latency, predicted_rating):
+        self.count += 1
+        self.latency_sum += latency
+        self.sketch.add(latency)
+        rating_bin = math.floor(predicted_rating / RATING_BIN_WIDTH)
+        self.ratings[rating_bin] = self.ratings.get(rating_bin, 0) + 1
+
+    def merge(self, other):
+        self.count += other.count
+        self.latency_sum += other.latency_sum
+        self.sketch.merge(other.sketch)
+        for rating_bin, count in other.ratings.items():
+            self.ratings[rating_bin] = self.ratings.get(rating_bin, 0) + count
+        return self
+
+    @property
+    def mean_latency(self):
+        return self.latency_sum / self.count if self.count else None
+
+    def rating_histogram(self):
+        """{lower edge of the rating bin: count}, in rating order."""
+        return {rating_bin * RATING_BIN_WIDTH: self.ratings[rating_bin] for rating_bin in sorted(self.ratings)}
+
+    def summary(self):
+        return {
+            'count': self.count,
+            'mean_latency': self.mean_latency,
+            'p50_latency': self.sketch.quantile(0.5),
+            'p95_latency': self.sketch.quantile(0.95),
+            'p99_latency': self.sketch.quantile(0.99)
+        }
+
+
+def bucket_start(timestamp, resolution):
+    seconds = RESOLUTIONS[resolution]
+    return int(timestamp) // seconds * seconds
+
+
+class RollupStore:
+    """Per-minute and per-hour rollups in one SQLite table, shared safely by every worker on a host.
+
+    Each write merges into the stored bucket inside a single IMMEDIATE
+    transaction, so concurrent writers never lose each other's counts.
+    Reading a time range touches only the buckets in that range.
+    """
+
+    def __init__(self, path='rollups.db'):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5.0, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS rollups ("
+            "resolution TEXT, bucket_start INTEGER, count INTEGER, latency_sum REAL, sketch TEXT, ratings TEXT, "
+            "PRIMARY KEY (resolution, bucket_start))"
+        )
+
+    def merge(self, rollups):
+        """Merge {(resolution, bucket_start): Rollup} into the stored buckets."""
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                for (resolution, start), rollup in rollups.items():
+                    row = self._conn.execute(
+                        "SELECT count, latency_sum, sketch, ratings FROM rollups "
+                        "WHERE resolution = ? AND bucket_start = ?", (resolution, start)
+                    ).fetchone()
+                    merged = Rollup().merge(rollup)
+                    if row is not None:
+                        merged.merge(self._decode(row))
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO rollups VALUES (?, ?, ?, ?, ?, ?)",
+                        (resolution, start, merged.count, merged.latency_sum, json.dumps(merged.sketch.to_dict()),
+                         json.dumps({str(b): c for b, c in merged.ratings.items()}))
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    @staticmethod
+    def _decode(row):
+        count, latency_sum, sketch, ratings = row
+        return Rollup(count, latency_sum, LatencySketch.from_dict(json.loads(sketch)),
+                      {int(b): c for b, c in json.loads(ratings).items()})
+
+    def query(self, resolution, start, end):
+        """[(bucket_start, Rollup)] for buckets starting in [start, end), oldest first."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT bucket_start, count, latency_sum, sketch, ratings FROM rollups "
+                "WHERE resolution = ? AND bucket_start >= ? AND bucket_start < ? ORDER BY bucket_start",
+                (resolution, bucket_start(start, resolution), end)
+            ).fetchall()
+        return [(row[0], self._decode(row[1:])) for row in rows]
+
+    def total(self, resolution, start, end):
+        """All buckets of the range merged into one Rollup."""
+        total = Rollup()
+        for _, rollup in self.query(resolution, start, end):
+            total.merge(rollup)
+        return total
+
+    def prune(self, resolution, before):
+        with self._lock:
+            deleted = self._conn.execute("DELETE FROM rollups WHERE resolution = ? AND bucket_start < ?",
+                                         (resolution, before)).rowcount
+        return deleted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+class RollupSink:
+    """Prediction log sink that folds each batch into per-minute and per-hour rollups.
+
+    A batch becomes one merge transaction with a handful of buckets, however
+    many records it holds. Minute buckets older than ``minute_retention``
+    seconds are pruned at most once per ``prune_interval``; hour buckets are
+    kept.
+    """
+
+    def __init__(self, store, minute_retention=7 * 86400, prune_interval=3600, clock=time.time):
+        self.store = store
+        self.minute_retention = minute_retention
+        self.prune_interval = prune_interval
+        self.clock = clock
+        self._last_prune = 0.0
+
+    def write_batch(self, records):
+        rollups = {}
+        for record in records:
+            for resolution in RESOLUTIONS:
+                key = (resolution, bucket_start(record['timestamp'], resolution))
+                rollups.setdefault(key, Rollup()).add(record['latency'], record['predicted_rating'])
+        self.store.merge(rollups)
+        now = self.clock()
+        if now - self._last_prune >= self.prune_interval:
+            self._last_prune = now
+            self.store.prune('minute', now - self.minute_retention)
+
+    def close(self):
+        self.store.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Backfill rollups from prediction records in JSON-lines files")
+    parser.add_argument('paths', nargs='+', help="predictions.jsonl or prediction_spill.jsonl files")
+    parser.add_argument('--db', default='rollups.db')
+    parser.add_argument('--batch-size', type=int, default=10000)
+    args = parser.parse_args()
+
+    sink = RollupSink(RollupStore(args.db), minute_retention=float('inf'))
+    total = 0
+    for path in args.paths:
+        batch = []
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    batch.append(json.loads(line))
+                if len(batch) >= args.batch_size:
+                    sink.write_batch(batch)
+                    total += len(batch)
+                    batch = []
+        if batch:
+            sink.write_batch(batch)
+            total += len(batch)
+    sink.close()
+    logger.info(f"Rolled up {total} prediction records into {args.db}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,203 @@
+from contextlib import nullcontext
+
+import numpy as np
+from scipy.sparse import csr_matrix
+
+from trainers import projector_from_manifest
+
+
+def top_k_indices(scores, k):
+    """Return the indices of the k highest scores in each row, best first."""
+    scores = np.atleast_2d(scores)
+    n_items = scores.shape[1]
+    k = min(k, n_items)
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < n_items:
+        part = np.argpartition(scores, n_items - k, axis=1)[:, n_items - k:]
+    else:
+        part = np.broadcast_to(np.arange(n_items), scores.shape).copy()
+    part_scores = np.take_along_axis(scores, part, axis=1)
+    order = np.argsort(-part_scores, axis=1, kind='stable')
+    return np.take_along_axis(part, order, axis=1)
+
+
+def _untimed(stage):
+    return nullcontext()
+
+
+class RecommenderEngine:
+    """Serving-side view of a factor model, built once at startup.
+
+    Holds the user factors for every known user (``svd.transform`` of the full
+    matrix), the item factors (``svd.components_``) and a user_id -> row map,
+    so a request is one row-times-matrix product plus an argpartition top-k.
+
+    The base arrays may be read-only memory maps. Users folded in after
+    startup (new users, or existing users with new ratings) live in a small
+    writable overlay that takes precedence over the base factors.
+    """
+
+    def __init__(self, user_factors, item_factors, user_ids, item_ids, rated=None, version=None, projector=None):
+        self.user_factors = np.ascontiguousarray(user_factors, dtype=np.float32)
+        self.item_factors = np.ascontiguousarray(item_factors, dtype=np.float32)
+        self.user_ids = np.asarray(user_ids)
+        self.item_ids = np.asarray(item_ids)
+        self.user_index = {user_id: row for row, user_id in enumerate(self.user_ids.tolist())}
+        self.item_index = {item_id: col for col, item_id in enumerate(self.item_ids.tolist())}
+        self.rated = csr_matrix(rated) if rated is not None else None
+        self.version = version
+        self.projector = projector
+        self._overlay_buffer = np.empty((16, self.item_factors.shape[0]), dtype=np.float32)
+        self.overlay_factors = self._overlay_buffer[:0]
+        self.overlay_rows = {}
+        self.overlay_rated = {}
+        self.n_new_users = 0
+        self.new_user_ids = []
+        self.ann = None
+        self.nprobe = None
+        self.quantized = None
+        self.stage_timer = _untimed
+
+    @classmethod
+    def from_model(cls, model, matrix, user_ids, item_ids):
+        """Build the engine from a fitted TruncatedSVD-like model and the CSR user-item matrix."""
+        matrix = csr_matrix(matrix)
+        user_factors = model.transform(matrix)
+        return cls(user_factors, model.components_, user_ids, item_ids, rated=matrix,
+                   projector=getattr(model, 'fold_in', None))
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        """Build the engine from an artifact bundle without copying its memory-mapped arrays."""
+        return cls(bundle.user_factors, bundle.item_factors, bundle.user_ids.tolist(), bundle.item_ids.tolist(),
+                   rated=bundle.matrix, version=bundle.version, projector=projector_from_manifest(bundle.manifest))
+
+    @property
+    def n_base_users(self):
+        return self.user_factors.shape[0]
+
+    @property
+    def n_users(self):
+        return self.n_base_users + self.n_new_users
+
+    @property
+    def n_items(self):
+        return self.item_factors.shape[1]
+
+    def user_row(self, user_id):
+        """Return the factor row for user_id, raising KeyError for unknown users."""
+        return self.user_index[user_id]
+
+    def rated_items(self, row):
+        """Item columns the user in this row has rated, including folded-in ratings."""
+        if row in self.overlay_rated:
+            return self.overlay_rated[row]
+        if self.rated is None or row >= self.rated.shape[0]:
+            return np.empty(0, dtype=np.int32)
+        return self.rated.indices[self.rated.indptr[row]:self.rated.indptr[row + 1]]
+
+    def project(self, item_cols, ratings):
+        """Fold a rating row into factor space, like ``model.transform`` of that sparse row."""
+        if self.projector is not None:
+            return self.projector(self.item_factors, item_cols, ratings)
+        return self.item_factors[:, item_cols] @ np.asarray(ratings, dtype=np.float32)
+
+    def set_user_factors(self, user_id, factors, rated_cols):
+        """Install folded-in factors for user_id, adding a new row for unknown users."""
+        row = self.user_index.get(user_id)
+        if row is None:
+            row = self.n_base_users + self.n_new_users
+        factors = np.asarray(factors, dtype=np.float32).reshape(-1)
+        # Always write a fresh slot past the published rows, then publish a longer view and repoint the row, so
+        # concurrent scoring never sees a partial write; the buffer doubles when full, so appends are amortised
+        # O(1). An updated user's old slot is simply left unused.
+        position = len(self.overlay_factors)
+        if position == len(self._overlay_buffer):
+            buffer = np.empty((2 * position, self._overlay_buffer.shape[1]), dtype=np.float32)
+            buffer[:position] = self._overlay_buffer[:position]
+            self._overlay_buffer = buffer
+        self._overlay_buffer[position] = factors
+        self.overlay_factors = self._overlay_buffer[:position + 1]
+        self.overlay_rows[row] = position
+        self.overlay_rated[row] = np.unique(np.asarray(rated_cols, dtype=np.int32))
+        if user_id not in self.user_index:
+            self.n_new_users += 1
+            self.user_index[user_id] = row
+            self.new_user_ids.append(user_id)
+        return row
+
+    def user_vectors(self, rows):
+        """Factor rows for the given user rows, taking folded-in users from the overlay."""
+        if not self.overlay_rows:
+            return self.user_factors[rows]
+        overlay, overlay_rows = self.overlay_factors, self.overlay_rows
+        vectors = np.empty((len(rows), self.item_factors.shape[0]), dtype=np.float32)
+        for out_row, row in enumerate(rows.tolist()):
+            position = overlay_rows.get(row)
+            if position is not None and position < len(overlay):
+                vectors[out_row] = overlay[position]
+            else:
+                vectors[out_row] = self.user_factors[row]
+        return vectors
+
+    def score_rows(self, rows):
+        """Predicted ratings for the given user rows, shape (len(rows), n_items)."""
+        return self._score_vectors(self.user_vectors(rows))
+
+    def _score_vectors(self, vectors):
+        scores = vectors @ self.item_factors
+        if not np.isfinite(scores).all():
+            scores = np.nan_to_num(scores, nan=0.0, posinf=0.0, neginf=0.0)
+        return scores
+
+    def _mask_rated(self, scores, rows):
+        for out_row, row in enumerate(rows.tolist()):
+            scores[out_row, self.rated_items(row)] = -np.inf
+
+    def use_ann(self, index, nprobe=32):
+        """Retrieve candidates from an IVF index and re-rank only those, instead of scoring every item."""
+        self.ann = index
+        self.nprobe = nprobe
+
+    def use_quantized(self, quantized):
+        """Shortlist from float16/int8 item factors and re-rank the shortlist exactly."""
+        self.quantized = quantized
+
+    def instrument(self, stage_timer):
+        """Time the transform/score/topk stages with stage_timer(stage), a context manager factory."""
+        self.stage_timer = stage_timer
+
+    def top_k_rows(self, rows, k=5, exclude_rated=False):
+        """Top-k item columns and scores for a block of user rows."""
+        rows = np.asarray(rows, dtype=np.int64)
+        timer = self.stage_timer
+        with timer('transform'):
+            vectors = self.user_vectors(rows)
+        if self.ann is not None or self.quantized is not None:
+            exclude = [self.rated_items(row) for row in rows.tolist()] if exclude_rated else None
+            # Candidate scoring and the top-k selection are one call here, timed together
+            with timer('score'):
+                if self.ann is not None:
+                    return self.ann.search(vectors, k, nprobe=self.nprobe, exclude=exclude)
+                return self.quantized.top_k(vectors, k, exclude=exclude)
+        with timer('score'):
+            scores = self._score_vectors(vectors)
+            if exclude_rated:
+                self._mask_rated(scores, rows)
+        with timer('topk'):
+            top = top_k_indices(scores, k)
+            return top, np.take_along_axis(scores, top, axis=1)
+
+    def recommend_rows(self, rows, k=5, exclude_rated=False):
+        """Return one (item_ids, scores) pair per user row, scored as a single matrix product."""
+        top, top_scores = self.top_k_rows(rows, k=k, exclude_rated=exclude_rated)
+        results = []
+        for items, scores in zip(top, top_scores):
+            keep = np.isfinite(scores)
+            results.append((self.item_ids[items[keep]].tolist(), scores[keep].tolist()))
+        return results
+
+    def recommend(self, user_id, k=5, exclude_rated=False):
+        """Return (item_ids, scores) of the top-k items for user_id, best first."""
+        return self.recommend_rows([self.user_row(user_id)], k=k, exclude_rated=exclude_rated)[0]
@@ -0,0 +1,146 @@
+import hashlib
+import inspect
+import json
+import logging
+import os
+import shutil
+import time
+from contextlib import contextmanager
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy.sparse import issparse, load_npz, save_npz
+
+logger = logging.getLogger(__name__)
+
+MANIFEST = 'outputs.json'
+
+
+def path_fingerprint(path):
+    """Cheap identity of a local file or directory tree: relative paths, sizes and mtimes."""
+    if not os.path.exists(path):
+        return {'path': path, 'missing': True}
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        return {'path': path, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    files = []
+    for directory, _, names in sorted(os.walk(path)):
+        for name in sorted(names):
+            stat = os.stat(os.path.join(directory, name))
+            files.append([os.path.relpath(os.path.join(directory, name), path), stat.st_size, stat.st_mtime_ns])
+    return {'path': path, 'files': files}
+
+
+def code_fingerprint(*objects):
+    """Hash of the source of functions, classes or modules, so editing a stage's code changes its key."""
+    digest = hashlib.sha256()
+    for obj in objects:
+        digest.update(inspect.getsource(obj).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def save_outputs(directory, outputs):
+    kinds = {}
+    for name, value in outputs.items():
+        if issparse(value):
+            save_npz(os.path.join(directory, f'{name}.npz'), value.tocsr())
+            kinds[name] = 'sparse'
+        elif isinstance(value, np.ndarray) and value.dtype != object:
+            np.save(os.path.join(directory, f'{name}.npy'), value)
+            kinds[name] = 'array'
+        elif isinstance(value, pd.DataFrame):
+            value.to_parquet(os.path.join(directory, f'{name}.parquet'), index=False)
+            kinds[name] = 'frame'
+        else:
+            joblib.dump(value, os.path.join(directory, f'{name}.pkl'))
+            kinds[name] = 'pickle'
+    with open(os.path.join(directory, MANIFEST), 'w') as f:
+        json.dump(kinds, f)
+
+
+def load_outputs(directory):
+    with open(os.path.join(directory, MANIFEST)) as f:
+        kinds = json.load(f)
+    outputs = {}
+    for name, kind in kinds.items():
+        if kind == 'sparse':
+            outputs[name] = load_npz(os.path.join(directory, f'{name}.npz')).tocsr()
+        elif kind == 'array':
+            outputs[name] = np.load(os.path.join(directory, f'{name}.npy'))
+        elif kind == 'frame':
+            outputs[name] = pd.read_parquet(os.path.join(directory, f'{name}.parquet'))
+        else:
+            outputs[name] = joblib.load(os.path.join(directory, f'{name}.pkl'))
+    return outputs
+
+
+class StageCache:
+    """On-disk cache of pipeline stage outputs, addressed by a hash of each stage's inputs.
+
+    A stage's key covers its name, parameters, input fingerprints, the source
+    of the code it runs and the keys of the stages it depends on, so changing
+    anything upstream changes every key downstream while an unchanged stage
+    is loaded instead of recomputed.
+    Stages named in ``force`` (or every stage, with 'all') always rerun.
+    """
+
+    def __init__(self, root='.stage_cache', force=()):
+        self.root = root
+        self.force = set(force)
+        self.keys = {}
+        self.timings = {}
+        self.cached = {}
+
+    def key(self, name, params=None, inputs=None, depends=(), code=()):
+        payload = {
+            'stage': name,
+            'params': params or {},
+            'inputs': inputs or {},
+            'depends': {stage: self.keys[stage] for stage in depends}
+        }
+        if code:
+            payload['code'] = code_fingerprint(*code)
+        encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+        return hashlib.sha256(encoded).hexdigest()[:16]
+
+    def run(self, name, fn, params=None, inputs=None, depends=(), code=()):
+        """Return the outputs dict of fn(), loading it from the cache when the key is unchanged.
+
+        ``code`` lists the functions and modules fn runs; their source is part
+        of the key.
+        """
+        key = self.keys[name] = self.key(name, params, inputs, depends, code)
+        path = os.path.join(self.root, name, key)
+        start = time.time()
+        forced = name in self.force or 'all' in self.force
+        if not forced and os.path.exists(os.path.join(path, MANIFEST)):
+            outputs = load_outputs(path)
+            self.cached[name] = True
+            logger.info(f"Stage {name}: loaded cached outputs {key} in {time.time() - start:.1f}s")
+        else:
+            outputs = fn()
+            tmp_path = f'{path}.tmp-{os.getpid()}'
+            shutil.rmtree(tmp_path, ignore_errors=True)
+            os.makedirs(tmp_path)
+            save_outputs(tmp_path, outputs)
+            shutil.rmtree(path, ignore_errors=True)
+            os.replace(tmp_path, path)
+            self.cached[name] = False
+            logger.info(f"Stage {name}: computed and cached {key} in {time.time() - start:.1f}s")
+        self.timings[name] = time.time() - start
+        return outputs
+
+    @contextmanager
+    def timed(self, name):
+        """Record the wall time of an uncached step alongside the stage timings."""
+        start = time.time()
+        yield
+        self.timings[name] = time.time() - start
+        logger.info(f"Stage {name}: {self.timings[name]:.1f}s")
+
+    def mlflow_metrics(self):
+        return {f'stage_{name}_seconds': seconds for name, seconds in self.timings.items()}
+
+    def mlflow_params(self):
+        return {f'stage_{name}_cached': cached for name, cached in self.cached.items()}
@@ -0,0 +1,216 @@
+import argparse
+import itertools
+import json
+import logging
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import joblib
+import numpy as np
+import pandas as pd
+from scipy.sparse import csr_matrix, load_npz
+from sklearn.model_selection import train_test_split
+from threadpoolctl import threadpool_limits
+
+from evaluation import evaluate
+from matrix_builder import build_user_item_matrix
+from trainers import make_trainer
+
+logger = logging.getLogger(__name__)
+
+# Trial keys that configure evaluation rather than the trainer
+EVAL_KEYS = ('k', 'threshold')
+# Metrics where lower is better when picking the best trial
+MINIMIZE = ('rmse', 'seconds')
+
+# Train/test split memory-mapped once per worker by the initializer
+_shared = {}
+
+
+def save_csr(directory, name, matrix):
+    matrix = csr_matrix(matrix)
+    matrix.sort_indices()
+    np.save(os.path.join(directory, f'{name}_data.npy'), matrix.data.astype(np.float32))
+    np.save(os.path.join(directory, f'{name}_indices.npy'), matrix.indices.astype(np.int32))
+    np.save(os.path.join(directory, f'{name}_indptr.npy'), matrix.indptr.astype(np.int64))
+    np.save(os.path.join(directory, f'{name}_shape.npy'), np.asarray(matrix.shape, dtype=np.int64))
+
+
+def load_csr(directory, name, mmap_mode='r'):
+    """Open a CSR matrix written by save_csr; the arrays stay memory-mapped."""
+    arrays = [np.load(os.path.join(directory, f'{name}_{part}.npy'), mmap_mode=mmap_mode)
+              for part in ('data', 'indices', 'indptr')]
+    shape = tuple(np.load(os.path.join(directory, f'{name}_shape.npy')).tolist())
+    return csr_matrix(tuple(arrays), shape=shape, copy=False)
+
+
+def prepare_split(matrix, work_dir, test_size=0.2, random_state=42):
+    """Split the rating matrix by user, as train_model.py does, and write both halves as .npy files."""
+    os.makedirs(work_dir, exist_ok=True)
+    train_matrix, test_matrix = train_test_split(csr_matrix(matrix), test_size=test_size, random_state=random_state)
+    save_csr(work_dir, 'train', train_matrix)
+    save_csr(work_dir, 'test', test_matrix)
+    logger.info(f"Prepared split in {work_dir}: {train_matrix.shape[0]} train and {test_matrix.shape[0]} test users")
+    return work_dir
+
+
+def _sample(choice, rng):
+    if isinstance(choice, dict):
+        low, high = choice['low'], choice['high']
+        if choice.get('log'):
+            value = float(np.exp(rng.uniform(np.log(low), np.log(high))))
+        else:
+            value = float(rng.uniform(low, high))
+        return int(round(value)) if isinstance(low, int) and isinstance(high, int) else value
+    if isinstance(choice, list):
+        return choice[rng.integers(len(choice))]
+    return choice
+
+
+def expand_spec(spec):
+    """Trial configurations for a search spec.
+
+    ``{"search": "grid", "params": {name: [values]}}`` takes the cartesian
+    product. ``{"search": "random", "n_trials": n, "params": ...}`` samples
+    each parameter from a list, or from ``{"low", "high", "log"}`` ranges.
+    ``fixed`` entries are added to every trial; ``trainer`` defaults to 'svd'.
+    """
+    params = spec.get('params', {})
+    fixed = {'trainer': spec.get('trainer', 'svd'), **spec.get('fixed', {})}
+    if spec.get('search', 'grid') == 'grid':
+        names = list(params)
+        values = [value if isinstance(value, list) else [value] for value in params.values()]
+        return [{**fixed, **dict(zip(names, combo))} for combo in itertools.product(*values)]
+    rng = np.random.default_rng(spec.get('seed', 42))
+    return [{**fixed, **{name: _sample(choice, rng) for name, choice in params.items()}}
+            for _ in range(spec.get('n_trials', 10))]
+
+
+def _init_worker(split_dir, blas_threads):
+    if blas_threads:
+        threadpool_limits(limits=blas_threads)
+    _shared.update(train=load_csr(split_dir, 'train'), test=load_csr(split_dir, 'test'), blas_threads=blas_threads)
+
+
+def run_trial(task):
+    """Fit and evaluate one configuration against the shared split. Runs in a pool worker."""
+    index, trial, model_dir = task
+    params = {name: value for name, value in trial.items() if name != 'trainer' and name not in EVAL_KEYS}
+    if trial['trainer'] != 'svd' and _shared['blas_threads']:
+        params.setdefault('n_threads', _shared['blas_threads'])
+    try:
+        model = make_trainer(trial['trainer'], **params)
+        fit_start = time.time()
+        model.fit_transform(_shared['train'])
+        fit_seconds = time.time() - fit_start
+        k, threshold = trial.get('k', 5), trial.get('threshold', 2)
+        test_metrics = evaluate(model.transform(_shared['test']), model.components_, _shared['test'],
+                                k=k, threshold=threshold)
+    except Exception as e:
+        logger.error(f"Trial {index} {trial} failed: {e}")
+        return {'index': index, 'trial': trial, 'error': str(e)}
+    model_path = os.path.join(model_dir, f'trial-{index:03d}.pkl')
+    joblib.dump(model, model_path)
+    metrics = {
+        'test_rmse_observed': test_metrics['rmse'],
+        f'test_precision_{k}': test_metrics[f'precision_at_{k}'],
+        f'test_recall_{k}': test_metrics[f'recall_at_{k}'],
+        f'test_ndcg_{k}': test_metrics[f'ndcg_at_{k}'],
+        'fit_seconds': fit_seconds
+    }
+    if hasattr(model, 'best_validation_rmse_'):
+        metrics['validation_rmse'] = model.best_validation_rmse_
+    logger.info(f"Trial {index} {trial}: {metrics}")
+    return {'index': index, 'trial': trial, 'metrics': metrics, 'model_path': model_path}
+
+
+def run_sweep(split_dir, trials, model_dir, n_jobs=None, blas_threads=1):
+    """Run every trial over the prepared split, n_jobs at a time with BLAS capped at blas_threads each."""
+    os.makedirs(model_dir, exist_ok=True)
+    tasks = [(index, trial, model_dir) for index, trial in enumerate(trials)]
+    n_jobs = n_jobs or os.cpu_count() or 1
+    if n_jobs == 1:
+        _init_worker(split_dir, None)
+        results = [run_trial(task) for task in tasks]
+        _shared.clear()
+        return results
+    with ProcessPoolExecutor(max_workers=n_jobs, initializer=_init_worker, initargs=(split_dir, blas_threads)) as pool:
+        return list(pool.map(run_trial, tasks))
+
+
+def best_result(results, metric):
+    """The successful trial with the best value of metric; rmse and seconds metrics are minimised."""
+    scored = [result for result in results if metric in result.get('metrics', {})]
+    if not scored:
+        return None
+    sign = 1 if any(word in metric for word in MINIMIZE) else -1
+    return min(scored, key=lambda result: sign * result['metrics'][metric])
+
+
+def log_sweep(results, best, spec, metric, tracking_uri=None, experiment='book_recommender_sweep', model_name=None):
+    """Log each trial as a nested MLflow run under one sweep run and register only the best model."""
+    import mlflow
+    import mlflow.sklearn
+
+    if tracking_uri:
+        mlflow.set_tracking_uri(tracking_uri)
+    mlflow.set_experiment(experiment)
+    with mlflow.start_run(run_name='sweep'):
+        mlflow.log_params({'search': spec.get('search', 'grid'), 'n_trials': len(results), 'metric': metric})
+        best_run_id = None
+        for result in results:
+            with mlflow.start_run(run_name=f"trial-{result['index']:03d}", nested=True) as run:
+                mlflow.log_params(result['trial'])
+                if 'error' in result:
+                    mlflow.set_tag('error', result['error'][:500])
+                    continue
+                mlflow.log_metrics(result['metrics'])
+                if result is best:
+                    mlflow.sklearn.log_model(joblib.load(result['model_path']), 'svd_model')
+                    best_run_id = run.info.run_id
+        if best is not None:
+            mlflow.log_params({f'best_{name}': value for name, value in best['trial'].items()})
+            mlflow.log_metrics({f'best_{name}': value for name, value in best['metrics'].items()})
+            if model_name:
+                mlflow.register_model(f"runs:/{best_run_id}/svd_model", model_name)
+
+
+def load_matrix(matrix_path, data_path):
+    if os.path.exists(matrix_path):
+        return load_npz(matrix_path)
+    logger.info(f"{matrix_path} not found, building the matrix from {data_path}")
+    return build_user_item_matrix(pd.read_parquet(data_path))[0]
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    parser = argparse.ArgumentParser(description="Run a grid or random hyperparameter sweep over one prepared split")
+    parser.add_argument('spec', help="JSON search spec (see expand_spec)")
+    parser.add_argument('--matrix', default='user_item_matrix.npz')
+    parser.add_argument('--data', default='books_5core_1M.parquet', help="Used when --matrix does not exist")
+    parser.add_argument('--work-dir', default='sweep')
+    parser.add_argument('--jobs', type=int, default=None, help="Parallel trials (default: CPU count)")
+    parser.add_argument('--blas-threads', type=int, default=1, help="BLAS/ALS threads per trial")
+    parser.add_argument('--metric', default='test_precision_5')
+    parser.add_argument('--tracking-uri', default=os.getenv('MLFLOW_TRACKING_URI', 'file:' + os.path.abspath('mlruns')))
+    parser.add_argument('--register', default='BookRecommenderModel', help="Registered model name for the best trial")
+    args = parser.parse_args()
+
+    with open(args.spec) as f:
+        spec = json.load(f)
+    trials = expand_spec(spec)
+    split_dir = prepare_split(load_matrix(args.matrix, args.data), os.path.join(args.work_dir, 'split'))
+    start = time.time()
+    results = run_sweep(split_dir, trials, os.path.join(args.work_dir, 'models'), n_jobs=args.jobs,
+                        blas_threads=args.blas_threads)
+    logger.info(f"Ran {len(trials)} trials in {time.time() - start:.1f}s")
+    best = best_result(results, args.metric)
+    if best is None:
+        raise SystemExit("Every trial failed")
+    logger.info(f"Best trial {best['index']}: {best['trial']} {args.metric}={best['metrics'][args.metric]:.4f}")
+    log_sweep(results, best, spec, args.metric, tracking_uri=args.tracking_uri, model_name=args.register)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+import numpy as np
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+
+from ann_index import IVFIndex, augment, recall_at_k
+from serving_engine import RecommenderEngine
+
+
+def test_augment_preserves_inner_product_order():
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((40, 5)) * rng.uniform(0.1, 3, (40, 1))
+    query = rng.standard_normal(5)
+    augmented = augment(vectors)
+    np.testing.assert_allclose(np.linalg.norm(augmented, axis=1), 1, rtol=1e-5)
+    np.testing.assert_array_equal(np.argsort(augmented[:, :-1] @ query), np.argsort(vectors @ query))
+
+
+def test_probing_every_list_is_exact(tmp_path):
+    rng = np.random.default_rng(1)
+    item_factors = rng.standard_normal((8, 300)).astype(np.float32)
+    user_factors = rng.standard_normal((50, 8)).astype(np.float32)
+    IVFIndex.build(item_factors, n_lists=12, version="v1").save(str(tmp_path))
+    index = IVFIndex.load(str(tmp_path))
+    assert index.n_lists == 12 and index.version == "v1"
+    assert sorted(index.items.tolist()) == list(range(300))
+    assert recall_at_k(index, user_factors, item_factors, k=10, nprobe=12)['recall'] == 1.0
+    assert recall_at_k(index, user_factors, item_factors, k=10, nprobe=2)['recall'] < 1.0
+
+
+def test_rebuild_leaves_a_loaded_index_intact(tmp_path):
+    rng = np.random.default_rng(2)
+    item_factors = rng.standard_normal((8, 300)).astype(np.float32)
+    IVFIndex.build(item_factors, n_lists=12, version="v1").save(str(tmp_path))
+    live = IVFIndex.load(str(tmp_path))
+    vectors = np.array(live.vectors)
+    IVFIndex.build(item_factors * 2, n_lists=6, version="v1").save(str(tmp_path))
+    # The server's mappings still see the old files, a fresh load sees the new ones
+    assert live.n_lists == 12
+    np.testing.assert_array_equal(live.vectors, vectors)
+    assert IVFIndex.load(str(tmp_path)).n_lists == 6
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_engine_ann_mode_excludes_rated():
+    matrix = sparse_random(60, 40, density=0.2, format='csr', random_state=2)
+    matrix.data = np.ceil(matrix.data * 5)
+    svd = TruncatedSVD(n_components=5, random_state=42).fit(matrix)
+    exact = RecommenderEngine.from_model(svd, matrix, [f"U{i}" for i in range(60)], [f"B{i}" for i in range(40)])
+    ann = RecommenderEngine.from_model(svd, matrix, [f"U{i}" for i in range(60)], [f"B{i}" for i in range(40)])
+    ann.use_ann(IVFIndex.build(svd.components_, n_lists=4), nprobe=4)
+    for user_id in ("U0", "U31", "U59"):
+        expected = exact.recommend(user_id, k=10, exclude_rated=True)[0]
+        assert ann.recommend(user_id, k=10, exclude_rated=True)[0] == expected
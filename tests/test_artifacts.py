@@ -0,0 +1,34 @@
+import numpy as np
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+
+from artifacts import StringTable, latest_bundle_path, load_bundle, save_bundle
+from serving_engine import RecommenderEngine
+
+
+def test_string_table_round_trip(tmp_path):
+    strings = ["AE224GVO7OHTYF26U6ER6BEVIUAQ", "", "0486241386", "café"]
+    StringTable.from_strings(strings).save(str(tmp_path), "ids")
+    table = StringTable.load(str(tmp_path), "ids")
+    assert len(table) == 4
+    assert table[3] == "café"
+    assert table.tolist() == strings
+
+
+def test_bundle_serves_same_recommendations_as_model(tmp_path):
+    matrix = (sparse_random(50, 30, density=0.15, format='csr', random_state=1) * 5).tocsr()
+    svd = TruncatedSVD(n_components=6, random_state=42).fit(matrix)
+    user_ids = [f"U{i}" for i in range(50)]
+    item_ids = [f"B{i}" for i in range(30)]
+    save_bundle(str(tmp_path), svd.transform(matrix), svd.components_, matrix, user_ids, item_ids, version="v1")
+
+    bundle = load_bundle(latest_bundle_path(str(tmp_path)))
+    assert bundle.version == "v1"
+    assert isinstance(bundle.user_factors, np.memmap)
+    assert bundle.matrix.nnz == matrix.nnz
+
+    from_bundle = RecommenderEngine.from_bundle(bundle)
+    from_model = RecommenderEngine.from_model(svd, matrix, user_ids, item_ids)
+    for user_id in ("U0", "U17", "U49"):
+        assert from_bundle.recommend(user_id, exclude_rated=True)[0] == \
+            from_model.recommend(user_id, exclude_rated=True)[0]
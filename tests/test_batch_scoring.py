@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+
+from batch_scoring import RecommendationStore, export_json, score_all
+from serving_engine import RecommenderEngine
+
+
+def make_engine():
+    matrix = sparse_random(70, 25, density=0.2, format='csr', random_state=4)
+    matrix.data = np.ceil(matrix.data * 5)
+    svd = TruncatedSVD(n_components=5, random_state=42).fit(matrix)
+    return RecommenderEngine.from_model(svd, matrix, [f"U{i}" for i in range(70)], [f"B{i}" for i in range(25)])
+
+
+def test_store_matches_online_scoring(tmp_path):
+    engine = make_engine()
+    for exclude_rated in (False, True):
+        directory = str(tmp_path / str(exclude_rated))
+        score_all(engine.user_factors, engine.item_factors, directory, rated=engine.rated, k=8,
+                  exclude_rated=exclude_rated, block_size=16, version="v1")
+        store = RecommendationStore.load(directory)
+        assert store.items.dtype == np.int32 and store.scores.dtype == np.float32
+        assert store.version == "v1" and len(store) == 70
+        online = engine.recommend_rows(np.arange(70), k=8, exclude_rated=exclude_rated)
+        for row, (items, scores) in enumerate(online):
+            cols, stored_scores = store.lookup(row, 8)
+            assert engine.item_ids[cols].tolist() == items
+            np.testing.assert_allclose(stored_scores, scores, rtol=1e-5)
+
+
+def test_short_rows_are_padded_and_exported(tmp_path):
+    engine = make_engine()
+    score_all(engine.user_factors, engine.item_factors, str(tmp_path), rated=engine.rated, k=25, exclude_rated=True)
+    store = RecommendationStore.load(str(tmp_path))
+    n_rated = np.diff(engine.rated.indptr)
+    assert ((store.items >= 0).sum(axis=1) == 25 - n_rated).all()
+
+    path = tmp_path / "all.json"
+    export_json(store, engine.user_ids.tolist(), engine.item_ids.tolist(), str(path), k=3)
+    exported = json.loads(path.read_text())
+    assert exported["U0"] == engine.recommend("U0", k=3, exclude_rated=True)[0]
+
+
+def test_rescoring_a_live_bundle_leaves_mapped_store_intact(tmp_path):
+    engine = make_engine()
+    score_all(engine.user_factors, engine.item_factors, str(tmp_path), k=8, version="v1")
+    live = RecommendationStore.load(str(tmp_path))
+    before = np.array(live.items)
+    score_all(engine.user_factors[:10], engine.item_factors, str(tmp_path), k=3, version="v2")
+    # The old mapping still reads complete old rows; a fresh load sees the new store
+    np.testing.assert_array_equal(live.items, before)
+    reloaded = RecommendationStore.load(str(tmp_path))
+    assert reloaded.version == "v2" and reloaded.items.shape == (10, 3)
+    assert not [name for name in os.listdir(tmp_path) if name.endswith('.tmp')]
@@ -0,0 +1,42 @@
+import asyncio
+
+from batching import MicroBatcher
+
+
+def test_concurrent_requests_are_coalesced():
+    seen = []
+
+    def process(requests):
+        seen.append(list(requests))
+        return [request * 2 if request >= 0 else KeyError(request) for request in requests]
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=8, max_wait_ms=20)
+        results = await asyncio.gather(*(batcher.submit(i) for i in range(5)), return_exceptions=True)
+        missing = await asyncio.gather(batcher.submit(-1), return_exceptions=True)
+        stats = batcher.stats()
+        await batcher.stop()
+        return results, missing, stats
+
+    results, missing, stats = asyncio.run(scenario())
+    assert results == [0, 2, 4, 6, 8]
+    assert isinstance(missing[0], KeyError)
+    assert seen[0] == [0, 1, 2, 3, 4]
+    assert stats["batches"] == 2 and stats["requests"] == 6
+
+
+def test_batches_respect_max_batch_size():
+    sizes = []
+
+    def process(requests):
+        sizes.append(len(requests))
+        return requests
+
+    async def scenario():
+        batcher = MicroBatcher(process, max_batch_size=3, max_wait_ms=20)
+        await asyncio.gather(*(batcher.submit(i) for i in range(7)))
+        await batcher.stop()
+
+    asyncio.run(scenario())
+    assert max(sizes) <= 3
+    assert sum(sizes) == 7
@@ -0,0 +1,47 @@
+import os
+
+import pandas as pd
+
+from artifacts import load_bundle
+from benchmark import benchmark_training, compare, synthetic_ratings
+
+
+def test_synthetic_ratings_are_skewed_with_repeated_pairs():
+    df = synthetic_ratings(20000, random_state=1)
+    assert len(df) == 20000
+    assert df['rating'].between(1, 5).all()
+    assert pd.api.types.is_datetime64_any_dtype(df['timestamp'])
+    assert df.duplicated(['user_id', 'parent_asin']).sum() >= 1000
+    # The most active user rates far more than the median one, as on a real marketplace
+    activity = df['user_id'].value_counts()
+    assert activity.iloc[0] > 10 * activity.median()
+
+
+def test_training_stages_are_timed_and_bundle_is_servable(tmp_path):
+    timings, bundle_path = benchmark_training(str(tmp_path), 5000, n_components=8, version='bench')
+    assert list(timings) == ['load', 'dedupe', 'matrix', 'split', 'fit', 'evaluate', 'bundle', 'batch_scoring']
+    assert all(seconds >= 0 for seconds in timings.values())
+    bundle = load_bundle(bundle_path)
+    assert bundle.item_factors.shape[0] == 8
+    assert os.path.exists(os.path.join(bundle_path, 'recommendations_items.npy'))
+    # Not published: serving picks the bundle only when the benchmark points LATEST at it
+    assert not os.path.exists(tmp_path / 'artifacts' / 'LATEST')
+
+
+def test_compare_flags_slower_stages_latencies_and_lower_throughput():
+    baseline = {'scales': {'100k': {
+        'training': {'fit': 1.0, 'split': 0.001},
+        'serving': {'predict': {'rps': 1000.0, 'p99_ms': 2.0, 'errors': 0, 'requests': 100}}
+    }}}
+    same = {'scales': {'100k': {
+        'training': {'fit': 1.1, 'split': 0.01},
+        'serving': {'predict': {'rps': 900.0, 'p99_ms': 2.2, 'errors': 0, 'requests': 100}}
+    }}}
+    assert compare(same, baseline, tolerance=0.25) == []
+
+    worse = {'scales': {'100k': {
+        'training': {'fit': 1.5, 'split': 0.01},
+        'serving': {'predict': {'rps': 500.0, 'p99_ms': 3.0, 'errors': 0, 'requests': 100}}
+    }}}
+    assert sorted(name for name, _, _ in compare(worse, baseline, tolerance=0.25)) == [
+        '100k.serving.predict.p99_ms', '100k.serving.predict.rps', '100k.training.fit']
@@ -0,0 +1,48 @@
+import numpy as np
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+from sklearn.metrics import mean_squared_error
+
+from evaluation import evaluate
+
+
+def make_problem():
+    matrix = sparse_random(90, 40, density=0.1, format='csr', random_state=3)
+    matrix.data = np.ceil(matrix.data * 5)
+    svd = TruncatedSVD(n_components=6, random_state=42)
+    user_factors = svd.fit_transform(matrix)
+    return matrix, user_factors, svd.components_
+
+
+def test_matches_dense_reference():
+    matrix, user_factors, item_factors = make_problem()
+    predicted = user_factors @ item_factors
+    actual = matrix.toarray()
+
+    precisions = []
+    for user_idx in range(actual.shape[0]):
+        top_k_items = np.argsort(predicted[user_idx])[-5:]
+        precisions.append(np.sum(actual[user_idx, top_k_items] >= 2) / 5)
+    observed = actual != 0
+
+    results = evaluate(user_factors, item_factors, matrix, k=5, block_size=16, dense_reference=True)
+    assert np.isclose(results['rmse_dense'], np.sqrt(mean_squared_error(actual, predicted)))
+    assert np.isclose(results['rmse'], np.sqrt(np.mean((predicted[observed] - actual[observed]) ** 2)))
+    assert np.isclose(results['precision_at_5'], np.mean(precisions))
+    assert 0.0 <= results['ndcg_at_5'] <= 1.0 and 0.0 <= results['recall_at_5'] <= 1.0
+
+
+def test_block_size_and_pool_do_not_change_results():
+    matrix, user_factors, item_factors = make_problem()
+    serial = evaluate(user_factors, item_factors, matrix, block_size=7)
+    pooled = evaluate(user_factors, item_factors, matrix, block_size=25, n_jobs=2)
+    for name, value in serial.items():
+        assert np.isclose(value, pooled[name])
+
+
+def test_perfect_ranking_scores_one():
+    matrix, _, _ = make_problem()
+    dense = matrix.toarray()
+    results = evaluate(dense, np.eye(dense.shape[1]), matrix, k=1)
+    assert np.isclose(results['ndcg_at_1'], 1.0)
+    assert np.isclose(results['rmse'], 0.0)
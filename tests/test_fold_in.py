@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+
+from fold_in import FoldInUpdater, append_folded_in, read_deltas
+from matrix_builder import build_user_item_matrix, dedupe_latest
+from serving_engine import RecommenderEngine
+
+
+def make_engine():
+    matrix = (sparse_random(40, 25, density=0.2, format='csr', random_state=5) * 5).tocsr()
+    svd = TruncatedSVD(n_components=5, random_state=42).fit(matrix)
+    user_ids = [f"U{i}" for i in range(40)]
+    item_ids = [f"B{i}" for i in range(25)]
+    return svd, matrix, RecommenderEngine.from_model(svd, matrix, user_ids, item_ids)
+
+
+def test_existing_user_matches_transform_of_updated_row(tmp_path):
+    svd, matrix, engine = make_engine()
+    updater = FoldInUpdater(engine, str(tmp_path))
+    summary = updater.add_ratings([("U3", "B7", 5.0, 10), ("U3", "missing", 4.0, 10)])
+    assert summary == {"accepted": 1, "updated_users": 1, "unknown_items": ["missing"]}
+
+    updated = matrix[3].toarray()
+    updated[0, 7] = 5.0
+    expected = svd.transform(updated)[0]
+    np.testing.assert_allclose(engine.user_vectors(np.array([3]))[0], expected, rtol=1e-4, atol=1e-5)
+    assert "B7" not in engine.recommend("U3", k=25, exclude_rated=True)[0]
+
+
+def test_new_user_is_served_and_delta_survives_restart(tmp_path):
+    _, _, engine = make_engine()
+    updater = FoldInUpdater(engine, str(tmp_path), worker_id="a")
+    updater.add_ratings([("NEW", "B1", 5.0, 1), ("NEW", "B2", 4.0, 2), ("NEW", "B1", 2.0, 3)])
+    books, _ = engine.recommend("NEW", k=5)
+    assert len(books) == 5
+    assert engine.n_users == 41
+    assert updater.compact() == 2
+
+    _, _, restarted = make_engine()
+    assert FoldInUpdater(restarted, str(tmp_path), worker_id="b").load() == 2
+    np.testing.assert_allclose(restarted.user_vectors(np.array([40])), engine.user_vectors(np.array([40])))
+    assert restarted.recommend("NEW", k=5)[0] == books
+
+
+def test_workers_keep_their_own_deltas_and_sync_each_other(tmp_path):
+    _, _, engine_a = make_engine()
+    _, _, engine_b = make_engine()
+    worker_a = FoldInUpdater(engine_a, str(tmp_path), worker_id="a")
+    worker_b = FoldInUpdater(engine_b, str(tmp_path), worker_id="b")
+    worker_a.add_ratings([("U1", "B3", 5.0, 10)])
+    worker_b.add_ratings([("U2", "B4", 1.0, 10), ("U1", "B3", 2.0, 20)])
+    worker_a.compact()
+    worker_b.compact()
+
+    # Neither compaction overwrote the other's ratings, and the later rating of the same pair wins everywhere
+    assert worker_a.sync() == 2 and worker_b.sync() == 1
+    assert worker_a.delta == worker_b.delta
+    assert worker_a.delta["U1"] == {3: (2.0, 20)}
+    assert worker_a.sync() == 0
+    np.testing.assert_allclose(engine_a.user_vectors(np.array([1, 2])), engine_b.user_vectors(np.array([1, 2])))
+    # Synced workers agree on each user's revision, which keys their shared recommendation cache
+    assert worker_a.revision("U1") == worker_b.revision("U1") == 20 and worker_a.revision("U9") == 0
+
+
+def test_overlay_grows_without_copying_per_user():
+    _, _, engine = make_engine()
+    for i in range(100):
+        engine.set_user_factors(f"NEW{i}", np.full(5, i, dtype=np.float32), [0])
+    engine.set_user_factors("NEW3", np.full(5, -1, dtype=np.float32), [0])
+    assert engine.n_new_users == 100
+    assert len(engine._overlay_buffer) == 128
+    np.testing.assert_array_equal(engine.user_vectors(np.array([40 + 3, 40 + 99]))[:, 0], [-1, 99])
+
+
+def test_retrain_input_merges_deltas_into_datetime_parquet(tmp_path):
+    _, _, engine = make_engine()
+    updater = FoldInUpdater(engine, str(tmp_path), worker_id="a")
+    updater.add_ratings([("U1", "B3", 5.0, 1_700_000_000_000), ("NEW", "B4", 4.0, None)])
+    updater.compact()
+    pd.DataFrame({
+        'user_id': pd.Categorical(["U1", "U2"]),
+        'parent_asin': pd.Categorical(["B3", "B4"]),
+        'rating': [1.0, 3.0],
+        'timestamp': pd.to_datetime([1_600_000_000_000, 1_600_000_000_000], unit='ms')
+    }).to_parquet(tmp_path / "ratings.parquet")
+
+    df = pd.read_parquet(tmp_path / "ratings.parquet")
+    ratings = dedupe_latest(append_folded_in(df, read_deltas(str(tmp_path))))
+    matrix, user_ids, item_ids = build_user_item_matrix(ratings, time_col=None)
+    dense = pd.DataFrame(matrix.toarray(), index=user_ids, columns=item_ids)
+    # The newer folded-in rating replaces the dump's, and a brand-new user is trained on
+    assert dense.loc["U1", "B3"] == 5.0 and dense.loc["NEW", "B4"] == 4.0 and dense.loc["U2", "B4"] == 3.0
@@ -0,0 +1,46 @@
+import json
+
+import pandas as pd
+
+from ingest_jsonl import ingest, read_lines_in_range, validate_record
+
+
+def write_reviews(path, n=300):
+    lines = []
+    for i in range(n):
+        lines.append(json.dumps({
+            'user_id': f"U{i % 17}", 'parent_asin': f"B{i % 11}", 'rating': float(i % 5 + 1),
+            'timestamp': 1600000000000 + i, 'text': "x" * (i % 40), 'title': "a \"quoted\" title"
+        }))
+    lines.insert(5, "{not json")
+    lines.insert(9, json.dumps({'user_id': "U1", 'parent_asin': "B1", 'rating': "5", 'timestamp': 1}))
+    path.write_text("\n".join(lines) + "\n")
+    return n
+
+
+def test_ranges_cover_every_line_exactly_once(tmp_path):
+    path = tmp_path / "reviews.jsonl"
+    write_reviews(path)
+    size = path.stat().st_size
+    pieces = [read_lines_in_range(str(path), start, min(start + 97, size)) for start in range(0, size, 97)]
+    assert b"".join(pieces) == path.read_bytes()
+
+
+def test_ingest_filters_and_projects(tmp_path):
+    path = tmp_path / "reviews.jsonl"
+    n = write_reviews(path)
+    out = tmp_path / "parquet"
+    totals = ingest(str(path), str(out), workers=2, chunk_bytes=1024, min_rating=2)
+
+    df = pd.read_parquet(out)
+    assert list(df.columns) == ['user_id', 'parent_asin', 'rating', 'timestamp']
+    assert totals['invalid'] == 2 and totals['lines'] == n + 2
+    assert len(df) == totals['rows'] == sum(1 for i in range(n) if i % 5 + 1 >= 2)
+    assert df['rating'].min() >= 2
+
+
+def test_validate_record_rejects_bad_types():
+    assert validate_record({'user_id': "U", 'parent_asin': "B", 'rating': 4, 'timestamp': 5}) == ("U", "B", 4.0, 5)
+    assert validate_record({'user_id': "U", 'parent_asin': "B", 'rating': True, 'timestamp': 5}) is None
+    assert validate_record({'user_id': "", 'parent_asin': "B", 'rating': 4, 'timestamp': 5}) is None
+    assert validate_record([1, 2]) is None
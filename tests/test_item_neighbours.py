@@ -0,0 +1,41 @@
+import numpy as np
+
+from item_neighbours import NeighbourIndex, build_neighbours, load_normalised_items, normalised_items, similar_items
+
+
+def test_table_matches_brute_force_cosine(tmp_path):
+    rng = np.random.default_rng(1)
+    item_factors = rng.standard_normal((6, 50))
+    item_factors[:, 7] = 0
+    build_neighbours(item_factors, str(tmp_path), k=5, block_size=8, version="v1")
+    index = NeighbourIndex.load(str(tmp_path))
+    assert index.items.dtype == np.int32 and index.scores.dtype == np.float16
+    assert index.version == "v1" and len(index) == 50
+
+    vectors = item_factors.T / np.maximum(np.linalg.norm(item_factors.T, axis=1, keepdims=True), 1e-12)
+    cosine = vectors @ vectors.T
+    np.fill_diagonal(cosine, -np.inf)
+    for col in (0, 13, 49):
+        cols, scores = index.lookup(col, 5)
+        assert col not in cols
+        np.testing.assert_allclose(scores, np.sort(cosine[col])[::-1][:5], atol=1e-3)
+    cols, _ = similar_items(normalised_items(item_factors), [13], 5)
+    assert cols[0].tolist() == index.lookup(13, 5)[0].tolist()
+
+
+def test_k_is_capped_by_catalogue(tmp_path):
+    build_neighbours(np.eye(3), str(tmp_path), k=10)
+    index = NeighbourIndex.load(str(tmp_path))
+    assert index.k == 2
+    assert sorted(index.lookup(0, 10)[0].tolist()) == [1, 2]
+
+
+def test_normalised_items_are_saved_once_per_bundle(tmp_path):
+    item_factors = np.random.default_rng(4).standard_normal((6, 30))
+    first = load_normalised_items(str(tmp_path), item_factors)
+    # Later workers map the saved copy instead of normalising the factors again
+    second = load_normalised_items(str(tmp_path), np.zeros((6, 30)))
+    assert isinstance(second, np.memmap)
+    np.testing.assert_array_equal(first, normalised_items(item_factors))
+    np.testing.assert_array_equal(second, first)
+    assert not list(tmp_path.glob("*.tmp"))
@@ -0,0 +1,42 @@
+import numpy as np
+import pandas as pd
+
+from kcore import build_k_core, k_core_mask
+
+
+def test_k_core_reaches_fixed_point():
+    # Item 3 has only two ratings; dropping it pushes user 3 below k=3 on the second pass
+    users = np.array([0, 0, 0, 1, 1, 1, 2, 2, 2, 3, 3, 3, 4])
+    items = np.array([0, 1, 2, 0, 1, 2, 0, 1, 2, 0, 1, 3, 3])
+    single_pass = (np.bincount(users)[users] >= 3) & (np.bincount(items)[items] >= 3)
+    assert 3 in set(users[single_pass])
+
+    keep = k_core_mask(users, items, k=3)
+    assert set(users[keep]) == {0, 1, 2}
+    assert set(items[keep]) == {0, 1, 2}
+
+
+def test_build_k_core_dedupes_latest_and_filters(tmp_path):
+    rng = np.random.default_rng(1)
+    n = 3000
+    df = pd.DataFrame({
+        'user_id': rng.choice([f"U{i}" for i in range(80)], n),
+        'parent_asin': rng.choice([f"B{i}" for i in range(60)], n),
+        'rating': rng.integers(1, 6, n).astype(np.float32),
+        'timestamp': rng.permutation(n).astype(np.int64) + 1600000000000
+    })
+    parts = tmp_path / "parts"
+    parts.mkdir()
+    df.iloc[:1500].to_parquet(parts / "part-00000.parquet")
+    df.iloc[1500:].to_parquet(parts / "part-00001.parquet")
+
+    out = tmp_path / "core.parquet"
+    build_k_core(str(parts), str(out), k=5)
+    result = pd.read_parquet(out)
+
+    assert not result.duplicated(['user_id', 'parent_asin']).any()
+    assert result['user_id'].value_counts().min() >= 5
+    assert result['parent_asin'].value_counts().min() >= 5
+    latest = df.sort_values('timestamp').groupby(['user_id', 'parent_asin'])['rating'].last()
+    merged = result.set_index(['user_id', 'parent_asin'])['rating']
+    assert (latest.loc[merged.index].values == merged.values).all()
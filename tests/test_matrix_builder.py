@@ -0,0 +1,23 @@
+import numpy as np
+import pandas as pd
+
+from matrix_builder import build_user_item_matrix
+
+
+def test_matches_dedupe_and_pivot():
+    rng = np.random.default_rng(0)
+    n = 400
+    df = pd.DataFrame({
+        'user_id': rng.choice([f"U{i}" for i in range(30)], n),
+        'parent_asin': rng.choice([f"B{i}" for i in range(20)], n),
+        'rating': rng.integers(1, 6, n),
+        'timestamp': pd.to_datetime(rng.permutation(n), unit='s')
+    })
+    deduped = df.sort_values('timestamp').groupby(['user_id', 'parent_asin'])[['rating', 'timestamp']].last()
+    pivot = deduped.reset_index().pivot(index='user_id', columns='parent_asin', values='rating').fillna(0)
+
+    matrix, user_ids, item_ids = build_user_item_matrix(df)
+    assert list(user_ids) == list(pivot.index)
+    assert list(item_ids) == list(pivot.columns)
+    np.testing.assert_array_equal(matrix.toarray(), pivot.values)
+    assert matrix.nnz == len(deduped)
@@ -0,0 +1,75 @@
+import time
+
+from fastapi import FastAPI, HTTPException
+from fastapi.testclient import TestClient
+
+from metrics import Histogram, MetricsMiddleware, MetricsRegistry, SamplingProfiler
+
+
+def test_histogram_buckets_and_quantiles():
+    histogram = Histogram(buckets=(0.001, 0.01, 0.1))
+    for value in [0.0005] * 90 + [0.05] * 9 + [5.0]:
+        histogram.observe(value)
+    assert histogram.counts == [90, 0, 9, 1]
+    assert histogram.quantile(0.5) == 0.001
+    assert histogram.quantile(0.95) == 0.1
+    assert histogram.quantile(1.0) == float('inf')
+
+
+def test_render_prometheus_text():
+    registry = MetricsRegistry(buckets=(0.01, 0.1))
+    registry.describe('serving_stage_seconds', 'histogram', 'Stage time.')
+    registry.observe('serving_stage_seconds', 0.05, stage='score')
+    registry.inc('requests_total', route='/predict', status=200)
+    registry.callback('queue_depth', 'gauge', 'Queued.', lambda: 3)
+    text = registry.render()
+    assert '# TYPE serving_stage_seconds histogram' in text
+    assert 'serving_stage_seconds_bucket{stage="score",le="0.01"} 0' in text
+    assert 'serving_stage_seconds_bucket{stage="score",le="0.1"} 1' in text
+    assert 'serving_stage_seconds_bucket{stage="score",le="+Inf"} 1' in text
+    assert 'serving_stage_seconds_count{stage="score"} 1' in text
+    assert 'requests_total{route="/predict",status="200"} 1' in text
+    assert 'queue_depth 3' in text
+
+
+def test_middleware_counts_routes_errors_and_profiles(tmp_path):
+    registry = MetricsRegistry()
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware, registry=registry, profile_dir=str(tmp_path))
+
+    @app.get("/items/{item_id}")
+    async def item(item_id: str):
+        if item_id == "missing":
+            raise HTTPException(status_code=404)
+        if item_id == "broken":
+            raise HTTPException(status_code=503)
+        return {"item_id": item_id}
+
+    @app.get("/slow")
+    def slow():
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+        return {}
+
+    with TestClient(app) as client:
+        client.get("/items/a")
+        client.get("/items/missing")
+        client.get("/items/broken")
+        response = client.get("/slow", headers={"X-Profile": "1"})
+    text = registry.render()
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="200"} 1' in text
+    assert 'http_requests_total{method="GET",route="/items/{item_id}",status="404"} 1' in text
+    assert 'http_request_errors_total{method="GET",route="/items/{item_id}"} 1' in text
+    assert 'http_requests_in_flight 0' in text
+    profile = (tmp_path / response.headers["x-profile-file"]).read_text()
+    assert "test_metrics.py:slow" in profile
+
+
+def test_sampling_profiler_collapses_stacks():
+    with SamplingProfiler(interval=0.001) as profiler:
+        deadline = time.perf_counter() + 0.05
+        while time.perf_counter() < deadline:
+            pass
+    # The profiler samples other threads, so the main thread's busy loop is in the profile
+    assert any("test_sampling_profiler_collapses_stacks" in line for line in profiler.collapsed().splitlines())
@@ -0,0 +1,120 @@
+import os
+
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+
+from artifacts import save_bundle, set_latest
+from model_manager import BundleSource, ModelManager, load_state, warm_up
+from quantization import save_quantized
+
+
+def base_matrix():
+    return (sparse_random(30, 20, density=0.3, format='csr', random_state=3) * 5).tocsr()
+
+
+def publish(root, version, scale=1.0, matrix=None):
+    rng = np.random.default_rng(3)
+    if matrix is None:
+        matrix = base_matrix()
+    return save_bundle(str(root), rng.standard_normal((30, 4)) * scale, rng.standard_normal((4, 20)), matrix,
+                       [f"U{i}" for i in range(30)], [f"B{i}" for i in range(20)], version=version)
+
+
+def test_swaps_to_new_version_and_keeps_folded_in_ratings(tmp_path):
+    publish(tmp_path, "v1")
+    swaps = []
+    manager = ModelManager(BundleSource(str(tmp_path)), load_state, on_swap=lambda old, new: swaps.append(new.version))
+    assert not manager.ready
+    assert manager.check() and manager.current.version == "v1"
+    assert not manager.check()
+
+    old = manager.current
+    old.fold_in.add_ratings([("NEW", "B2", 5.0, 1)])
+    publish(tmp_path, "v2", scale=2.0)
+    assert manager.check()
+    assert swaps == ["v1", "v2"]
+    # Requests that read the old state keep a complete, working model
+    assert old.version == "v1" and len(old.engine.recommend("U1", k=5)[0]) == 5
+    assert manager.current.engine.recommend("NEW", k=5)[0]
+    # Persisted in the new bundle, since the old bundle's delta is gone
+    assert not manager.current.fold_in.dirty and os.path.exists(manager.current.fold_in.delta_path)
+
+
+def test_swap_to_retrained_bundle_drops_absorbed_ratings(tmp_path):
+    publish(tmp_path, "v1")
+    manager = ModelManager(BundleSource(str(tmp_path)), load_state)
+    manager.check()
+    old = manager.current
+    old.fold_in.add_ratings([("U1", "B2", 5.0, 1), ("U2", "B3", 4.0, 2)])
+    old.fold_in.compact()
+    assert os.path.exists(old.fold_in.delta_path)
+
+    # The retrain absorbed U1's rating but its data cutoff missed U2's
+    retrained = base_matrix().tolil()
+    retrained[1, 2] = 5.0
+    publish(tmp_path, "v2", matrix=retrained.tocsr())
+    assert manager.check()
+    assert len(manager.current.engine.overlay_rows) == 1
+    assert [r[:3] for r in manager.current.fold_in.ratings()] == [("U2", "B3", 4.0)]
+    assert not os.path.exists(old.fold_in.delta_path)
+    assert os.path.exists(manager.current.fold_in.delta_path)
+
+    # Once a retrain absorbs everything the overlay stays empty, however often the model is swapped
+    retrained[2, 3] = 4.0
+    publish(tmp_path, "v3", matrix=retrained.tocsr())
+    assert manager.check()
+    assert manager.current.engine.overlay_rows == {} and manager.current.fold_in.ratings() == []
+
+
+def test_failed_load_keeps_serving_previous_version(tmp_path):
+    publish(tmp_path, "v1")
+    manager = ModelManager(BundleSource(str(tmp_path)), load_state)
+    manager.check()
+    os.makedirs(tmp_path / "broken")
+    (tmp_path / "broken" / "manifest.json").write_text("{")
+    set_latest(str(tmp_path), "broken")
+    assert not manager.check()
+    assert not manager.check()
+    stats = manager.stats()
+    assert stats["version"] == "v1" and stats["failures"] == 1 and stats["last_error"]
+
+
+def test_warm_up_rejects_non_finite_factors(tmp_path):
+    path = publish(tmp_path, "v1")
+    state = load_state(path)
+    warm_up(state)
+    item_factors = np.array(state.engine.item_factors)
+    item_factors[0, 3] = np.nan
+    state.engine.item_factors = item_factors
+    with pytest.raises(ValueError):
+        warm_up(state)
+
+
+def test_unreachable_source_counts_as_failure_and_recovers(tmp_path):
+    class FlakySource(BundleSource):
+        down = True
+
+        def latest(self):
+            if self.down:
+                raise ConnectionError("registry unreachable")
+            return super().latest()
+
+    publish(tmp_path, "v1")
+    source = FlakySource(str(tmp_path))
+    manager = ModelManager(source, load_state)
+    assert not manager.check()
+    assert manager.stats()["failures"] == 1 and "ConnectionError" in manager.last_error
+    source.down = False
+    assert manager.check() and manager.current.version == "v1"
+
+
+def test_quantized_warm_up_reads_codes_not_float32_factors(tmp_path):
+    path = publish(tmp_path, "v1")
+    save_quantized(path, load_state(path).engine.item_factors, version="v1")
+    state = load_state(path, quantization='int8', shortlist=5)
+    assert state.engine.quantized._vectors is None
+    # Poisoned float32 factors would fail warm-up if it paged them in
+    state.engine.item_factors = np.full(state.engine.item_factors.shape, np.nan, dtype=np.float32)
+    warm_up(state)
+    assert state.engine.quantized._vectors is not None
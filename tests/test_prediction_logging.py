@@ -0,0 +1,79 @@
+import asyncio
+import json
+import sqlite3
+
+from prediction_logging import MemorySink, PredictionLogger, SQLiteSink
+
+
+class FailingSink(MemorySink):
+    def write_batch(self, records):
+        raise ConnectionError("sink unavailable")
+
+
+def test_records_are_batched_and_flushed_on_stop():
+    sink = MemorySink()
+    batches = []
+    original = sink.write_batch
+    sink.write_batch = lambda records: (batches.append(len(records)), original(records))
+
+    async def scenario():
+        prediction_logger = PredictionLogger(sink, batch_size=25, flush_interval=0.05)
+        for i in range(60):
+            prediction_logger.log("U1", f"B{i}", 4.5, 0.01)
+        await prediction_logger.stop()
+        return prediction_logger.stats()
+
+    stats = asyncio.run(scenario())
+    assert len(sink.records) == 60
+    assert max(batches) <= 25
+    assert stats["written"] == 60 and stats["queue_depth"] == 0
+
+
+def test_full_queue_spills_to_local_file(tmp_path):
+    spill_path = tmp_path / "spill.jsonl"
+
+    async def scenario():
+        prediction_logger = PredictionLogger(MemorySink(), max_queue=3, spill_path=str(spill_path))
+        for i in range(5):
+            prediction_logger.log("U1", f"B{i}", 3.0, 0.01)
+        # Nothing is written on the event loop; the overflow waits for the writer thread
+        assert prediction_logger.stats()["spilled"] == 0 and not spill_path.exists()
+        await prediction_logger.stop()
+        return prediction_logger.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["spilled"] == 2 and stats["dropped"] == 0
+    spilled = [json.loads(line) for line in spill_path.read_text().splitlines()]
+    assert [r["item_id"] for r in spilled] == ["B3", "B4"]
+
+
+def test_overflow_beyond_the_spill_buffer_is_dropped(tmp_path):
+    async def scenario():
+        prediction_logger = PredictionLogger(MemorySink(), max_queue=2, spill_path=str(tmp_path / "spill.jsonl"))
+        for i in range(7):
+            prediction_logger.log("U1", f"B{i}", 3.0, 0.01)
+        await prediction_logger.stop()
+        return prediction_logger.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["written"] == 2 and stats["spilled"] == 2 and stats["dropped"] == 3
+
+
+def test_failed_writes_are_dropped_when_configured():
+    async def scenario():
+        prediction_logger = PredictionLogger(FailingSink(), overflow='drop')
+        prediction_logger.log("U1", "B1", 3.0, 0.01)
+        await prediction_logger.stop()
+        return prediction_logger.stats()
+
+    stats = asyncio.run(scenario())
+    assert stats["dropped"] == 1 and stats["failed_batches"] == 1
+
+
+def test_sqlite_sink_round_trip(tmp_path):
+    path = str(tmp_path / "predictions.db")
+    sink = SQLiteSink(path)
+    sink.write_batch([{'user_id': 'U1', 'item_id': 'B1', 'predicted_rating': 4.0, 'timestamp': 1, 'latency': 0.1}])
+    sink.close()
+    rows = sqlite3.connect(path).execute("SELECT user_id, item_id FROM predictions").fetchall()
+    assert rows == [("U1", "B1")]
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+
+from quantization import QuantizedItems, quantization_report, quantize, save_quantized
+from serving_engine import RecommenderEngine, top_k_indices
+
+
+def test_int8_error_is_bounded_per_item():
+    rng = np.random.default_rng(0)
+    item_factors = rng.standard_normal((16, 200)) * rng.uniform(0.01, 5, 200)
+    codes, scales = quantize(item_factors, 'int8')
+    assert codes.dtype == np.int8 and scales.shape == (200,)
+    assert (np.abs(codes * scales - item_factors) <= scales / 2 + 1e-6).all()
+    with pytest.raises(ValueError):
+        quantize(item_factors, 'int4')
+
+
+@pytest.mark.parametrize("mode", ["float16", "int8"])
+def test_shortlist_rerank_matches_exact_top_k(tmp_path, mode):
+    rng = np.random.default_rng(1)
+    item_factors = rng.standard_normal((12, 500)).astype(np.float32)
+    users = rng.standard_normal((30, 12)).astype(np.float32)
+    save_quantized(str(tmp_path), item_factors, version="v1")
+    quantized = QuantizedItems.load(str(tmp_path), mode, shortlist=50, block_size=128)
+    assert quantized.version == "v1" and quantized.nbytes < item_factors.nbytes
+    top, scores = quantized.top_k(users, 10)
+    exact = users @ item_factors
+    np.testing.assert_array_equal(top, top_k_indices(exact, 10))
+    np.testing.assert_allclose(scores, np.take_along_axis(exact, top, axis=1), rtol=1e-5)
+
+
+def test_resaving_leaves_a_loaded_copy_intact(tmp_path):
+    rng = np.random.default_rng(2)
+    item_factors = rng.standard_normal((12, 200)).astype(np.float32)
+    save_quantized(str(tmp_path), item_factors, version="v1")
+    live = QuantizedItems.load(str(tmp_path), "int8")
+    codes, vectors = np.array(live.codes), np.array(live.vectors)
+    save_quantized(str(tmp_path), rng.standard_normal((12, 200)), version="v2")
+    np.testing.assert_array_equal(live.codes, codes)
+    np.testing.assert_array_equal(live.vectors, vectors)
+    assert QuantizedItems.load(str(tmp_path), "int8").version == "v2"
+    assert not list(tmp_path.glob("*.tmp"))
+
+
+def test_engine_quantized_mode_and_report():
+    matrix = sparse_random(80, 60, density=0.2, format='csr', random_state=3)
+    matrix.data = np.ceil(matrix.data * 5)
+    svd = TruncatedSVD(n_components=6, random_state=42).fit(matrix)
+    ids = ([f"U{i}" for i in range(80)], [f"B{i}" for i in range(60)])
+    exact = RecommenderEngine.from_model(svd, matrix, *ids)
+    quantized = RecommenderEngine.from_model(svd, matrix, *ids)
+    quantized.use_quantized(QuantizedItems.from_factors(svd.components_, 'int8', shortlist=20))
+    for user_id in ("U0", "U40", "U79"):
+        assert quantized.recommend(user_id, k=5, exclude_rated=True)[0] == \
+            exact.recommend(user_id, k=5, exclude_rated=True)[0]
+
+    report = quantization_report(svd.transform(matrix), svd.components_, matrix, shortlist=20)
+    assert set(report) == {"float16", "int8"}
+    assert report["int8"]["saved_mb"] > report["float16"]["saved_mb"] > 0
+    assert report["int8"]["rank_agreement"] == 1.0 and report["int8"]["precision_delta"] == 0.0
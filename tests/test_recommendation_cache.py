@@ -0,0 +1,145 @@
+import asyncio
+import threading
+import time
+
+from recommendation_cache import RecommendationCache, SQLiteCacheBackend
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_lru_eviction_and_ttl_expiry():
+    clock = FakeClock()
+    cache = RecommendationCache(max_entries=2, ttl=10, clock=clock)
+    cache.put("v1", "U1", 5, False, (["B1"], [1.0]))
+    cache.put("v1", "U2", 5, False, (["B2"], [1.0]))
+    assert cache.get("v1", "U1", 5, False) == (["B1"], [1.0])
+    cache.put("v1", "U3", 5, False, (["B3"], [1.0]))
+    assert cache.get("v1", "U2", 5, False) is None
+    assert cache.get("v2", "U1", 5, False) is None
+    clock.now = 11
+    assert cache.get("v1", "U1", 5, False) is None
+    stats = cache.stats()
+    assert stats["evictions"] == 1 and stats["expirations"] == 1 and stats["hits"] == 1
+
+
+def test_single_flight_and_invalidation():
+    cache = RecommendationCache()
+    calls = []
+
+    async def compute():
+        calls.append(1)
+        await asyncio.sleep(0.01)
+        return (["B1"], [2.0])
+
+    async def run():
+        results = await asyncio.gather(*[cache.get_or_compute("v1", "U1", 5, False, compute) for _ in range(10)])
+        assert all(result == (["B1"], [2.0]) for result in results)
+        assert len(calls) == 1
+        await cache.get_or_compute("v1", "U1", 5, False, compute)
+        assert len(calls) == 1
+
+        # A computation that overlaps an invalidation is returned but not cached
+        pending = asyncio.ensure_future(cache.get_or_compute("v1", "U2", 5, False, compute))
+        await asyncio.sleep(0)
+        await cache.invalidate_user("U2")
+        await pending
+        assert cache.get("v1", "U2", 5, False) is None
+
+        await cache.invalidate_user("U1")
+        await cache.get_or_compute("v1", "U1", 5, False, compute)
+        assert len(calls) == 3
+
+    asyncio.run(run())
+    # Generations are only tracked while a computation for the user is in flight
+    assert cache._generations == {}
+    stats = cache.stats()
+    assert stats["coalesced"] == 9 and stats["misses"] == 3 and stats["invalidations"] == 2
+
+
+def test_errors_reach_every_waiter():
+    cache = RecommendationCache()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise KeyError("U9")
+
+    async def run():
+        return await asyncio.gather(*[cache.get_or_compute("v1", "U9", 5, False, compute) for _ in range(3)],
+                                    return_exceptions=True)
+
+    assert all(isinstance(result, KeyError) for result in asyncio.run(run()))
+    assert len(cache) == 0
+
+
+def test_sqlite_backend_is_shared_between_workers(tmp_path):
+    path = str(tmp_path / "cache.db")
+    worker_a = RecommendationCache(backend=SQLiteCacheBackend(path))
+    worker_b = RecommendationCache(backend=SQLiteCacheBackend(path))
+    worker_a.put("v1", "U1", 5, True, (["B1", "B2"], [3.0, 2.0]))
+    assert worker_b.get("v1", "U1", 5, True) == (["B1", "B2"], [3.0, 2.0])
+    assert worker_b.stats()["backend_hits"] == 1
+    asyncio.run(worker_a.invalidate_user("U1", version="v1"))
+    assert RecommendationCache(backend=SQLiteCacheBackend(path)).get("v1", "U1", 5, True) is None
+
+
+def test_worker_behind_on_ratings_cannot_overwrite_fresh_results(tmp_path):
+    path = str(tmp_path / "cache.db")
+    fresh = RecommendationCache(backend=SQLiteCacheBackend(path))
+    stale = RecommendationCache(backend=SQLiteCacheBackend(path))
+    # The stale worker has not synced the rating at t=1700 yet and stores what it computed without it
+    stale.put("v1", "U1", 5, True, (["B1"], [3.0]), revision=0)
+    assert fresh.get("v1", "U1", 5, True, revision=1700) is None
+    fresh.put("v1", "U1", 5, True, (["B2"], [4.0]), revision=1700)
+    assert stale.get("v1", "U1", 5, True, revision=1700) == (["B2"], [4.0])
+
+
+def test_clear_from_another_thread_runs_on_the_loop():
+    cache = RecommendationCache()
+
+    async def compute():
+        return (["B1"], [1.0])
+
+    async def run():
+        await cache.get_or_compute("v1", "U1", 5, False, compute)
+        worker = threading.Thread(target=cache.clear)
+        worker.start()
+        worker.join()
+        # Scheduled, not done behind the loop's back
+        assert len(cache) == 1
+        await asyncio.sleep(0)
+        assert len(cache) == 0
+
+    asyncio.run(run())
+
+
+def test_slow_backend_does_not_block_the_event_loop(tmp_path):
+    class SlowBackend(SQLiteCacheBackend):
+        def get(self, *args):
+            time.sleep(0.2)
+            return super().get(*args)
+
+    cache = RecommendationCache(backend=SlowBackend(str(tmp_path / "cache.db")))
+    ticks = []
+
+    async def compute():
+        return (["B1"], [1.0])
+
+    async def ticker():
+        for _ in range(10):
+            ticks.append(time.monotonic())
+            await asyncio.sleep(0.01)
+
+    async def run():
+        await asyncio.gather(cache.get_or_compute("v1", "U1", 5, False, compute), ticker())
+
+    asyncio.run(run())
+    # Ticks kept coming while the backend read was blocked in its thread
+    assert max(later - earlier for earlier, later in zip(ticks, ticks[1:])) < 0.15
+    cache._executor.shutdown(wait=True)
+    assert RecommendationCache(backend=SQLiteCacheBackend(str(tmp_path / "cache.db"))).get("v1", "U1", 5, False)
@@ -0,0 +1,60 @@
+import numpy as np
+import pytest
+
+from prediction_logging import MemorySink, TeeSink
+from rollups import LatencySketch, RollupSink, RollupStore
+
+
+def test_sketch_quantiles_within_relative_error_and_merge_exactly():
+    rng = np.random.default_rng(0)
+    latencies = rng.lognormal(mean=-5, sigma=1, size=20000)
+    whole, first, second = LatencySketch(), LatencySketch(), LatencySketch()
+    for i, value in enumerate(latencies):
+        whole.add(value)
+        (first if i % 2 else second).add(value)
+    merged = LatencySketch.from_dict(first.to_dict()).merge(second)
+    assert merged.buckets == whole.buckets
+    for q in (0.5, 0.95, 0.99):
+        exact = np.quantile(latencies, q, method='lower')
+        assert abs(merged.quantile(q) - exact) / exact <= 0.02
+
+
+def test_sink_rolls_up_minutes_and_hours(tmp_path):
+    store = RollupStore(str(tmp_path / "rollups.db"))
+    sink = TeeSink(MemorySink(), [RollupSink(store, clock=lambda: 7200)])
+    records = [{'user_id': 'U1', 'item_id': 'B1', 'predicted_rating': rating, 'timestamp': timestamp,
+                'latency': latency}
+               for timestamp, rating, latency in [(3600, 4.1, 0.01), (3610, 4.2, 0.02), (3670, 0.3, 0.03)]]
+    sink.write_batch(records[:2])
+    sink.write_batch(records[2:])
+    assert len(sink.primary.records) == 3
+
+    minutes = store.query('minute', 3600, 3720)
+    assert [(start, rollup.count) for start, rollup in minutes] == [(3600, 2), (3660, 1)]
+    hour = store.total('hour', 3600, 7200)
+    assert hour.count == 3
+    assert abs(hour.mean_latency - 0.02) < 1e-9
+    assert hour.rating_histogram() == {0.25: 1, 4.0: 2}
+    assert store.query('hour', 0, 3600) == []
+
+
+def test_secondary_failure_does_not_fail_the_batch():
+    class Broken(MemorySink):
+        def write_batch(self, records):
+            raise OSError("disk full")
+
+    sink = TeeSink(MemorySink(), [Broken()])
+    sink.write_batch([{'predicted_rating': 1.0}])
+    assert len(sink.primary.records) == 1 and sink.secondary_errors == 1
+
+
+def test_primary_failure_skips_the_secondaries():
+    class Broken(MemorySink):
+        def write_batch(self, records):
+            raise OSError("throttled")
+
+    secondary = MemorySink()
+    sink = TeeSink(Broken(), [secondary])
+    with pytest.raises(OSError):
+        sink.write_batch([{'predicted_rating': 1.0}])
+    assert secondary.records == []
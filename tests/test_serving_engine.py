@@ -0,0 +1,47 @@
+import numpy as np
+from scipy.sparse import random as sparse_random
+from sklearn.decomposition import TruncatedSVD
+
+from serving_engine import RecommenderEngine, top_k_indices
+
+
+def make_engine(n_users=60, n_items=40, n_components=8):
+    matrix = sparse_random(n_users, n_items, density=0.1, format='csr', random_state=0) * 5
+    svd = TruncatedSVD(n_components=n_components, random_state=42).fit(matrix)
+    user_ids = np.array([f"U{i:03d}" for i in range(n_users)], dtype=object)
+    item_ids = np.array([f"B{i:03d}" for i in range(n_items)], dtype=object)
+    return svd, matrix, RecommenderEngine.from_model(svd, matrix, user_ids, item_ids)
+
+
+def test_top_k_indices_matches_argsort():
+    scores = np.random.default_rng(0).normal(size=(4, 50))
+    expected = np.argsort(-scores, axis=1)[:, :5]
+    np.testing.assert_array_equal(top_k_indices(scores, 5), expected)
+
+
+def test_recommend_matches_dense_path():
+    svd, matrix, engine = make_engine()
+    row = 7
+    dense = np.dot(svd.transform(matrix[row].toarray()), svd.components_)[0]
+    expected = engine.item_ids[np.argsort(dense)[-5:][::-1]].tolist()
+    books, scores = engine.recommend("U007", k=5)
+    assert books == expected
+    assert scores == sorted(scores, reverse=True)
+
+
+def test_exclude_rated_drops_known_items():
+    _, matrix, engine = make_engine()
+    rated = set(engine.item_ids[matrix[3].indices].tolist())
+    books, _ = engine.recommend("U003", k=10, exclude_rated=True)
+    assert len(books) == 10
+    assert not rated.intersection(books)
+
+
+def test_unknown_user_raises_key_error():
+    _, _, engine = make_engine()
+    try:
+        engine.recommend("missing")
+    except KeyError:
+        pass
+    else:
+        raise AssertionError("expected KeyError")
@@ -0,0 +1,67 @@
+import importlib.util
+import linecache
+import numpy as np
+import pandas as pd
+from scipy.sparse import random as sparse_random
+
+from stage_cache import StageCache, path_fingerprint
+
+
+def test_round_trips_output_types(tmp_path):
+    outputs = {
+        "matrix": sparse_random(10, 8, density=0.3, format='csr', random_state=0),
+        "factors": np.arange(6, dtype=np.float32).reshape(2, 3),
+        "ids": np.asarray(["U1", "U2"], dtype=object),
+        "frame": pd.DataFrame({"user_id": ["U1", "U2"], "rating": [4.0, 5.0]}),
+        "seconds": 1.5
+    }
+    StageCache(str(tmp_path)).run('stage', lambda: outputs)
+    loaded = StageCache(str(tmp_path)).run('stage', lambda: 1 / 0)
+    assert (loaded["matrix"] != outputs["matrix"]).nnz == 0
+    np.testing.assert_array_equal(loaded["factors"], outputs["factors"])
+    assert loaded["ids"].tolist() == ["U1", "U2"]
+    pd.testing.assert_frame_equal(loaded["frame"], outputs["frame"])
+    assert loaded["seconds"] == 1.5
+
+
+def test_reruns_only_stages_whose_inputs_changed(tmp_path):
+    source = tmp_path / "ratings.txt"
+    source.write_text("1 2 3")
+    calls = []
+
+    def pipeline(n_components, force=()):
+        cache = StageCache(str(tmp_path / "cache"), force=force)
+        cache.run('load', lambda: calls.append('load') or {"x": np.ones(3)},
+                  inputs={"source": path_fingerprint(str(source))})
+        cache.run('fit', lambda: calls.append('fit') or {"k": n_components}, params={"k": n_components},
+                  depends=('load',))
+        return cache
+
+    pipeline(2)
+    cache = pipeline(2)
+    assert calls == ['load', 'fit']
+    assert cache.cached == {"load": True, "fit": True}
+
+    pipeline(3)
+    assert calls[2:] == ['fit']
+    pipeline(3, force=('load',))
+    assert calls[3:] == ['load']
+
+    source.write_text("1 2 3 4")
+    pipeline(3)
+    assert calls[4:] == ['load', 'fit']
+
+
+def test_editing_stage_code_invalidates_its_key(tmp_path):
+    module = tmp_path / "stage_code.py"
+    module.write_text("def transform(x):\n    return x + 1\n")
+    spec = importlib.util.spec_from_file_location("stage_code", module)
+    stage_code = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(stage_code)
+    cache = StageCache(str(tmp_path / "cache"))
+    before = cache.key('matrix', code=(stage_code,))
+    assert cache.key('matrix', code=(stage_code,)) == before
+
+    module.write_text("def transform(x):\n    return x + 2\n")
+    linecache.clearcache()
+    assert cache.key('matrix', code=(stage_code,)) != before
@@ -0,0 +1,43 @@
+import numpy as np
+from scipy.sparse import random as sparse_random
+
+from sweep import best_result, expand_spec, load_csr, prepare_split, run_sweep
+
+
+def make_matrix():
+    matrix = sparse_random(120, 40, density=0.15, format='csr', random_state=5)
+    matrix.data = np.ceil(matrix.data * 5)
+    return matrix
+
+
+def test_split_is_memory_mapped(tmp_path):
+    matrix = make_matrix()
+    split_dir = prepare_split(matrix, str(tmp_path))
+    train, test = load_csr(split_dir, 'train'), load_csr(split_dir, 'test')
+    assert not train.data.flags.owndata and not train.data.flags.writeable
+    assert train.shape[0] + test.shape[0] == matrix.shape[0]
+    assert train.nnz + test.nnz == matrix.nnz
+
+
+def test_expand_spec():
+    grid = expand_spec({"params": {"n_components": [2, 4], "n_iter": [3, 5, 7]}, "fixed": {"random_state": 0}})
+    assert len(grid) == 6
+    assert grid[0] == {"trainer": "svd", "random_state": 0, "n_components": 2, "n_iter": 3}
+
+    ranges = {"n_components": [4, 8], "regularization": {"low": 0.01, "high": 1.0, "log": True}}
+    trials = expand_spec({"search": "random", "trainer": "als", "n_trials": 5, "params": ranges})
+    assert len(trials) == 5
+    assert all(0.01 <= trial["regularization"] <= 1.0 and trial["n_components"] in (4, 8) for trial in trials)
+
+
+def test_parallel_sweep_matches_sequential(tmp_path):
+    split_dir = prepare_split(make_matrix(), str(tmp_path / "split"))
+    trials = expand_spec({"params": {"n_components": [2, 8]}, "fixed": {"random_state": 0}})
+    trials.append({"trainer": "unknown"})
+    sequential = run_sweep(split_dir, trials, str(tmp_path / "seq"), n_jobs=1)
+    parallel = run_sweep(split_dir, trials, str(tmp_path / "par"), n_jobs=2)
+    assert "error" in parallel[2]
+    for a, b in zip(sequential[:2], parallel[:2]):
+        assert np.isclose(a["metrics"]["test_rmse_observed"], b["metrics"]["test_rmse_observed"])
+    best = best_result(parallel, "test_rmse_observed")
+    assert best["metrics"]["test_rmse_observed"] == min(r["metrics"]["test_rmse_observed"] for r in parallel[:2])
@@ -0,0 +1,51 @@
+import numpy as np
+from scipy.sparse import csr_matrix, random as sparse_random
+
+from trainers import ALSRecommender, holdout_entries, make_trainer, solve_side
+
+
+def low_rank_ratings(n_users=120, n_items=80, rank=3, density=0.3, seed=0):
+    rng = np.random.default_rng(seed)
+    dense = rng.random((n_users, rank)) @ rng.random((rank, n_items))
+    mask = sparse_random(n_users, n_items, density=density, format='csr', random_state=seed)
+    mask.data[:] = 1
+    return csr_matrix(mask.multiply(dense + 1))
+
+
+def test_batched_solve_matches_per_user_normal_equations():
+    matrix = low_rank_ratings()
+    factors = np.random.default_rng(1).random((matrix.shape[1], 4)).astype(np.float32)
+    solved = solve_side(matrix, factors, regularization=0.1, n_threads=2, max_block_bytes=4096)
+    for user in (0, 17, 119):
+        cols = matrix[user].indices
+        Y = factors[cols].astype(np.float64)
+        A = Y.T @ Y + 0.1 * len(cols) * np.eye(4)
+        expected = np.linalg.solve(A, Y.T @ matrix[user].data)
+        np.testing.assert_allclose(solved[user], expected, rtol=1e-3, atol=1e-4)
+
+
+def test_explicit_als_fits_low_rank_data():
+    matrix = low_rank_ratings()
+    train, validation = holdout_entries(matrix, 0.1)
+    model = ALSRecommender(n_components=3, regularization=0.01, n_iter=20, validation_fraction=0).fit(
+        train, validation=validation)
+    assert model.components_.shape == (3, matrix.shape[1])
+    assert model.components_.dtype == np.float32
+    assert model.best_validation_rmse_ < 0.2
+
+
+def test_fold_in_matches_transform():
+    matrix = low_rank_ratings()
+    for name in ('als', 'als_implicit'):
+        model = make_trainer(name, n_components=4, n_iter=3)
+        model.fit(matrix)
+        row = matrix[5]
+        folded = model.fold_in(model.components_, row.indices, row.data)
+        np.testing.assert_allclose(folded, model.transform(row)[0], rtol=1e-3, atol=1e-5)
+
+
+def test_early_stopping_keeps_best_iteration():
+    matrix = low_rank_ratings()
+    model = ALSRecommender(n_components=8, regularization=0.0001, n_iter=30, patience=1, tol=0.5).fit(matrix)
+    assert model.n_iter_ < 30
+    assert model.best_validation_rmse_ == min(h['validation_rmse'] for h in model.history_)
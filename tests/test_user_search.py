@@ -0,0 +1,36 @@
+import numpy as np
+from scipy.sparse import identity
+
+from artifacts import load_bundle, save_bundle
+from user_search import UserIDIndex
+
+
+def test_prefix_pages_cover_every_match_once():
+    user_ids = [f"A{i:03d}" for i in range(250)] + ["B1", "AB", "A"]
+    index = UserIDIndex.from_ids(reversed(user_ids))
+    matches = sorted(u for u in user_ids if u.startswith("A0"))
+    seen, cursor = [], None
+    while True:
+        page, cursor = index.search("A0", limit=30, cursor=cursor)
+        assert len(page) <= 30
+        seen.extend(page)
+        if cursor is None:
+            break
+    assert seen == matches
+    assert index.search("Z")[0] == [] and index.search("Z")[1] is None
+
+
+def test_extra_ids_are_merged_in_order():
+    index = UserIDIndex.from_ids(["U1", "U3", "V1"])
+    assert index.search("U", extra=["U2", "X"]) == (["U1", "U2", "U3"], None)
+    assert index.search("U", limit=2, extra=["U2", "X"]) == (["U1", "U2"], "U2")
+    assert index.search("U", limit=2, cursor="U2", extra=["U2", "X"]) == (["U3"], None)
+
+
+def test_bundle_table_is_searched_in_place(tmp_path):
+    user_ids = [f"U{i:02d}" for i in range(12)]
+    path = save_bundle(str(tmp_path), np.ones((12, 2)), np.ones((2, 3)), identity(12, format='csr')[:, :3],
+                       user_ids, ["B0", "B1", "B2"], version="v1")
+    bundle = load_bundle(path)
+    assert bundle.manifest['files']['user_ids']['sorted']
+    assert UserIDIndex(bundle.user_ids).search("U1", limit=5) == (["U10", "U11"], None)
@@ -1,9 +1,7 @@
 import pandas as pd
 import numpy as np
-from scipy.sparse import csr_matrix, save_npz
-from sklearn.decomposition import TruncatedSVD
+from scipy.sparse import save_npz
 from sklearn.model_selection import train_test_split
-from sklearn.metrics import mean_squared_error
 import joblib
 import mlflow
 import mlflow.sklearn
@@ -13,8 +11,22 @@ import warnings
 import logging
 import boto3
 import traceback
-import json
-import jsonlines
+import time
+import argparse
+import ingest_jsonl
+import matrix_builder
+import trainers
+from ann_index import IVFIndex, recall_at_k
+from artifacts import latest_bundle_path, save_bundle, set_latest
+from batch_scoring import RecommendationStore, export_json, score_all
+from evaluation import evaluate
+from fold_in import append_folded_in, delta_paths, read_deltas
+from ingest_jsonl import ingest
+from item_neighbours import build_neighbours
+from matrix_builder import build_user_item_matrix, dedupe_latest
+from quantization import quantization_report, save_quantized
+from stage_cache import StageCache, path_fingerprint
+from trainers import bundle_metadata, make_trainer
 
 # Set up logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -24,85 +36,133 @@ logger = logging.getLogger(__name__)
 os.environ["MLFLOW_LOGGING_WARNINGS"] = "0"
 warnings.filterwarnings("ignore", category=UserWarning, module="mlflow.*")
 
-# Initialize S3 client for streaming fallback
-s3 = boto3.client('s3')
 bucket_name = 'my-book-recommender-2025-jtnusink'
 s3_file_key = 'data/Books.jsonl'
 local_file = 'books_5core_1M.parquet'
+local_jsonl = 'Books.jsonl'
+ingest_dir = 'books_parquet'
+ingest_workers = int(os.getenv('INGEST_WORKERS', str(os.cpu_count() or 1)))
+artifact_root = 'artifacts'
+eval_block_size = int(os.getenv('EVAL_BLOCK_SIZE', '512'))
+eval_jobs = int(os.getenv('EVAL_JOBS', '1'))
+recommend_k = int(os.getenv('RECOMMEND_K', '10'))
+recommend_jobs = int(os.getenv('RECOMMEND_JOBS', '1'))
+similar_k = int(os.getenv('SIMILAR_K', '20'))
+ann_lists = int(os.getenv('ANN_LISTS', '0')) or None
+ann_nprobe = int(os.getenv('ANN_NPROBE', '32'))
+stage_cache_dir = os.getenv('STAGE_CACHE_DIR', '.stage_cache')
+STAGES = ('ratings', 'matrix', 'split', 'fit')
 
+# Trainer selection: 'svd' (Model 18, TruncatedSVD), 'als' or 'als_implicit'
+trainer_name = os.getenv('TRAINER', 'svd')
+if trainer_name == 'svd':
+    trainer_params = {"n_components": int(os.getenv('N_COMPONENTS', '1000')), "n_iter": int(os.getenv('N_ITER', '10')),
+                      "random_state": 42}
+else:
+    trainer_params = {"n_components": int(os.getenv('N_COMPONENTS', '64')), "n_iter": int(os.getenv('N_ITER', '15')),
+                      "regularization": float(os.getenv('ALS_REGULARIZATION', '0.1')),
+                      "alpha": float(os.getenv('ALS_ALPHA', '40')), "random_state": 42}
 
-def process_chunk(chunk):
-    """Process a chunk of JSONL data for streaming fallback."""
-    user_ids = []
-    item_ids = []
-    ratings = []
-    timestamps = []
-    for line in chunk:
-        try:
-            data = eval(line)  # Adjust if JSONL format differs (e.g., json.loads if valid JSON)
-            user_id = data.get('user_id')
-            item_id = data.get('parent_asin')  # Match your column name
-            rating = data.get('rating')
-            timestamp = data.get('timestamp')
-            if user_id and item_id and rating and timestamp and rating >= 2:
-                user_ids.append(user_id)
-                item_ids.append(item_id)
-                ratings.append(rating)
-                timestamps.append(timestamp)
-        except Exception as e:
-            logger.warning(f"Skipping invalid line: {e}")
-    return user_ids, item_ids, ratings, timestamps
-
-
-try:
-    # Load data (prefer local parquet, fallback to S3 streaming)
+
+def load_ratings():
+    """Load the ratings (local parquet, else ingest the JSONL dump) and keep the latest per user-item pair."""
     if os.path.exists(local_file):
         logger.info("Loading data from local parquet file...")
         df = pd.read_parquet(local_file)
     else:
-        logger.info("Local parquet not found, streaming from S3...")
-        user_ids_all = []
-        item_ids_all = []
-        ratings_all = []
-        timestamps_all = []
-        response = s3.get_object(Bucket=bucket_name, Key=s3_file_key)
-        with jsonlines.Reader(response['Body']) as reader:
-            for obj in reader:
-                user_ids, item_ids, ratings, timestamps = process_chunk([obj])
-                user_ids_all.extend(user_ids)
-                item_ids_all.extend(item_ids)
-                ratings_all.extend(ratings)
-                timestamps_all.extend(timestamps)
-        df = pd.DataFrame({
-            'user_id': user_ids_all,
-            'parent_asin': item_ids_all,
-            'rating': ratings_all,
-            'timestamp': timestamps_all
-        })
+        # Parse the JSONL dump (local copy if present, else ranged reads from S3) into Parquet partitions
+        source = local_jsonl if os.path.exists(local_jsonl) else f's3://{bucket_name}/{s3_file_key}'
+        logger.info(f"Local parquet not found, ingesting {source}...")
+        ingest(source, ingest_dir, workers=ingest_workers)
+        df = pd.read_parquet(ingest_dir)
+    df = df[['user_id', 'parent_asin', 'rating', 'timestamp']]
+
+    # Ratings folded in by the serving workers since the last bundle; the latest rating per pair still wins
+    served_bundle = latest_bundle_path(artifact_root)
+    folded_in = read_deltas(served_bundle) if served_bundle else []
+    if folded_in:
+        logger.info(f"Adding {len(folded_in)} folded-in ratings from {served_bundle}")
+        df = append_folded_in(df, folded_in)
 
     # Verify aggregation method
     logger.info("Using most recent rating aggregation (un-normalized, threshold 2, 1M dataset)")
 
     # Ensure ratings are un-normalized (1-5)
     if df['rating'].max() <= 1.0:
-        df['rating'] = df['rating'] * 5
+        df = df.assign(rating=df['rating'] * 5)
     logger.info(f"Rating range: {df['rating'].min()} - {df['rating'].max()}")
+    return {"ratings": dedupe_latest(df)}
+
+
+def source_fingerprint():
+    if os.path.exists(local_file):
+        return path_fingerprint(local_file)
+    if os.path.exists(local_jsonl):
+        return path_fingerprint(local_jsonl)
+    return {'path': f's3://{bucket_name}/{s3_file_key}'}
+
+
+def fold_in_fingerprint():
+    served_bundle = latest_bundle_path(artifact_root)
+    return [path_fingerprint(path) for path in delta_paths(served_bundle)] if served_bundle else []
+
+
+def build_matrix(ratings):
+    # Create user-item matrix (no normalization) from int codes; pairs are already deduped
+    sparse_matrix, user_ids, item_ids = build_user_item_matrix(ratings, time_col=None)
+    logger.info(f"Built {sparse_matrix.shape[0]}x{sparse_matrix.shape[1]} matrix with {sparse_matrix.nnz} ratings")
+    return {"matrix": sparse_matrix, "user_ids": user_ids, "item_ids": item_ids}
+
+
+def split_matrix(sparse_matrix):
+    train_matrix, test_matrix = train_test_split(sparse_matrix, test_size=0.2, random_state=42)
+    return {"train": train_matrix, "test": test_matrix}
+
+
+def fit_model(train_matrix):
+    # Train the selected model (default: SVD, Model 18 configuration)
+    model = make_trainer(trainer_name, **trainer_params)
+    fit_start = time.time()
+    user_factors = model.fit_transform(train_matrix)
+    fit_seconds = time.time() - fit_start
+    logger.info(f"Fitted {trainer_name} in {fit_seconds:.1f}s")
+    return {"model": model, "user_factors": user_factors, "fit_seconds": fit_seconds}
 
-    # Aggregate duplicate user_id/parent_asin pairs by most recent rating
-    df = df.sort_values('timestamp').groupby(['user_id', 'parent_asin'])[['rating', 'timestamp']].last().reset_index()
 
-    # Create user-item matrix (no normalization)
-    user_item_matrix = df.pivot(index='user_id', columns='parent_asin', values='rating').fillna(0)
-    sparse_matrix = csr_matrix(user_item_matrix.values)
+def run_stages(cache):
+    """Run the cacheable stages: deduped ratings, CSR + ID tables, train/test split and fitted factors."""
+    # `code` names what each stage runs, so editing e.g. dedupe_latest invalidates the cached ratings
+    ratings = cache.run('ratings', load_ratings, params={"aggregation": "most_recent"},
+                        inputs={"source": source_fingerprint(), "fold_in": fold_in_fingerprint()},
+                        code=(load_ratings, matrix_builder, ingest_jsonl, read_deltas, append_folded_in))['ratings']
+    built = cache.run('matrix', lambda: build_matrix(ratings), depends=('ratings',),
+                      code=(build_matrix, matrix_builder))
+    split = cache.run('split', lambda: split_matrix(built['matrix']), params={"test_size": 0.2, "random_state": 42},
+                      depends=('matrix',), code=(split_matrix,))
+    fitted = cache.run('fit', lambda: fit_model(split['train']),
+                       params={"trainer": trainer_name, **trainer_params}, depends=('split',),
+                       code=(fit_model, trainers))
+    return built, split, fitted
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the recommender, reusing cached stage outputs")
+    parser.add_argument('--force-stage', action='append', default=[], choices=STAGES + ('all',),
+                        help="Recompute this stage even if its inputs are unchanged (repeatable)")
+    parser.add_argument('--cache-dir', default=stage_cache_dir)
+    args = parser.parse_args()
+    cache = StageCache(args.cache_dir, force=args.force_stage)
+
+    built, split, fitted = run_stages(cache)
+    sparse_matrix, user_ids, item_ids = built['matrix'], built['user_ids'], built['item_ids']
+    train_matrix, test_matrix = split['train'], split['test']
+    svd, user_factors, fit_seconds = fitted['model'], fitted['user_factors'], fitted['fit_seconds']
+    n_users, n_items = sparse_matrix.shape
 
     # Save sparse matrix and indices
     save_npz('user_item_matrix.npz', sparse_matrix)
-    user_ids = user_item_matrix.index.values
     np.save('user_item_indices.npy', user_ids)
-    np.save('user_item_columns.npy', user_item_matrix.columns.values)
-
-    # Split into train/test
-    train_matrix, test_matrix = train_test_split(sparse_matrix, test_size=0.2, random_state=42)
+    np.save('user_item_columns.npy', item_ids)
 
     # Set experiment
     mlflow.set_experiment("book_recommender")
@@ -110,78 +170,106 @@ try:
     with mlflow.start_run():
         # Parameters
         params = {
-            "n_components": 1000,
-            "sample_size": len(df),
-            "n_users": user_item_matrix.shape[0],
-            "n_items": user_item_matrix.shape[1],
-            "sparsity": 1 - (len(df) / (user_item_matrix.shape[0] * user_item_matrix.shape[1])),
+            "trainer": trainer_name,
+            "n_components": trainer_params["n_components"],
+            "sample_size": sparse_matrix.nnz,
+            "n_users": n_users,
+            "n_items": n_items,
+            "sparsity": 1 - (sparse_matrix.nnz / (n_users * n_items)),
             "data_version": "books_5core_1M",
-            "n_iter": 10,
+            "n_iter": trainer_params["n_iter"],
             "aggregation": "most_recent",
             "normalized": False,
             "precision_threshold": 2
         }
-        mlflow.log_params(params)
-
-        # Train SVD (Model 18 configuration)
-        svd = TruncatedSVD(n_components=1000, random_state=42, n_iter=10)
-        user_factors = svd.fit_transform(train_matrix)
+        if trainer_name != 'svd':
+            params.update({"regularization": trainer_params["regularization"], "alpha": trainer_params["alpha"]})
+        mlflow.log_params({**params, **cache.mlflow_params()})
 
         # Save model locally
         save_path = 'model.pkl'
         joblib.dump(svd, save_path)
 
-        # Metrics
-        predicted_ratings = np.dot(user_factors, svd.components_)
-        train_rmse = np.sqrt(mean_squared_error(train_matrix.toarray(), predicted_ratings))
-        test_user_factors = svd.transform(test_matrix)
-        test_predicted_ratings = np.dot(test_user_factors, svd.components_)
-        test_rmse = np.sqrt(mean_squared_error(test_matrix.toarray(), test_predicted_ratings))
-
-        def precision_at_k(actual, predicted, k=5):
-            precisions = []
-            for user_idx in range(actual.shape[0]):
-                top_k_items = np.argsort(predicted[user_idx])[-k:]
-                actual_ratings = actual[user_idx, top_k_items].toarray().flatten()
-                precision = np.sum(actual_ratings >= 2) / k
-                precisions.append(precision)
-            return np.mean(precisions) if precisions else 0.0
-
-        train_precision = precision_at_k(train_matrix, predicted_ratings)
-        test_precision = precision_at_k(test_matrix, test_predicted_ratings)
+        # Save versioned, memory-mappable artifact bundle for serving
+        with cache.timed('bundle'):
+            all_user_factors = svd.transform(sparse_matrix)
+            bundle_path = save_bundle(
+                artifact_root, all_user_factors, svd.components_, sparse_matrix, user_ids, item_ids,
+                extra={**bundle_metadata(svd), "mlflow_run_id": mlflow.active_run().info.run_id}, publish=False
+            )
+
+        # Item-to-item neighbour table for /similar, next to the bundle arrays
+        with cache.timed('neighbours'):
+            build_neighbours(svd.components_, bundle_path, k=similar_k, n_jobs=recommend_jobs,
+                             version=os.path.basename(bundle_path))
+
+        # IVF index for optional ANN retrieval, with its recall@10 against exact search at the serving nprobe
+        with cache.timed('ann_index'):
+            ann_index = IVFIndex.build(svd.components_, n_lists=ann_lists, version=os.path.basename(bundle_path))
+            ann_index.save(bundle_path)
+            ann_check = recall_at_k(ann_index, all_user_factors, svd.components_, k=10, nprobe=ann_nprobe)
+        logger.info(f"ANN recall@10 {ann_check['recall']:.3f} at nprobe={ann_nprobe} "
+                    f"({ann_check['latency_ms']:.2f} ms/query)")
+
+        # Metrics (blocked over users, RMSE over observed ratings plus the dense all-cells reference)
+        eval_params = {"k": 5, "threshold": 2, "block_size": eval_block_size, "n_jobs": eval_jobs,
+                       "dense_reference": True}
+        with cache.timed('evaluate'):
+            train_metrics = evaluate(user_factors, svd.components_, train_matrix, **eval_params)
+            test_user_factors = svd.transform(test_matrix)
+            test_metrics = evaluate(test_user_factors, svd.components_, test_matrix, **eval_params)
+        train_rmse, test_rmse = train_metrics["rmse_dense"], test_metrics["rmse_dense"]
+        train_precision, test_precision = train_metrics["precision_at_5"], test_metrics["precision_at_5"]
+
+        # Quantized item factors for low-memory serving, with their memory and accuracy cost on the test users
+        with cache.timed('quantization'):
+            save_quantized(bundle_path, svd.components_, version=os.path.basename(bundle_path))
+            quant_report = quantization_report(test_user_factors, svd.components_, test_matrix)
 
         mlflow.log_metrics({
             "train_rmse": float(train_rmse),
             "test_rmse": float(test_rmse),
             "train_precision_5": float(train_precision),
-            "test_precision_5": float(test_precision)
+            "test_precision_5": float(test_precision),
+            "train_rmse_observed": train_metrics["rmse"],
+            "test_rmse_observed": test_metrics["rmse"],
+            "train_recall_5": train_metrics["recall_at_5"],
+            "test_recall_5": test_metrics["recall_at_5"],
+            "train_ndcg_5": train_metrics["ndcg_at_5"],
+            "test_ndcg_5": test_metrics["ndcg_at_5"],
+            "fit_seconds": fit_seconds,
+            "item_factor_mb": svd.components_.nbytes / 2 ** 20,
+            "ann_recall_10": ann_check["recall"],
+            "ann_latency_ms": ann_check["latency_ms"]
         })
+        mlflow.log_metrics({f"quant_{mode}_{name}": value for mode, values in quant_report.items()
+                            for name, value in values.items()})
+        if hasattr(svd, "best_validation_rmse_"):
+            mlflow.log_metrics({"validation_rmse": svd.best_validation_rmse_, "als_iterations": svd.n_iter_})
 
         # Log model with signature
-        input_example = user_item_matrix.iloc[[0]].values
-        signature = infer_signature(input_example, predicted_ratings[0])
+        input_example = sparse_matrix[[0]].toarray()
+        signature = infer_signature(input_example, np.dot(user_factors[:1], svd.components_)[0])
         mlflow.sklearn.log_model(svd, "svd_model", signature=signature)
         mlflow.log_artifact('user_item_matrix.npz')
         mlflow.log_artifact('user_item_indices.npy')
         mlflow.log_artifact('user_item_columns.npy')
 
-        # Register model
+        # Precompute top-k for all users into the bundle (blocked matmul + argpartition), export the top 5 as JSON
+        logger.info("Generating recommendations for all users")
+        with cache.timed('recommendations'):
+            score_all(all_user_factors, svd.components_, bundle_path, rated=sparse_matrix, k=recommend_k,
+                      n_jobs=recommend_jobs, version=os.path.basename(bundle_path))
+            export_json(RecommendationStore.load(bundle_path), user_ids, item_ids, 'all_recommendations.json')
+        # Publish only now that every side artifact exists; running servers hot-swap to it on their next poll.
+        # Registry-backed servers download artifact_bundle of the newest registered version, so upload the
+        # complete bundle before registering it
+        set_latest(artifact_root, os.path.basename(bundle_path))
+        mlflow.log_artifacts(bundle_path, artifact_path='artifact_bundle')
         model_uri = f"runs:/{mlflow.active_run().info.run_id}/svd_model"
         mlflow.register_model(model_uri, "BookRecommenderModel")
-
-        # Generate recommendations for all users
-        logger.info("Generating recommendations for all users")
-        all_user_factors = svd.transform(sparse_matrix)
-        all_predicted_ratings = np.dot(all_user_factors, svd.components_)
-        all_recommendations = {}
-        for idx, user_id in enumerate(user_ids):
-            top_items = user_item_matrix.columns[np.argsort(all_predicted_ratings[idx])[-5:]].tolist()
-            all_recommendations[user_id] = top_items
-
-        # Save all recommendations
-        with open('all_recommendations.json', 'w') as f:
-            json.dump(all_recommendations, f, indent=4)
         mlflow.log_artifact('all_recommendations.json')
+        mlflow.log_metrics(cache.mlflow_metrics())
 
         # Upload to S3 with logging
         if os.path.exists(save_path):
@@ -199,6 +287,10 @@ try:
                 ]:
                     s3.upload_file(file, bucket_name, f'data/{file}')
                     logger.info(f"Uploaded {file} to s3://{bucket_name}/data/{file}")
+                for file in sorted(os.listdir(bundle_path)):
+                    key = f'data/{artifact_root}/{os.path.basename(bundle_path)}/{file}'
+                    s3.upload_file(os.path.join(bundle_path, file), bucket_name, key)
+                    logger.info(f"Uploaded {file} to s3://{bucket_name}/{key}")
             except Exception as e:
                 logger.error(f"S3 upload failed: {e}")
                 traceback.print_exc()
@@ -207,8 +299,13 @@ try:
 
         logger.info(f"Train RMSE: {train_rmse:.4f}, Test RMSE: {test_rmse:.4f}")
         logger.info(f"Train Precision@5: {train_precision:.4f}, Test Precision@5: {test_precision:.4f}")
+        logger.info(f"Observed-entry RMSE: train {train_metrics['rmse']:.4f}, test {test_metrics['rmse']:.4f}")
+
 
-except Exception as e:
-    logger.error(f"Error in training process: {e}")
-    traceback.print_exc()
-    raise
+if __name__ == '__main__':
+    try:
+        main()
+    except Exception as e:
+        logger.error(f"Error in training process: {e}")
+        traceback.print_exc()
+        raise
@@ -0,0 +1,272 @@
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from scipy.sparse import csr_matrix
+from sklearn.base import BaseEstimator, TransformerMixin
+from sklearn.decomposition import TruncatedSVD
+
+logger = logging.getLogger(__name__)
+
+
+def row_blocks(indptr, n_factors, max_block_bytes, max_rows=4096):
+    """Split CSR rows into blocks whose batched normal equations fit in max_block_bytes."""
+    per_matrix = n_factors * n_factors * 4
+    blocks = []
+    start = 0
+    n_rows = len(indptr) - 1
+    while start < n_rows:
+        end = start + 1
+        while end < n_rows and end - start < max_rows:
+            cost = ((end + 1 - start) + (indptr[end + 1] - indptr[start])) * per_matrix
+            if cost > max_block_bytes:
+                break
+            end += 1
+        blocks.append((start, end))
+        start = end
+    return blocks
+
+
+def conjugate_gradient(lhs, rhs, initial, steps):
+    """A few batched conjugate-gradient steps on lhs x = rhs, warm-started from initial."""
+    x = initial.astype(np.float32, copy=True)
+    residual = rhs - np.matmul(lhs, x[..., None])[..., 0]
+    direction = residual.copy()
+    rs = np.einsum('ij,ij->i', residual, residual)
+    for _ in range(steps):
+        lhs_direction = np.matmul(lhs, direction[..., None])[..., 0]
+        step = rs / np.maximum(np.einsum('ij,ij->i', direction, lhs_direction), 1e-20)
+        x += step[:, None] * direction
+        residual -= step[:, None] * lhs_direction
+        rs_new = np.einsum('ij,ij->i', residual, residual)
+        direction = residual + (rs_new / np.maximum(rs, 1e-20))[:, None] * direction
+        rs = rs_new
+    return x
+
+
+def solve_block(matrix, factors, start, end, regularization, implicit, alpha, gram=None, initial=None,
+                cg_steps=3):
+    """Least-squares factors for rows [start, end) of matrix given the other side's factors.
+
+    Explicit: minimise squared error over observed ratings with ALS-WR
+    regularisation (lambda * n_ratings). Implicit: Hu/Koren/Volinsky with
+    confidence 1 + alpha * rating and preference 1, using the full gram matrix.
+    All rows of the block are solved as one batched ``np.linalg.solve``, or
+    with ``cg_steps`` of batched conjugate gradient when ``initial`` factors
+    are given to warm-start from.
+    """
+    n_factors = factors.shape[1]
+    indptr = matrix.indptr[start:end + 1]
+    lo, hi = indptr[0], indptr[-1]
+    n_block = end - start
+    counts = np.diff(indptr)
+    gathered = factors[matrix.indices[lo:hi]]
+    values = matrix.data[lo:hi].astype(np.float32)
+    if implicit:
+        lhs_weights, rhs_weights = alpha * values, 1.0 + alpha * values
+    else:
+        lhs_weights, rhs_weights = np.ones_like(values), values
+
+    identity = np.eye(n_factors, dtype=np.float32)
+    if implicit:
+        lhs = np.broadcast_to(gram + regularization * identity, (n_block, n_factors, n_factors)).copy()
+    else:
+        lhs = regularization * np.maximum(counts, 1)[:, None, None].astype(np.float32) * identity
+    if hi > lo:
+        # Per-row weighted sums of y y^T and y as sparse segment matrices times the stacked factors
+        positions = np.arange(hi - lo)
+        segment_indptr = indptr - lo
+        lhs_segments = csr_matrix((lhs_weights, positions, segment_indptr), shape=(n_block, hi - lo))
+        rhs_segments = csr_matrix((rhs_weights, positions, segment_indptr), shape=(n_block, hi - lo))
+        outer = np.einsum('ni,nj->nij', gathered, gathered).reshape(hi - lo, -1)
+        lhs += (lhs_segments @ outer).reshape(n_block, n_factors, n_factors)
+        rhs = rhs_segments @ gathered
+    else:
+        rhs = np.zeros((n_block, n_factors), dtype=np.float32)
+    if initial is not None:
+        return conjugate_gradient(lhs, rhs, initial, cg_steps)
+    return np.linalg.solve(lhs, rhs[..., None])[..., 0]
+
+
+def solve_side(matrix, factors, regularization, implicit=False, alpha=40.0, n_threads=1,
+               max_block_bytes=128 << 20, initial=None, cg_steps=3):
+    """Solve every row of a CSR matrix against fixed factors, block by block across a thread pool.
+
+    With ``initial`` (the previous iteration's factors for these rows) each
+    block takes ``cg_steps`` conjugate-gradient steps instead of an exact solve.
+    """
+    factors = np.ascontiguousarray(factors, dtype=np.float32)
+    gram = factors.T @ factors if implicit else None
+    blocks = row_blocks(matrix.indptr, factors.shape[1], max_block_bytes)
+    out = np.zeros((matrix.shape[0], factors.shape[1]), dtype=np.float32)
+
+    def run(bounds):
+        start, end = bounds
+        warm = initial[start:end] if initial is not None else None
+        out[start:end] = solve_block(matrix, factors, start, end, regularization, implicit, alpha, gram,
+                                     initial=warm, cg_steps=cg_steps)
+
+    if n_threads > 1 and len(blocks) > 1:
+        with ThreadPoolExecutor(max_workers=n_threads) as pool:
+            list(pool.map(run, blocks))
+    else:
+        for bounds in blocks:
+            run(bounds)
+    return out
+
+
+def observed_rmse(user_factors, item_factors, matrix):
+    """RMSE of user_factors @ item_factors.T over the stored entries of matrix."""
+    if matrix.nnz == 0:
+        return 0.0
+    rows = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    predicted = np.einsum('ij,ij->i', user_factors[rows], item_factors[matrix.indices])
+    return float(np.sqrt(np.mean((predicted - matrix.data) ** 2)))
+
+
+def holdout_entries(matrix, fraction, random_state=42):
+    """Split the stored entries of a CSR matrix into train and validation matrices of the same shape."""
+    coo = matrix.tocoo()
+    rng = np.random.default_rng(random_state)
+    held = rng.random(coo.nnz) < fraction
+    shape = matrix.shape
+    train = csr_matrix((coo.data[~held], (coo.row[~held], coo.col[~held])), shape=shape)
+    validation = csr_matrix((coo.data[held], (coo.row[held], coo.col[held])), shape=shape)
+    return train, validation
+
+
+class ALSRecommender(BaseEstimator, TransformerMixin):
+    """Alternating least squares on the sparse rating matrix, with float32 factors.
+
+    Unlike TruncatedSVD on the zero-filled matrix, missing ratings are not
+    treated as zeros (explicit mode) or are treated as low-confidence
+    negatives (``implicit=True``). Exposes ``components_`` (factors x items)
+    and ``transform`` like TruncatedSVD so the rest of the pipeline and the
+    serving engine can use it unchanged. A ``validation_fraction`` of the
+    training ratings is held out for early stopping on validation RMSE. With
+    ``solver='cg'`` every sweep after the first takes a few warm-started
+    conjugate-gradient steps per row instead of an exact solve.
+    """
+
+    def __init__(self, n_components=64, regularization=0.1, n_iter=15, implicit=False, alpha=40.0,
+                 validation_fraction=0.1, tol=1e-4, patience=2, solver='cg', cg_steps=3, n_threads=None,
+                 max_block_bytes=128 << 20, random_state=42):
+        self.n_components = n_components
+        self.regularization = regularization
+        self.n_iter = n_iter
+        self.implicit = implicit
+        self.alpha = alpha
+        self.validation_fraction = validation_fraction
+        self.tol = tol
+        self.patience = patience
+        self.solver = solver
+        self.cg_steps = cg_steps
+        self.n_threads = n_threads
+        self.max_block_bytes = max_block_bytes
+        self.random_state = random_state
+
+    def _threads(self):
+        return self.n_threads or os.cpu_count() or 1
+
+    def _solve(self, matrix, factors, initial=None):
+        if self.solver != 'cg':
+            initial = None
+        return solve_side(matrix, factors, self.regularization, implicit=self.implicit, alpha=self.alpha,
+                          n_threads=self._threads(), max_block_bytes=self.max_block_bytes, initial=initial,
+                          cg_steps=self.cg_steps)
+
+    def _validation_rmse(self, user_factors, item_factors, validation):
+        if self.implicit:
+            validation = validation.copy()
+            validation.data = np.ones_like(validation.data)
+        return observed_rmse(user_factors, item_factors, validation)
+
+    def fit(self, X, y=None, validation=None):
+        X = csr_matrix(X, dtype=np.float32)
+        if validation is None and self.validation_fraction:
+            X, validation = holdout_entries(X, self.validation_fraction, self.random_state)
+        X_items = X.T.tocsr()
+        rng = np.random.default_rng(self.random_state)
+        item_factors = (rng.standard_normal((X.shape[1], self.n_components)) * 0.01).astype(np.float32)
+        user_factors = np.zeros((X.shape[0], self.n_components), dtype=np.float32)
+        best = (np.inf, user_factors, item_factors)
+        stalled = 0
+        self.history_ = []
+        for iteration in range(self.n_iter):
+            start = time.time()
+            # The first sweep solves exactly; later sweeps warm-start CG from the previous factors
+            user_factors = self._solve(X, item_factors, initial=user_factors if iteration else None)
+            item_factors = self._solve(X_items, user_factors, initial=item_factors if iteration else None)
+            entry = {'iteration': iteration + 1, 'seconds': time.time() - start}
+            if validation is not None and validation.nnz:
+                entry['validation_rmse'] = self._validation_rmse(user_factors, item_factors, validation)
+            self.history_.append(entry)
+            logger.info(f"ALS iteration {iteration + 1}: {entry}")
+            if 'validation_rmse' not in entry:
+                best = (np.inf, user_factors, item_factors)
+                continue
+            improved = entry['validation_rmse'] < best[0] - self.tol
+            if entry['validation_rmse'] < best[0]:
+                best = (entry['validation_rmse'], user_factors, item_factors)
+            if improved:
+                stalled = 0
+            else:
+                stalled += 1
+                if stalled >= self.patience:
+                    logger.info(f"Early stopping after {iteration + 1} iterations")
+                    break
+        self.best_validation_rmse_ = best[0]
+        self.user_factors_ = best[1]
+        self.components_ = np.ascontiguousarray(best[2].T)
+        self.n_iter_ = len(self.history_)
+        return self
+
+    def fit_transform(self, X, y=None, **fit_params):
+        # Users are re-solved against the final item factors, including held-out ratings
+        return self.fit(X, **fit_params).transform(X)
+
+    def transform(self, X):
+        return self._solve(csr_matrix(X, dtype=np.float32), self.components_.T)
+
+    def fold_in(self, item_factors, cols, values):
+        """Factors for one user's rating row; ``item_factors`` is factors x items as served."""
+        row = csr_matrix((np.asarray(values, dtype=np.float32), np.asarray(cols), [0, len(cols)]),
+                         shape=(1, item_factors.shape[1]))
+        gram = None
+        if self.implicit:
+            cache = getattr(self, '_gram_cache', None)
+            if cache is None or cache[0] is not item_factors:
+                self._gram_cache = (item_factors, item_factors @ item_factors.T)
+            gram = self._gram_cache[1]
+        return solve_block(row, np.ascontiguousarray(item_factors.T), 0, 1, self.regularization, self.implicit,
+                           self.alpha, gram)[0]
+
+
+def make_trainer(name, **params):
+    """Build a trainer by name: 'svd' (TruncatedSVD), 'als' or 'als_implicit'."""
+    if name == 'svd':
+        return TruncatedSVD(**params)
+    if name == 'als':
+        return ALSRecommender(implicit=False, **params)
+    if name == 'als_implicit':
+        return ALSRecommender(implicit=True, **params)
+    raise ValueError(f"Unknown trainer: {name}")
+
+
+def bundle_metadata(model):
+    """Manifest fields the serving side needs to fold new ratings in the way this model was fit."""
+    if isinstance(model, ALSRecommender):
+        return {'model_type': 'als', 'als_regularization': model.regularization, 'als_implicit': model.implicit,
+                'als_alpha': model.alpha}
+    return {'model_type': 'truncated_svd'}
+
+
+def projector_from_manifest(manifest):
+    """Fold-in function for an artifact manifest, or None for plain SVD projection."""
+    if manifest.get('model_type') != 'als':
+        return None
+    model = ALSRecommender(regularization=manifest['als_regularization'], implicit=manifest['als_implicit'],
+                           alpha=manifest['als_alpha'])
+    return model.fold_in
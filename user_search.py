@@ -0,0 +1,62 @@
+import heapq
+import logging
+from bisect import bisect_left, bisect_right
+from itertools import islice
+
+from artifacts import StringTable
+
+logger = logging.getLogger(__name__)
+
+
+class UserIDIndex:
+    """Sorted user IDs for prefix search and cursor paging, searched with bisect.
+
+    The IDs live in a StringTable (UTF-8 bytes plus offsets), which is the
+    bundle's own memory-mapped table when the bundle recorded its IDs as
+    sorted; UTF-8 byte order matches Python's string order, so bisect works
+    on it directly. Each probe decodes one ID, so a page costs
+    O(log n + limit) however many users there are.
+    """
+
+    def __init__(self, table):
+        self.table = table
+        self._extra = []
+        self._extra_source = 0
+
+    @classmethod
+    def from_ids(cls, user_ids):
+        return cls(StringTable.from_strings(sorted(str(user_id) for user_id in user_ids)))
+
+    def __len__(self):
+        return len(self.table)
+
+    def search(self, prefix='', limit=20, cursor=None, extra=()):
+        """Up to limit IDs starting with prefix and sorting after cursor, plus the cursor of the next page.
+
+        ``extra`` is an append-only list of IDs outside the table (users
+        folded in since the bundle was built); they are merged in order.
+        """
+        if len(extra) != self._extra_source:
+            self._extra = sorted(extra)
+            self._extra_source = len(extra)
+        table_ids = _with_prefix(self.table, _start(self.table, prefix, cursor), prefix)
+        extra_ids = _with_prefix(self._extra, _start(self._extra, prefix, cursor), prefix)
+        # One more than asked for tells whether another page exists
+        page = list(islice(heapq.merge(table_ids, extra_ids), limit + 1))
+        next_cursor = page[limit - 1] if len(page) > limit else None
+        return page[:limit], next_cursor
+
+
+def _start(ids, prefix, cursor):
+    """Position of the first ID that starts the page: after the cursor, or at the prefix."""
+    if cursor is not None and cursor >= prefix:
+        return bisect_right(ids, cursor)
+    return bisect_left(ids, prefix)
+
+
+def _with_prefix(ids, start, prefix):
+    for i in range(start, len(ids)):
+        user_id = ids[i]
+        if not user_id.startswith(prefix):
+            return
+        yield user_id